@@ -1,11 +1,14 @@
 from django.contrib import admin, messages
 from django.db.models import Count
+from django.utils.timesince import timesince
 
 from fediverser.apps.lemmy.services import LemmyClientRateLimited
 
 from . import tasks
 from .models.accounts import RedditAccountAuthorizedScope, UserAccount
 from .models.activitypub import Community, Instance
+from .models.archive import RedditArchive
+from .models.common import DomainHealth
 from .models.feeds import CommunityFeed, Entry, Feed
 from .models.invites import InviteTemplate, RedditorInvite
 from .models.mapping import (
@@ -21,9 +24,11 @@ from .models.mapping import (
 from .models.mirroring import LemmyMirroredComment, LemmyMirroredPost, RedditMirrorStrategy
 from .models.network import (
     ChangeFeedEntry,
+    ChangeFeedRecord,
     FediversedInstance,
     RedditToCommunityRecommendationEntry,
 )
+from .models.push import ChangeFeedSubscription, subscribe_to_partner
 from .models.reddit import (
     RedditAccount,
     RedditApplicationKey,
@@ -33,6 +38,7 @@ from .models.reddit import (
     RejectedPost,
 )
 from .settings import app_settings
+from .snapshots import bootstrap_from_partner
 
 
 class ReadOnlyMixin:
@@ -92,6 +98,12 @@ class UserAccountAdmin(admin.ModelAdmin):
         return False
 
 
+@admin.register(RedditArchive)
+class RedditArchiveAdmin(ReadOnlyMixin, admin.ModelAdmin):
+    date_hierarchy = "created"
+    list_display = ("path", "cutoff", "submission_count", "comment_count")
+
+
 @admin.register(RedditAccountAuthorizedScope)
 class RedditAccountAuthorizedScopesAdmin(admin.ModelAdmin):
     list_display = ("username", "scope")
@@ -105,7 +117,7 @@ class RedditAccountAuthorizedScopesAdmin(admin.ModelAdmin):
 @admin.register(Feed)
 class FeedAdmin(admin.ModelAdmin):
     date_hierarchy = "last_fetched"
-    list_display = ("url", "title", "last_fetched")
+    list_display = ("url", "title", "last_fetched", "next_fetch_at")
 
     actions = ("fetch_feeds",)
 
@@ -140,7 +152,7 @@ class ChangeFeedEntryAdmin(admin.ModelAdmin):
     @admin.action(description="Merge selected entries into our database")
     def merge_entries(self, request, queryset):
         good = 0
-        for entry in queryset:
+        for entry in self._get_subclassed_qs(queryset):
             try:
                 entry.merge()
                 good += 1
@@ -149,12 +161,20 @@ class ChangeFeedEntryAdmin(admin.ModelAdmin):
         if good:
             messages.success(request, f"Merged {good} entries")
 
+    @admin.display(description="description")
+    def description(self, obj):
+        # Reads the stored record, instead of joining all entry tables
+        try:
+            return obj.record.description
+        except ChangeFeedRecord.DoesNotExist:
+            return obj.description
+
     def _get_subclassed_qs(self, qs):
         return qs.select_subclasses()
 
     def get_queryset(self, *args, **kw):
-        qs = self._get_subclassed_qs(super().get_queryset(*args, **kw))
-        return qs.prefetch_related("merge_info")
+        qs = super().get_queryset(*args, **kw)
+        return qs.select_related("published_by", "record", "merge_info")
 
 
 @admin.register(RedditToCommunityRecommendationEntry)
@@ -200,6 +220,14 @@ class CategoryAdmin(admin.ModelAdmin):
         return qs.with_tree_fields()
 
 
+@admin.register(DomainHealth)
+class DomainHealthAdmin(admin.ModelAdmin):
+    list_display = ("domain", "failures", "down_since", "open_until", "flagged")
+    list_filter = ("flagged",)
+    search_fields = ("domain",)
+    readonly_fields = ("last_error",)
+
+
 @admin.register(Topic)
 class TopicAdmin(admin.ModelAdmin):
     list_display = ("code", "name", "description")
@@ -259,6 +287,8 @@ class FediversedInstanceAdmin(admin.ModelAdmin):
         "allows_reddit_signup",
         "allows_reddit_mirrored_content",
         "accepts_community_requests",
+        "sync_lag",
+        "sync_failures",
     )
     list_filter = (
         "allows_reddit_signup",
@@ -276,8 +306,28 @@ class FediversedInstanceAdmin(admin.ModelAdmin):
         "allows_reddit_mirrored_content",
         "accepts_community_requests",
         "creates_reddit_mirror_bots",
+        "change_feed_cursor",
+        "sync_lag",
+        "sync_failures",
+    )
+    exclude = ("push_secret",)
+    actions = (
+        "submit_registration",
+        "fetch_instance_info",
+        "endorse_instances",
+        "subscribe_to_changes",
+        "import_snapshots",
     )
-    actions = ("submit_registration", "fetch_instance_info", "endorse_instances")
+
+    def get_queryset(self, *args, **kw):
+        qs = super().get_queryset(*args, **kw)
+        return qs.with_sync_status()
+
+    @admin.display(description="Sync lag", ordering="last_sync_success")
+    def sync_lag(self, obj):
+        if obj.portal_url == app_settings.Portal.url:
+            return "-"
+        return timesince(obj.last_sync_success) if obj.last_sync_success else "never synced"
 
     @admin.action(description="Mark selected instances as trusted")
     def endorse_instances(self, request, queryset):
@@ -313,10 +363,41 @@ class FediversedInstanceAdmin(admin.ModelAdmin):
             except Exception as exc:
                 messages.error(request, f"Failed to register at {instance.portal_url}: {exc}")
 
+    @admin.action(description="Subscribe to changes pushed by selected instances")
+    def subscribe_to_changes(self, request, queryset):
+        for instance in queryset.exclude(portal_url=app_settings.Portal.url):
+            try:
+                subscribe_to_partner(instance)
+                messages.success(request, f"Subscribed to {instance.portal_url}")
+            except Exception as exc:
+                messages.error(request, f"Failed to subscribe to {instance.portal_url}: {exc}")
+
+    @admin.action(description="Import latest snapshot from selected instances")
+    def import_snapshots(self, request, queryset):
+        for instance in queryset.exclude(portal_url=app_settings.Portal.url):
+            try:
+                header, _ = bootstrap_from_partner(instance)
+                messages.success(
+                    request, f"Imported snapshot of {instance.portal_url} at {header['cursor']}"
+                )
+            except Exception as exc:
+                messages.error(
+                    request, f"Failed to import snapshot of {instance.portal_url}: {exc}"
+                )
+
     def has_change_permission(self, request, obj=None):
         return obj is None or obj.portal_url == app_settings.Portal.url
 
 
+@admin.register(ChangeFeedSubscription)
+class ChangeFeedSubscriptionAdmin(admin.ModelAdmin):
+    list_display = ("subscriber", "callback_url", "active", "last_delivered_at")
+    list_filter = ("active",)
+    list_select_related = ("subscriber",)
+    exclude = ("secret",)
+    readonly_fields = ("subscriber", "callback_url")
+
+
 class AnnotationAdmin(admin.ModelAdmin):
     list_filter = ("status", "hidden", "locked")
 
@@ -0,0 +1,171 @@
+import asyncio
+import logging
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import reduce
+from operator import or_
+from urllib.parse import urlparse
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+
+from fediverser.apps.lemmy.models import Instance as LemmyInstance
+from fediverser.apps.lemmy.services import InstanceProxy
+
+from .models.activitypub import Instance, make_ap_client
+from .models.common import AP_SERVER_SOFTWARE, DomainHealth
+from .models.mapping import InstanceExtraInformation
+from .settings import app_settings
+
+logger = logging.getLogger(__name__)
+
+# Nodeinfo reports software names in lowercase
+SOFTWARE = {value.lower(): value for value, _ in AP_SERVER_SOFTWARE}
+BATCH_SIZE = 500
+
+
+def _is_supported(software):
+    return (software or "").lower() in SOFTWARE
+
+
+def get_peer_domains():
+    """
+    Returns the domains of the instances that the connected Lemmy instance
+    federates with and that run software we support, from its database
+    and from its list of linked instances.
+    """
+
+    if not settings.FEDIVERSER_ENABLE_LEMMY_INTEGRATION:
+        return set()
+
+    connected = InstanceProxy.get_connected_instance()
+    if connected is None:
+        return set()
+
+    supported_q = reduce(or_, (Q(software__iexact=software) for software in SOFTWARE))
+    domains = set(LemmyInstance.objects.filter(supported_q).values_list("domain", flat=True))
+
+    try:
+        response = make_ap_client().get(f"https://{connected.domain}/api/v3/federated_instances")
+        response.raise_for_status()
+        linked = (response.json().get("federated_instances") or {}).get("linked") or []
+        domains.update(peer["domain"] for peer in linked if _is_supported(peer.get("software")))
+    except Exception as exc:
+        logger.info(f"Could not get federated instances from {connected.domain}: {exc}")
+
+    domains.discard(connected.domain)
+    return domains
+
+
+class InstanceCrawler:
+    """
+    Fetches the nodeinfo of many instances at once, along with the site
+    details of the Lemmy ones, and stores what was found with bulk
+    upserts. Requests are sent from a pool of threads with the shared
+    ActivityPub client, limited in total and per host.
+    """
+
+    def __init__(self, concurrency=None, per_host=None):
+        self.concurrency = concurrency or app_settings.Http.crawler_concurrency
+        self.per_host = per_host or app_settings.Http.crawler_connections_per_host
+        self.client = make_ap_client()
+
+    async def _get(self, url):
+        host = urlparse(url).hostname
+        async with self.host_semaphores[host], self.semaphore:
+            response = await asyncio.to_thread(self.client.get, url)
+        response.raise_for_status()
+        return response.json()
+
+    async def crawl_instance(self, domain):
+        try:
+            nodeinfo = await self._get(f"https://{domain}/.well-known/nodeinfo")
+            software_info = await self._get(nodeinfo["links"][0]["href"])
+            site = None
+            if software_info["software"]["name"].lower() == AP_SERVER_SOFTWARE.lemmy:
+                site = await self._get(f"https://{domain}/api/v3/site")
+            return domain, software_info, site
+        except Exception as exc:
+            logger.debug(f"Failed to crawl {domain}: {exc}")
+            return domain, None, None
+
+    async def _crawl(self, domains):
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        self.host_semaphores = defaultdict(lambda: asyncio.Semaphore(self.per_host))
+
+        loop = asyncio.get_running_loop()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            loop.set_default_executor(executor)
+            return await asyncio.gather(*(self.crawl_instance(domain) for domain in domains))
+
+    def crawl(self, domains):
+        results = asyncio.run(self._crawl(sorted(set(domains))))
+        DomainHealth.flush()
+        found = [
+            (domain, software_info, site)
+            for domain, software_info, site in results
+            if software_info is not None and _is_supported(software_info["software"].get("name"))
+        ]
+        for start in range(0, len(found), BATCH_SIZE):
+            self.save(found[start : start + BATCH_SIZE])
+
+        logger.info(f"Crawled {len(results)} instances, {len(found)} are supported")
+        return found
+
+    @transaction.atomic
+    def save(self, results):
+        # Only instances whose site could be read get their name and
+        # description replaced, the others keep what they had.
+        instances = {True: [], False: []}
+        for domain, software_info, site in results:
+            instance = Instance(
+                domain=domain,
+                software=SOFTWARE[software_info["software"]["name"].lower()],
+                open_registrations=software_info.get("openRegistrations") or False,
+            )
+            if site is not None:
+                site_info = site["site_view"]["site"]
+                instance.name = (site_info.get("name") or "")[:30]
+                instance.description = site_info.get("description")
+            instances[site is not None].append(instance)
+
+        common_fields = ["software", "open_registrations"]
+        for with_site, batch in instances.items():
+            Instance.objects.bulk_create(
+                batch,
+                update_conflicts=True,
+                unique_fields=["domain"],
+                update_fields=common_fields + (["name", "description"] if with_site else []),
+            )
+
+        instance_ids = dict(
+            Instance.objects.filter(domain__in=[domain for domain, _, _ in results]).values_list(
+                "domain", "id"
+            )
+        )
+        InstanceExtraInformation.objects.bulk_create(
+            [
+                InstanceExtraInformation(
+                    instance_id=instance_ids[domain],
+                    application_required=(
+                        site["site_view"]["local_site"]["registration_mode"]
+                        == "RequireApplication"
+                    ),
+                )
+                for domain, _, site in results
+                if site is not None
+            ],
+            update_conflicts=True,
+            unique_fields=["instance"],
+            update_fields=["application_required"],
+        )
+
+
+def crawl_instances(domains=None, concurrency=None, per_host=None):
+    if not domains:
+        domains = get_peer_domains() | set(Instance.objects.values_list("domain", flat=True))
+    return InstanceCrawler(concurrency=concurrency, per_host=per_host).crawl(domains)
+
+
+__all__ = ("InstanceCrawler", "get_peer_domains", "crawl_instances")
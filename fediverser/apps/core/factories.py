@@ -25,6 +25,7 @@ class InstanceFactory(factory.django.DjangoModelFactory):
 class CommunityFactory(factory.django.DjangoModelFactory):
     instance = factory.SubFactory(InstanceFactory)
     name = factory.Sequence(lambda n: f"community-{n:03}")
+    url = factory.LazyAttribute(lambda obj: f"https://{obj.instance.domain}/c/{obj.name}")
 
     class Meta:
         model = Community
@@ -0,0 +1,132 @@
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import feedparser
+import requests
+from feedparser.http import ACCEPT_HEADER
+
+from .settings import app_settings
+
+logger = logging.getLogger(__name__)
+
+
+def get_host_key(url):
+    hostname = (urlparse(url).hostname or "").lower()
+
+    # www., old. and the bare domain all count against the same limits on reddit
+    if hostname == "reddit.com" or hostname.endswith(".reddit.com"):
+        return "reddit.com"
+    return hostname
+
+
+class FeedFetcher:
+    """
+    Downloads feeds concurrently and parses them in a thread pool.
+
+    Downloads run in an asyncio loop, bounded by a global connection
+    limit and by a limit for each host. The fetcher does not touch the
+    database: results are handed back so that the caller can process
+    them from its own thread.
+    """
+
+    def __init__(self, max_connections=None, max_connections_per_host=None, host_limits=None):
+        self.max_connections = max_connections or app_settings.Feeds.max_connections
+        self.max_connections_per_host = (
+            max_connections_per_host or app_settings.Feeds.max_connections_per_host
+        )
+        self.host_limits = {"reddit.com": app_settings.Feeds.max_reddit_connections}
+        self.host_limits.update(host_limits or {})
+        self._local = threading.local()
+
+    def _get_session(self):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            session.headers.update({"User-Agent": feedparser.USER_AGENT, "Accept": ACCEPT_HEADER})
+            self._local.session = session
+        return session
+
+    def get_host_limit(self, host):
+        return self.host_limits.get(host, self.max_connections_per_host)
+
+    def download(self, url, etag=None, modified=None):
+        headers = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if modified:
+            headers["If-Modified-Since"] = modified
+
+        response = self._get_session().get(
+            url, headers=headers, timeout=app_settings.Feeds.timeout
+        )
+        response.raise_for_status()
+        return response
+
+    def parse(self, response):
+        if response.status_code == 304:
+            return feedparser.FeedParserDict(status=304, entries=[])
+
+        headers = {key.lower(): value for key, value in response.headers.items()}
+        result = feedparser.parse(response.content, response_headers=headers)
+        result["status"] = response.status_code
+        result["href"] = response.url
+        result["etag"] = headers.get("etag")
+        result["modified"] = headers.get("last-modified")
+        return result
+
+    async def _fetch(self, feed, validators, connections, host_connections, pools):
+        loop = asyncio.get_running_loop()
+        download_pool, parser_pool = pools
+        try:
+            # Wait for the host before taking a global slot, so that feeds
+            # queued on a busy host do not hold back every other host.
+            async with host_connections[get_host_key(feed.url)], connections:
+                response = await loop.run_in_executor(
+                    download_pool, lambda: self.download(feed.url, **validators)
+                )
+            return await loop.run_in_executor(parser_pool, self.parse, response)
+        except Exception as exc:
+            logger.warning(f"Failed to fetch {feed.url}: {exc}")
+            return None
+
+    async def _fetch_all(self, feeds, force):
+        connections = asyncio.Semaphore(self.max_connections)
+        host_connections = {
+            host: asyncio.Semaphore(self.get_host_limit(host))
+            for host in {get_host_key(feed.url) for feed in feeds}
+        }
+
+        with (
+            ThreadPoolExecutor(self.max_connections) as download_pool,
+            ThreadPoolExecutor(app_settings.Feeds.parser_threads) as parser_pool,
+        ):
+            pools = (download_pool, parser_pool)
+            return await asyncio.gather(
+                *(
+                    self._fetch(
+                        feed,
+                        feed.get_validators(force=force),
+                        connections,
+                        host_connections,
+                        pools,
+                    )
+                    for feed in feeds
+                )
+            )
+
+    def fetch(self, feeds, force=False):
+        """
+        Returns a list of (feed, result) pairs, in the same order as the
+        given feeds. The result is None for feeds that could not be
+        downloaded.
+        """
+
+        feeds = list(feeds)
+        results = asyncio.run(self._fetch_all(feeds, force=force))
+        return list(zip(feeds, results))
+
+
+__all__ = ("FeedFetcher", "get_host_key")
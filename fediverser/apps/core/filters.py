@@ -134,18 +134,27 @@ class RedditCommunityFilter(filters.FilterSet):
         )
 
 
+class NumberInFilter(filters.BaseInFilter, filters.NumberFilter):
+    pass
+
+
 class ChangeFeedFilter(filters.FilterSet):
+    id = NumberInFilter(label="ids", field_name="pk", lookup_expr="in")
     since = filters.DateTimeFilter(label="since", field_name="created", lookup_expr="gte")
     until = filters.DateTimeFilter(label="until", field_name="created", lookup_expr="lte")
+    after_id = filters.NumberFilter(label="after id", field_name="pk", lookup_expr="gt")
 
     class Meta:
-        model = models.ChangeFeedEntry
-        fields = ("since", "until")
+        model = models.ChangeFeedRecord
+        fields = ("id", "since", "until", "after_id")
 
 
 class FediversedInstanceFilter(filters.FilterSet):
     search = filters.CharFilter(label="search", method="instance_search")
     trusted = filters.BooleanFilter(label="trusted", method="trusted_by_us")
+    min_trust = filters.NumberFilter(
+        label="minimum trust score", field_name="trust_score__score", lookup_expr="gte"
+    )
 
     def instance_search(self, queryset, name, value):
         instance_domain_q = Q(instance__domain__icontains=value)
@@ -154,14 +163,14 @@ class FediversedInstanceFilter(filters.FilterSet):
 
     def trusted_by_us(self, queryset, name, value):
         action = queryset.filter if value else queryset.exclude
-        us = models.FediversedInstance.current()
-        return action(endorsed_instances__endorser=us)
+        return action(trust_score__endorsed=True)
 
     class Meta:
         model = models.FediversedInstance
         fields = (
             "search",
             "trusted",
+            "min_trust",
             "accepts_community_requests",
             "allows_reddit_mirrored_content",
             "allows_reddit_signup",
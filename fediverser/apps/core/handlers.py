@@ -10,7 +10,8 @@ from allauth.socialaccount.signals import (
 )
 from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db.models.signals import m2m_changed, post_save
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
 from django.dispatch import receiver
 
 from fediverser.apps.lemmy.services import InstanceProxy, LocalUserProxy
@@ -32,20 +33,27 @@ from .models.mapping import (
 )
 from .models.mirroring import LemmyMirroredPost
 from .models.network import (
+    ChangeFeedRecord,
     ConnectedRedditAccount,
     ConnectedRedditAccountEntry,
+    Endorsement,
+    EndorsementEntry,
     FediversedInstance,
     RedditToCommunityRecommendationEntry,
 )
+from .models.push import ChangeFeedSubscription
 from .models.reddit import (
     RedditAccount,
     RedditCommunity,
-    RedditSubmission,
-    make_reddit_client,
     make_reddit_user_client,
 )
 from .settings import app_settings
-from .signals import instance_abandoned, instance_closed, redditor_migrated
+from .signals import (
+    feed_entries_created,
+    instance_abandoned,
+    instance_closed,
+    redditor_migrated,
+)
 
 logger = logging.getLogger(__name__)
 User = get_user_model()
@@ -182,12 +190,9 @@ def on_reddit_account_updated_save_access_token(sender, **kw):
 def on_subreddit_added_create_rss_feed(sender, **kw):
     action = kw["action"]
     if action == "post_add" and not kw["reverse"]:
-        for subreddit_id in kw["pk_set"]:
-            subreddit = RedditCommunity.objects.filter(id=subreddit_id).first()
-            if not subreddit:
-                continue
-            feed_url = f"https://reddit.com/r/{subreddit.name}/hot.rss"
-            tasks.fetch_feed.delay(feed_url)
+        new_subreddits = RedditCommunity.objects.filter(id__in=kw["pk_set"], feeds__isnull=True)
+        if new_subreddits.exists():
+            tasks.enqueue(tasks.make_subreddit_feeds)
 
 
 @receiver(m2m_changed, sender=RedditAccount.subreddits.through)
@@ -211,23 +216,25 @@ def on_subreddit_added_subscribe_to_corresponding_community(sender, **kw):
 def on_feed_created_fetch_entries(sender, **kw):
     if kw["created"]:
         feed = kw["instance"]
-        tasks.fetch_feed.delay(feed_url=feed.url)
-
-
-@receiver(post_save, sender=Entry)
-def on_reddit_feed_entry_get_submission(sender, **kw):
-    entry = kw["instance"]
-
-    if kw["created"] and entry.reddit_submission_id:
-        reddit_name = entry.subreddit_name
-
-        subreddit = RedditCommunity.objects.filter(
-            name__iexact=reddit_name
-        ).first() or RedditCommunity.fetch(reddit_name)
-
-        client = make_reddit_client()
-        post = client.submission(entry.reddit_submission_id)
-        RedditSubmission.make(subreddit=subreddit, post=post)
+        tasks.enqueue(tasks.fetch_feed, feed_url=feed.url)
+
+
+@receiver(feed_entries_created, sender=Entry)
+def on_reddit_feed_entries_fetch_submissions(sender, **kw):
+    # Entries from multireddit feeds are routed back to the subreddits of
+    # the group by the link of the post. Anything else is ignored.
+    group_names = kw["feed"].subreddits.values_list("name", flat=True)
+    subreddit_names = {name.lower() for name in group_names}
+    submission_ids = sorted(
+        {
+            entry.reddit_submission_id
+            for entry in kw["entries"]
+            if entry.reddit_submission_id
+            and (not subreddit_names or entry.subreddit_name.lower() in subreddit_names)
+        }
+    )
+    if submission_ids:
+        tasks.enqueue(tasks.fetch_reddit_submissions, submission_ids)
 
 
 @receiver(post_save, sender=RedditToCommunityRecommendation)
@@ -241,11 +248,50 @@ def on_recommendation_created_publish_change_feed_entry(sender, **kw):
         )
 
 
+@receiver(post_save, sender=ConnectedRedditAccountEntry)
+@receiver(post_save, sender=EndorsementEntry)
+@receiver(post_save, sender=RedditToCommunityRecommendationEntry)
+def on_change_feed_entry_created_write_record(sender, **kw):
+    if kw["created"]:
+        ChangeFeedRecord.make(kw["instance"])
+
+
+@receiver(post_save, sender=ChangeFeedRecord)
+def on_change_feed_record_created_push_to_subscribers(sender, **kw):
+    record = kw["instance"]
+    if not kw["created"] or record.published_by_id != FediversedInstance.current().id:
+        return
+
+    if ChangeFeedSubscription.enqueue(record):
+        transaction.on_commit(lambda: tasks.enqueue(tasks.push_change_feed_entries))
+
+
+@receiver(post_save, sender=ChangeFeedRecord)
+@receiver(post_delete, sender=ChangeFeedRecord)
+def on_change_feed_record_changed_invalidate_versions(sender, **kw):
+    # Invalidating before the commit would let a concurrent request cache
+    # the version that doesn't include this record yet.
+    transaction.on_commit(ChangeFeedRecord.invalidate_versions)
+
+
+@receiver(post_save, sender=FediversedInstance)
+@receiver(post_delete, sender=FediversedInstance)
+def on_fediversed_instance_changed_clear_current(sender, **kw):
+    if kw["instance"].portal_url == app_settings.Portal.url:
+        FediversedInstance.clear_current()
+
+
+@receiver(post_save, sender=Endorsement)
+@receiver(post_delete, sender=Endorsement)
+def on_endorsement_changed_update_trust_scores(sender, **kw):
+    transaction.on_commit(lambda: tasks.enqueue(tasks.update_trust_scores))
+
+
 @receiver(post_save, sender=Instance)
 def on_instance_created_get_extra_information(sender, **kw):
     if kw["created"]:
         instance = kw["instance"]
-        tasks.get_instance_details.delay(instance.domain)
+        tasks.enqueue(tasks.get_instance_details, instance.domain)
 
 
 @receiver(post_save, sender=RecommendCommunity)
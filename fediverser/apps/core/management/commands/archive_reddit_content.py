@@ -0,0 +1,34 @@
+import datetime
+import logging
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from fediverser.apps.core.models.archive import RedditArchive
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Move reddit submissions and comments that are too old for mirroring into an archive"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=None,
+            help="Archive content older than this many days (defaults to the configured horizon)",
+        )
+
+    def handle(self, *args, **options):
+        days = options["days"]
+        cutoff = days and timezone.now() - datetime.timedelta(days=days)
+        archive = RedditArchive.make(cutoff=cutoff)
+        if archive is None:
+            self.stdout.write("Nothing to archive")
+            return
+
+        self.stdout.write(
+            f"Archived {archive.submission_count} submissions and "
+            f"{archive.comment_count} comments to {archive.path}"
+        )
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from fediverser.apps.core.crawler import crawl_instances
+
+
+class Command(BaseCommand):
+    help = "Fetch nodeinfo and site details of known and federated instances"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "domains", nargs="*", help="Crawl only these domains, instead of all known instances"
+        )
+        parser.add_argument("--concurrency", type=int, default=None)
+        parser.add_argument("--per-host", type=int, default=None)
+
+    def handle(self, *args, **options):
+        found = crawl_instances(
+            options["domains"],
+            concurrency=options["concurrency"],
+            per_host=options["per_host"],
+        )
+        self.stdout.write(f"Updated {len(found)} instances")
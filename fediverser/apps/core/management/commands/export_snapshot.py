@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from fediverser.apps.core.snapshots import write_snapshot
+
+
+class Command(BaseCommand):
+    help = "Write a snapshot of the federated state that new partners can bootstrap from"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--path",
+            default=None,
+            help="Where to write the snapshot (defaults to the configured snapshot path)",
+        )
+
+    def handle(self, *args, **options):
+        path = write_snapshot(path=options["path"])
+        self.stdout.write(f"Wrote snapshot to {path}")
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from fediverser.apps.core.models.network import FediversedInstance
+from fediverser.apps.core.snapshots import (
+    InvalidSnapshot,
+    bootstrap_from_partner,
+    import_snapshot,
+)
+
+
+class Command(BaseCommand):
+    help = "Import a snapshot of a partner's federated state"
+
+    def add_arguments(self, parser):
+        parser.add_argument("portal_url", help="URL of the partner portal")
+        parser.add_argument(
+            "--file",
+            default=None,
+            help="Import from this file, instead of downloading the latest snapshot",
+        )
+
+    def handle(self, *args, **options):
+        partner, _ = FediversedInstance.objects.get_or_create(
+            portal_url=options["portal_url"].removesuffix("/")
+        )
+
+        try:
+            if options["file"]:
+                with open(options["file"], "rb") as snapshot_file:
+                    header, counts = import_snapshot(snapshot_file, partner=partner)
+            else:
+                header, counts = bootstrap_from_partner(partner)
+        except InvalidSnapshot as exc:
+            raise CommandError(str(exc))
+
+        summary = ", ".join(f"{count} {kind}" for kind, count in counts.items())
+        self.stdout.write(f"Imported {summary or 'nothing'} at cursor {header['cursor']}")
@@ -83,14 +83,18 @@ def refresh_posts(client, subreddits):
     subreddits.update(last_synced_at=timezone.now())
 
 
+def get_automated_subreddits():
+    mirrored_subreddits = RedditCommunity.objects.filter(mirroring_strategies__isnull=False)
+    return mirrored_subreddits.exclude(
+        mirroring_strategies__automatic_submission_policy=AutomaticSubmissionPolicies.NONE
+    )
+
+
 def refresh_subreddits(client):
     current_time = timezone.now()
     cutoff = current_time - QUERYING_INTERVAL
 
-    mirrored_subreddits = RedditCommunity.objects.filter(mirroring_strategies__isnull=False)
-    automated_subreddits = mirrored_subreddits.exclude(
-        mirroring_strategies__automatic_submission_policy=AutomaticSubmissionPolicies.NONE
-    )
+    automated_subreddits = get_automated_subreddits()
 
     # If a subreddit has been created and never synced, we set it for sync now.
     automated_subreddits.filter(last_synced_at=None).update(last_synced_at=cutoff)
@@ -0,0 +1,101 @@
+import logging
+import threading
+import time
+from collections import Counter
+
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "fediverser:metrics"
+
+# Counters on hot paths are kept in memory and only added to the shared
+# ones once this many seconds have passed since the last flush.
+FLUSH_INTERVAL = 10
+
+_buffer = Counter()
+_buffer_lock = threading.Lock()
+_flushed_at = time.monotonic()
+
+
+def _get_key(name):
+    return f"{KEY_PREFIX}:{name}"
+
+
+def increment(name, delta=1):
+    """
+    Increments a counter that is shared by every process using the same
+    cache. Counters never expire, but are not guaranteed to survive a
+    cache flush.
+    """
+
+    key = _get_key(name)
+    cache.add(key, 0, timeout=None)
+    try:
+        return cache.incr(key, delta)
+    except ValueError:
+        # Key was evicted between the add and the incr.
+        cache.set(key, delta, timeout=None)
+        return delta
+
+
+def increment_later(name, delta=1):
+    """
+    Increments a counter in memory, to be added to the shared counter by
+    the next flush. Counts are flushed by the first call after
+    FLUSH_INTERVAL, and are lost if the process exits before that.
+    """
+
+    with _buffer_lock:
+        _buffer[name] += delta
+        is_due = time.monotonic() - _flushed_at >= FLUSH_INTERVAL
+
+    if is_due:
+        flush()
+
+
+def flush():
+    global _buffer, _flushed_at
+
+    with _buffer_lock:
+        pending, _buffer = _buffer, Counter()
+        _flushed_at = time.monotonic()
+
+    for name, delta in pending.items():
+        increment(name, delta)
+
+
+def get_count(name):
+    return cache.get(_get_key(name), 0)
+
+
+def record_hit(name, later=False):
+    return (increment_later if later else increment)(f"{name}:hits")
+
+
+def record_miss(name, later=False):
+    return (increment_later if later else increment)(f"{name}:misses")
+
+
+def get_hit_ratio(name):
+    hits = get_count(f"{name}:hits")
+    misses = get_count(f"{name}:misses")
+    total = hits + misses
+    return total and hits / total
+
+
+def reset(*names):
+    keys = [_get_key(f"{name}:{suffix}") for name in names for suffix in ("hits", "misses")]
+    cache.delete_many(keys + [_get_key(name) for name in names])
+
+
+__all__ = (
+    "increment",
+    "increment_later",
+    "flush",
+    "get_count",
+    "record_hit",
+    "record_miss",
+    "get_hit_ratio",
+    "reset",
+)
@@ -0,0 +1,17 @@
+# Generated by Django 5.2 on 2026-10-19 13:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("core", "0024_setinstanceasclosed_setinstanceasabandoned"),
+        ("taggit", "0006_rename_taggeditem_content_type_object_id_taggit_tagg_content_8fc721_idx"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="entry",
+            index=models.Index(fields=["modified"], name="core_entry_modified_idx"),
+        ),
+    ]
@@ -0,0 +1,76 @@
+# Generated by Django 5.2 on 2026-10-19 13:33
+
+import django.db.models.deletion
+import django.utils.timezone
+import model_utils.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("core", "0025_entry_modified_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RedditArchive",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name="ID"
+                    ),
+                ),
+                (
+                    "created",
+                    model_utils.fields.AutoCreatedField(
+                        default=django.utils.timezone.now, editable=False, verbose_name="created"
+                    ),
+                ),
+                (
+                    "modified",
+                    model_utils.fields.AutoLastModifiedField(
+                        default=django.utils.timezone.now, editable=False, verbose_name="modified"
+                    ),
+                ),
+                ("path", models.CharField(max_length=500, unique=True)),
+                ("cutoff", models.DateTimeField()),
+                ("submission_count", models.PositiveIntegerField(default=0)),
+                ("comment_count", models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                "abstract": False,
+            },
+        ),
+        migrations.CreateModel(
+            name="ArchivedRedditContent",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name="ID"
+                    ),
+                ),
+                (
+                    "kind",
+                    models.CharField(
+                        choices=[("submission", "Submission"), ("comment", "Comment")],
+                        max_length=16,
+                    ),
+                ),
+                ("reddit_id", models.CharField(max_length=16)),
+                (
+                    "archive",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="contents",
+                        to="core.redditarchive",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name_plural": "Archived Reddit Content",
+                "unique_together": {("kind", "reddit_id")},
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2 on 2026-10-19 13:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("core", "0026_redditarchive"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="redditcommunity",
+            name="last_synced_at",
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="redditcomment",
+            index=models.Index(fields=["status", "created"], name="core_comment_queue_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="redditcomment",
+            index=models.Index(fields=["submission", "status"], name="core_comment_thread_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="redditsubmission",
+            index=models.Index(fields=["status", "created"], name="core_submission_queue_idx"),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2 on 2026-10-19 13:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("core", "0027_scheduling_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="feed",
+            name="last_modified",
+            field=models.CharField(blank=True, max_length=50, null=True),
+        ),
+        migrations.AlterField(
+            model_name="feed",
+            name="etag",
+            field=models.CharField(blank=True, db_index=True, max_length=255, null=True),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2 on 2026-10-19 13:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("core", "0028_feed_last_modified"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="feed",
+            name="next_fetch_at",
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
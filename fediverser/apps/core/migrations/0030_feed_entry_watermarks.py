@@ -0,0 +1,22 @@
+# Generated by Django 5.2 on 2026-10-19 13:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("core", "0029_feed_next_fetch_at"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="entry",
+            name="content_hash",
+            field=models.CharField(blank=True, max_length=40, null=True),
+        ),
+        migrations.AddField(
+            model_name="feed",
+            name="last_entry_guid",
+            field=models.CharField(blank=True, max_length=500, null=True),
+        ),
+    ]
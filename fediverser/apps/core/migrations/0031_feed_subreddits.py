@@ -0,0 +1,19 @@
+# Generated by Django 5.2 on 2026-10-19 14:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("core", "0030_feed_entry_watermarks"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="feed",
+            name="subreddits",
+            field=models.ManyToManyField(
+                blank=True, related_name="feeds", to="core.redditcommunity"
+            ),
+        ),
+    ]
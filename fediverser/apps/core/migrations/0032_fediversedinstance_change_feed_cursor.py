@@ -0,0 +1,21 @@
+# Generated by Django 5.2 on 2026-10-19 14:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("core", "0031_feed_subreddits"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="fediversedinstance",
+            name="change_feed_cursor",
+            field=models.BigIntegerField(
+                blank=True,
+                help_text="Id of the last change feed entry pulled from partner",
+                null=True,
+            ),
+        ),
+    ]
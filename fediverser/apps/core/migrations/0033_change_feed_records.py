@@ -0,0 +1,133 @@
+# Generated by Django 5.2 on 2026-10-19 14:12
+
+import django.core.serializers.json
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def write_change_feed_records(apps, schema_editor):
+    ChangeFeedRecord = apps.get_model("core", "ChangeFeedRecord")
+
+    def get_connection_fields(entry):
+        return {
+            "description": f"/u/{entry.reddit_account.username} connected to {entry.actor.url}",
+            "reddit_account": entry.reddit_account.username,
+            "actor": entry.actor.url,
+        }
+
+    def get_endorsement_fields(entry):
+        endorser = entry.endorsement.endorser.portal_url
+        endorsed = entry.endorsement.endorsed.portal_url
+        return {
+            "description": f"{endorser} endorses {endorsed}",
+            "endorser": endorser,
+            "endorsed": endorsed,
+        }
+
+    def get_recommendation_fields(entry):
+        community = entry.community
+        return {
+            "description": (
+                f"{community.name}@{community.instance.domain} "
+                f"as alternative to /r/{entry.subreddit.name}"
+            ),
+            "subreddit": entry.subreddit.name,
+            "community": community.url,
+        }
+
+    entry_types = (
+        (
+            "ConnectedRedditAccountEntry",
+            "connection:reddit",
+            ("reddit_account", "actor"),
+            get_connection_fields,
+        ),
+        (
+            "EndorsementEntry",
+            "endorsement",
+            ("endorsement__endorser", "endorsement__endorsed"),
+            get_endorsement_fields,
+        ),
+        (
+            "RedditToCommunityRecommendationEntry",
+            "recommendation:group",
+            ("subreddit", "community__instance"),
+            get_recommendation_fields,
+        ),
+    )
+
+    def make_record(entry, entry_type, get_fields):
+        fields = get_fields(entry)
+        return ChangeFeedRecord(
+            entry_id=entry.pk,
+            published_by_id=entry.published_by_id,
+            type=entry_type,
+            created=entry.created,
+            payload={
+                "id": entry.pk,
+                "description": fields.pop("description"),
+                "type": entry_type,
+                "created": entry.created,
+                **fields,
+            },
+        )
+
+    for model_name, entry_type, related, get_fields in entry_types:
+        entries = apps.get_model("core", model_name).objects.select_related(*related)
+        ChangeFeedRecord.objects.bulk_create(
+            (
+                make_record(entry, entry_type, get_fields)
+                for entry in entries.iterator(chunk_size=1000)
+            ),
+            batch_size=1000,
+            ignore_conflicts=True,
+        )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("core", "0032_fediversedinstance_change_feed_cursor"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ChangeFeedRecord",
+            fields=[
+                (
+                    "entry",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="record",
+                        serialize=False,
+                        to="core.changefeedentry",
+                    ),
+                ),
+                ("type", models.CharField(max_length=50)),
+                ("created", models.DateTimeField()),
+                (
+                    "payload",
+                    models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder),
+                ),
+                (
+                    "published_by",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="published_feed_records",
+                        to="core.fediversedinstance",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["published_by", "entry"], name="core_changerecord_cursor_idx"
+                    ),
+                    models.Index(
+                        fields=["published_by", "created"], name="core_changerecord_date_idx"
+                    ),
+                ],
+            },
+        ),
+        migrations.RunPython(write_change_feed_records, reverse_code=migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2 on 2026-10-19 14:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("core", "0034_change_feed_push"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="fediversedinstance",
+            name="sync_failures",
+            field=models.PositiveIntegerField(
+                default=0,
+                help_text="Consecutive failed attempts to pull the change feed from partner",
+            ),
+        ),
+        migrations.AddField(
+            model_name="syncjob",
+            name="caught_up",
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AddField(
+            model_name="syncjob",
+            name="entry_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="syncjob",
+            name="succeeded",
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AddIndex(
+            model_name="syncjob",
+            index=models.Index(fields=["instance", "run_on"], name="core_syncjob_instance_idx"),
+        ),
+    ]
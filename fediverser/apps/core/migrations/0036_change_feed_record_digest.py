@@ -0,0 +1,48 @@
+# Generated by Django 5.2 on 2026-10-19 14:26
+
+import hashlib
+import json
+
+from django.db import migrations, models
+
+
+def write_record_digests(apps, schema_editor):
+    ChangeFeedRecord = apps.get_model("core", "ChangeFeedRecord")
+
+    def get_digest(payload):
+        identity = {
+            key: value
+            for key, value in payload.items()
+            if key not in ("id", "description", "created")
+        }
+        return hashlib.sha1(json.dumps(identity, sort_keys=True).encode()).hexdigest()
+
+    batch = []
+    for record in ChangeFeedRecord.objects.only("entry_id", "payload").iterator(chunk_size=1000):
+        record.digest = get_digest(record.payload)
+        batch.append(record)
+        if len(batch) >= 1000:
+            ChangeFeedRecord.objects.bulk_update(batch, ["digest"])
+            batch = []
+    ChangeFeedRecord.objects.bulk_update(batch, ["digest"])
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("core", "0035_partner_sync_status"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="changefeedrecord",
+            name="digest",
+            field=models.CharField(default="", max_length=40),
+        ),
+        migrations.AddIndex(
+            model_name="changefeedrecord",
+            index=models.Index(
+                fields=["published_by", "digest"], name="core_changerecord_digest_idx"
+            ),
+        ),
+        migrations.RunPython(write_record_digests, reverse_code=migrations.RunPython.noop),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2 on 2026-10-19 14:29
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("core", "0036_change_feed_record_digest"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TrustScore",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name="ID"
+                    ),
+                ),
+                ("score", models.FloatField(db_index=True, default=0.0)),
+                (
+                    "endorsed",
+                    models.BooleanField(
+                        default=False, help_text="Directly endorsed by this portal"
+                    ),
+                ),
+                ("updated", models.DateTimeField(auto_now=True)),
+                (
+                    "instance",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="trust_score",
+                        to="core.fediversedinstance",
+                    ),
+                ),
+            ],
+        ),
+    ]
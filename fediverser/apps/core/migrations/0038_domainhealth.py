@@ -0,0 +1,38 @@
+# Generated by Django 5.2 on 2026-10-19 14:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("core", "0037_trust_score"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DomainHealth",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name="ID"
+                    ),
+                ),
+                ("domain", models.CharField(max_length=255, unique=True)),
+                ("failures", models.PositiveIntegerField(default=0)),
+                ("down_since", models.DateTimeField(blank=True, null=True)),
+                ("open_until", models.DateTimeField(blank=True, null=True)),
+                ("last_error", models.TextField(blank=True, default="")),
+                (
+                    "flagged",
+                    models.BooleanField(
+                        default=False,
+                        help_text="Instance was marked as closed for being unreachable",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name_plural": "Domain Health",
+            },
+        ),
+    ]
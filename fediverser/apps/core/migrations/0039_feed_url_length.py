@@ -0,0 +1,17 @@
+# Generated by Django 5.2 on 2026-10-19 14:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("core", "0038_domainhealth"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="feed",
+            name="url",
+            field=models.URLField(max_length=2000, unique=True),
+        ),
+    ]
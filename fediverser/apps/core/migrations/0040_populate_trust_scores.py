@@ -0,0 +1,82 @@
+from collections import defaultdict
+
+from django.db import migrations
+
+from fediverser.apps.core.settings import app_settings
+
+
+def compute_trust_scores(edges, source):
+    # Frozen copy of TrustScore.compute, so that this migration does not
+    # change along with the model.
+    damping = app_settings.Federation.trust_damping
+
+    endorsements = defaultdict(list)
+    for endorser, endorsed in edges:
+        endorsements[endorser].append(endorsed)
+
+    nodes = {
+        source,
+        *endorsements,
+        *(node for nodes in endorsements.values() for node in nodes),
+    }
+    scores = dict.fromkeys(nodes, 0.0)
+    scores[source] = 1.0
+
+    for _ in range(app_settings.Federation.trust_max_iterations):
+        updated = dict.fromkeys(nodes, 0.0)
+
+        returned = 1.0 - damping
+        for node, score in scores.items():
+            targets = endorsements.get(node)
+            if not targets:
+                returned += damping * score
+                continue
+            share = damping * score / len(targets)
+            for target in targets:
+                updated[target] += share
+        updated[source] += returned
+
+        delta = sum(abs(updated[node] - scores[node]) for node in nodes)
+        scores = updated
+        if delta < app_settings.Federation.trust_tolerance:
+            break
+
+    return scores
+
+
+def populate_trust_scores(apps, schema_editor):
+    # Without this, ?trusted=true would list nothing until the first
+    # scheduled rebuild.
+    FediversedInstance = apps.get_model("core", "FediversedInstance")
+    Endorsement = apps.get_model("core", "Endorsement")
+    TrustScore = apps.get_model("core", "TrustScore")
+
+    source = FediversedInstance.objects.filter(portal_url=app_settings.Portal.url).first()
+    if source is None:
+        return
+
+    edges = list(Endorsement.objects.values_list("endorser_id", "endorsed_id"))
+    scores = compute_trust_scores(edges, source.id)
+    endorsed = {target for endorser, target in edges if endorser == source.id}
+
+    TrustScore.objects.bulk_create(
+        [
+            TrustScore(
+                instance_id=instance_id,
+                score=scores.get(instance_id, 0.0),
+                endorsed=instance_id in endorsed,
+            )
+            for instance_id in FediversedInstance.objects.values_list("id", flat=True)
+        ],
+        ignore_conflicts=True,
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("core", "0039_feed_url_length"),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_trust_scores, reverse_code=migrations.RunPython.noop),
+    ]
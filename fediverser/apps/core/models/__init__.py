@@ -1,5 +1,6 @@
 from .accounts import *  # noqa
 from .activitypub import *  # noqa
+from .archive import *  # noqa
 from .cms import *  # noqa
 from .common import *  # noqa
 from .feeds import *  # noqa
@@ -7,4 +8,5 @@ from .invites import *  # noqa
 from .mapping import *  # noqa
 from .mirroring import *  # noqa
 from .network import *  # noqa
+from .push import *  # noqa
 from .reddit import *  # noqa
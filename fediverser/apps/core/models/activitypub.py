@@ -18,9 +18,7 @@ AP_CLIENT_REQUEST_HEADERS = {"Accept": "application/ld+json;application/activity
 
 
 def make_ap_client():
-    client = make_http_client()
-    client.headers.update(**AP_CLIENT_REQUEST_HEADERS)
-    return client
+    return make_http_client("activitypub", headers=AP_CLIENT_REQUEST_HEADERS, cached=True)
 
 
 class Instance(models.Model):
@@ -57,23 +55,31 @@ class Instance(models.Model):
         response.raise_for_status()
         return response.json()
 
+    @classmethod
+    def make(cls, domain, software_info=None):
+        if software_info is None:
+            instance, _ = cls.objects.get_or_create(domain=domain)
+            return instance
+
+        instance, _ = cls.objects.update_or_create(
+            domain=domain,
+            defaults={
+                "software": software_info["software"]["name"],
+                "open_registrations": software_info.get("openRegistrations") or False,
+            },
+        )
+        return instance
+
     @classmethod
     def fetch(cls, url):
         domain = urlparse(url).hostname
 
         try:
             software_info = cls.get_software_info(url)
-            instance, _ = cls.objects.update_or_create(
-                domain=domain,
-                defaults={
-                    "software": software_info["software"]["name"],
-                    "open_registrations": software_info.get("openRegistrations") or False,
-                },
-            )
         except ConnectionError:
-            instance, _ = cls.objects.get_or_create(domain=domain)
+            software_info = None
 
-        return instance
+        return cls.make(domain, software_info)
 
     def __str__(self):
         return self.domain
@@ -132,6 +138,19 @@ class Community(models.Model, ActorMixin):
     def __str__(self):
         return self.fqdn
 
+    @classmethod
+    def make(cls, url, instance, community_data):
+        try:
+            assert community_data.get("type") == "Group", "not an AP Group actor"
+            name = community_data["preferredUsername"]
+        except (KeyError, AssertionError) as exc:
+            raise ValueError(str(exc))
+
+        community, _ = cls.objects.get_or_create(
+            url=url, defaults={"instance": instance, "name": name}
+        )
+        return community
+
     @classmethod
     def fetch(cls, url):
         try:
@@ -139,18 +158,8 @@ class Community(models.Model, ActorMixin):
             instance = Instance.objects.filter(domain=domain).first() or Instance.fetch(
                 f"https://{domain}"
             )
-            client = make_ap_client()
-            response = client.get(url)
-            response.raise_for_status()
-            community_data = response.json()
-
-            assert community_data.get("type") == "Group", "not an AP Group actor"
-            name = community_data["preferredUsername"]
-            community, _ = cls.objects.get_or_create(
-                url=url, defaults={"instance": instance, "name": name}
-            )
-            return community
-        except (KeyError, AssertionError) as exc:
+            return cls.make(url, instance, cls.get_metadata(url))
+        except KeyError as exc:
             raise ValueError(str(exc))
 
     class Meta:
@@ -172,6 +181,19 @@ class Person(models.Model, ActorMixin):
         )
         return person
 
+    @classmethod
+    def make(cls, url, instance, person_data):
+        try:
+            assert person_data.get("type") == "Person", "not an AP Person actor"
+            name = person_data["preferredUsername"]
+        except (KeyError, AssertionError) as exc:
+            raise ValueError(str(exc))
+
+        person, _ = cls.objects.update_or_create(
+            url=url, defaults={"instance": instance, "name": name}
+        )
+        return person
+
     @classmethod
     def fetch(cls, url):
         try:
@@ -179,18 +201,8 @@ class Person(models.Model, ActorMixin):
             instance = Instance.objects.filter(domain=domain).first() or Instance.fetch(
                 f"https://{domain}"
             )
-            client = make_ap_client()
-            response = client.get(url)
-            response.raise_for_status()
-            person_data = response.json()
-
-            assert person_data.get("type") == "Person", "not an AP Person actor"
-            name = person_data["preferredUsername"]
-            person, _ = cls.objects.update_or_create(
-                url=url, defaults={"instance": instance, "name": name}
-            )
-            return person
-        except (KeyError, AssertionError) as exc:
+            return cls.make(url, instance, cls.get_metadata(url))
+        except KeyError as exc:
             raise ValueError(str(exc))
 
 
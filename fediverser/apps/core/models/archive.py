@@ -0,0 +1,259 @@
+import gzip
+import json
+import logging
+import os
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models, transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+from model_utils import Choices
+from model_utils.models import TimeStampedModel
+
+from ..settings import app_settings
+from .mirroring import LemmyMirroredComment
+from .reddit import RedditComment, RedditSubmission
+
+logger = logging.getLogger(__name__)
+
+
+ARCHIVED_CONTENT_TYPES = Choices(("submission", "Submission"), ("comment", "Comment"))
+
+
+def to_archive_record(obj):
+    return {field.attname: field.value_from_object(obj) for field in obj._meta.concrete_fields}
+
+
+def from_archive_record(model, record):
+    return model(
+        **{
+            field.attname: field.to_python(record.get(field.attname))
+            for field in model._meta.concrete_fields
+        }
+    )
+
+
+class RedditArchive(TimeStampedModel):
+    """
+    Compressed JSONL file holding reddit content that is too old to be
+    mirrored. Each line is a {"kind": ..., "data": ...} record.
+    """
+
+    BATCH_SIZE = 1000
+
+    path = models.CharField(max_length=500, unique=True)
+    cutoff = models.DateTimeField()
+    submission_count = models.PositiveIntegerField(default=0)
+    comment_count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return self.path
+
+    def read(self, kind, reddit_id):
+        model = {
+            ARCHIVED_CONTENT_TYPES.submission: RedditSubmission,
+            ARCHIVED_CONTENT_TYPES.comment: RedditComment,
+        }[kind]
+
+        needle = json.dumps({"id": reddit_id})[1:-1]
+        with gzip.open(self.path, "rt", encoding="utf-8") as archive_file:
+            for line in archive_file:
+                if needle not in line:
+                    continue
+                record = json.loads(line)
+                if record["kind"] == kind and record["data"]["id"] == reddit_id:
+                    return from_archive_record(model, record["data"])
+        return None
+
+    @staticmethod
+    def _write(archive_file, kind, objects):
+        for obj in objects:
+            record = {"kind": kind, "data": to_archive_record(obj)}
+            archive_file.write(json.dumps(record, cls=DjangoJSONEncoder) + "\n")
+
+    @staticmethod
+    def get_archivable_comments(cutoff):
+        return RedditComment.objects.filter(created__lt=cutoff).exclude(
+            ArchivedRedditContent.is_archived(ARCHIVED_CONTENT_TYPES.comment)
+        )
+
+    @staticmethod
+    def get_archivable_submissions(cutoff):
+        return RedditSubmission.objects.filter(created__lt=cutoff).exclude(
+            ArchivedRedditContent.is_archived(ARCHIVED_CONTENT_TYPES.submission)
+        )
+
+    @classmethod
+    def _dump(cls, archive_file, kind, queryset):
+        ids = []
+        last_id = ""
+        while True:
+            batch = list(queryset.filter(id__gt=last_id).order_by("id")[: cls.BATCH_SIZE])
+            if not batch:
+                break
+
+            cls._write(archive_file, kind, batch)
+            last_id = batch[-1].id
+            ids.extend(obj.id for obj in batch)
+        return ids
+
+    def _index(self, kind, ids):
+        ArchivedRedditContent.objects.bulk_create(
+            [
+                ArchivedRedditContent(archive=self, kind=kind, reddit_id=reddit_id)
+                for reddit_id in ids
+            ],
+            ignore_conflicts=True,
+        )
+
+    def _remove_comments(self, comment_ids):
+        for start in range(0, len(comment_ids), self.BATCH_SIZE):
+            batch = comment_ids[start : start + self.BATCH_SIZE]
+            with transaction.atomic():
+                self._index(ARCHIVED_CONTENT_TYPES.comment, batch)
+                mirrored = LemmyMirroredComment.objects.filter(reddit_comment_id__in=batch)
+                RedditComment.objects.filter(id__in=mirrored.values("reddit_comment_id")).update(
+                    body="", body_html=""
+                )
+                RedditComment.objects.filter(
+                    id__in=batch, lemmy_mirrored_comments__isnull=True
+                ).delete()
+
+    def _remove_submissions(self, submission_ids):
+        still_referenced = Q(lemmy_mirrored_posts__isnull=False) | Q(comments__isnull=False)
+        for start in range(0, len(submission_ids), self.BATCH_SIZE):
+            batch = submission_ids[start : start + self.BATCH_SIZE]
+            with transaction.atomic():
+                self._index(ARCHIVED_CONTENT_TYPES.submission, batch)
+                stubs = RedditSubmission.objects.filter(id__in=batch).filter(still_referenced)
+                RedditSubmission.objects.filter(id__in=stubs.values("id")).update(
+                    selftext=None, selftext_html=None
+                )
+                RedditSubmission.objects.filter(id__in=batch).exclude(
+                    id__in=stubs.values("id")
+                ).delete()
+
+    @classmethod
+    def _write_file(cls, path, cutoff):
+        # Written to a temporary file that is only moved into place once it
+        # is complete and on disk, so that nothing is removed from the
+        # database before it can be read back from the archive.
+        temp_path = f"{path}.tmp"
+        try:
+            with open(temp_path, "wb") as raw_file:
+                with gzip.open(raw_file, "wt", encoding="utf-8") as archive_file:
+                    comment_ids = cls._dump(
+                        archive_file,
+                        ARCHIVED_CONTENT_TYPES.comment,
+                        cls.get_archivable_comments(cutoff),
+                    )
+                    submission_ids = cls._dump(
+                        archive_file,
+                        ARCHIVED_CONTENT_TYPES.submission,
+                        cls.get_archivable_submissions(cutoff),
+                    )
+                raw_file.flush()
+                os.fsync(raw_file.fileno())
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        folder = os.open(os.path.dirname(path), os.O_RDONLY)
+        try:
+            os.fsync(folder)
+        finally:
+            os.close(folder)
+
+        return comment_ids, submission_ids
+
+    @classmethod
+    def make(cls, cutoff=None):
+        """
+        Moves all reddit content created before the cutoff into a new
+        archive file. Content that is still referenced by a mirrored
+        post or comment is kept in the database as a stub, stripped of
+        its text. Content that can still be mirrored is never archived,
+        whatever the cutoff. Returns None when there is nothing to archive.
+        """
+
+        mirroring_age = max(RedditSubmission.MAX_AGE, RedditComment.MAXIMUM_AGE_FOR_MIRRORING)
+        now = timezone.now()
+        latest_cutoff = now - mirroring_age
+        if cutoff is None:
+            cutoff = now - max(app_settings.Archive.horizon, mirroring_age)
+        elif cutoff > latest_cutoff:
+            logger.warning(f"Content after {latest_cutoff} can still be mirrored, keeping it")
+            cutoff = latest_cutoff
+
+        has_content = (
+            cls.get_archivable_comments(cutoff).exists()
+            or cls.get_archivable_submissions(cutoff).exists()
+        )
+        if not has_content:
+            logger.info(f"No reddit content from before {cutoff} left to archive")
+            return None
+
+        os.makedirs(app_settings.Archive.path, exist_ok=True)
+        path = os.path.join(app_settings.Archive.path, f"reddit-{now:%Y%m%dT%H%M%S}.jsonl.gz")
+
+        comment_ids, submission_ids = cls._write_file(path, cutoff)
+
+        archive = cls.objects.create(
+            path=path,
+            cutoff=cutoff,
+            comment_count=len(comment_ids),
+            submission_count=len(submission_ids),
+        )
+        archive._remove_comments(comment_ids)
+        archive._remove_submissions(submission_ids)
+
+        logger.info(
+            f"Archived {archive.submission_count} submissions and "
+            f"{archive.comment_count} comments to {path}"
+        )
+        return archive
+
+    @classmethod
+    def restore_submission(cls, submission):
+        """
+        Fills in the text that was stripped from a stub with the one
+        kept in the archive. Submissions that were never archived are
+        returned as they are, without reading any archive file.
+        """
+
+        archived = cls.find_submission(submission.id)
+        if archived is not None:
+            submission.selftext = archived.selftext
+            submission.selftext_html = archived.selftext_html
+        return submission
+
+    @classmethod
+    def find_submission(cls, submission_id):
+        archived = (
+            ArchivedRedditContent.objects.filter(
+                kind=ARCHIVED_CONTENT_TYPES.submission, reddit_id=submission_id
+            )
+            .select_related("archive")
+            .order_by("-archive__created")
+            .first()
+        )
+        return archived and archived.archive.read(ARCHIVED_CONTENT_TYPES.submission, submission_id)
+
+
+class ArchivedRedditContent(models.Model):
+    archive = models.ForeignKey(RedditArchive, related_name="contents", on_delete=models.CASCADE)
+    kind = models.CharField(max_length=16, choices=ARCHIVED_CONTENT_TYPES)
+    reddit_id = models.CharField(max_length=16)
+
+    @classmethod
+    def is_archived(cls, kind):
+        return Exists(cls.objects.filter(kind=kind, reddit_id=OuterRef("id")))
+
+    class Meta:
+        unique_together = ("kind", "reddit_id")
+        verbose_name_plural = "Archived Reddit Content"
+
+
+__all__ = ("RedditArchive", "ArchivedRedditContent")
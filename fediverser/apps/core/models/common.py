@@ -1,11 +1,23 @@
+import datetime
 import os
+import threading
 import uuid
+from urllib.parse import urlparse
 
 import cloudscraper
-from django.db import models
+import redis
+import requests
+import requests_cache
+from django.core.cache import cache
+from django.db import models, transaction
+from django.utils import timezone
 from django.utils.deconstruct import deconstructible
 from model_utils import Choices
 from tree_queries.models import TreeNode
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from .. import metrics
+from ..settings import app_settings
 
 AP_CLIENT_REQUEST_HEADERS = {"Accept": "application/ld+json"}
 
@@ -31,11 +43,328 @@ AP_SERVER_SOFTWARE = Choices(
 )
 
 
-def make_http_client():
-    return cloudscraper.create_scraper(
-        browser={"browser": "firefox", "platform": "linux", "mobile": False}
+def _get_counted_pool_class(pool_class, metric_name):
+    class CountedConnectionPool(pool_class):
+        def _get_conn(self, timeout=None):
+            # Connections that were dropped by the server come back
+            # closed, and need to be established again just like new ones.
+            conn = super()._get_conn(timeout=timeout)
+            if conn.sock is None:
+                metrics.record_miss(metric_name, later=True)
+            else:
+                metrics.record_hit(metric_name, later=True)
+            return conn
+
+    return CountedConnectionPool
+
+
+class PooledHttpClient(cloudscraper.CloudScraper):
+    """
+    Scraper for the callers with the same purpose, so that connections
+    are kept alive between requests. Connections are pooled per host, up
+    to a fixed number for each, and requests that do not set their own
+    timeout get the default one.
+
+    Scrapers keep cookies and challenge state, so each thread gets its
+    own. Their adapters, and so the connection pools, are shared by all
+    the scrapers of the purpose.
+    """
+
+    def __init__(self, purpose, adapters=None, **kw):
+        super().__init__(
+            browser={"browser": "firefox", "platform": "linux", "mobile": False}, **kw
+        )
+        self.purpose = purpose
+        self.timeout = (app_settings.Http.connect_timeout, app_settings.Http.read_timeout)
+
+        if adapters is not None:
+            for prefix, adapter in adapters.items():
+                self.mount(prefix, adapter)
+            return
+
+        metric_name = f"http.{purpose}.connections"
+        for adapter in self.adapters.values():
+            adapter.init_poolmanager(
+                app_settings.Http.pooled_hosts,
+                app_settings.Http.connections_per_host,
+                block=True,
+            )
+            adapter.poolmanager.pool_classes_by_scheme = {
+                "http": _get_counted_pool_class(HTTPConnectionPool, metric_name),
+                "https": _get_counted_pool_class(HTTPSConnectionPool, metric_name),
+            }
+
+    def request(self, method, url, *args, **kw):
+        kw.setdefault("timeout", self.timeout)
+        return super().request(method, url, *args, **kw)
+
+    def send(self, request, **kw):
+        # Cached responses never get here, so they are still served while
+        # the circuit of their domain is open.
+        domain = urlparse(request.url).hostname
+        DomainHealth.ensure_reachable(domain)
+        try:
+            response = super().send(request, **kw)
+        except requests.exceptions.RequestException as exc:
+            if DomainHealth.is_failure(exc):
+                DomainHealth.record_failure(domain, exc)
+            raise
+
+        if response.status_code >= 500:
+            DomainHealth.record_failure(domain, f"{response.status_code} {response.reason}")
+        else:
+            DomainHealth.record_success(domain)
+        return response
+
+
+def get_http_cache_backend(purpose):
+    backend = app_settings.Http.cache_backend
+    location = app_settings.Http.cache_location
+    namespace = f"fediverser:http:{purpose}"
+
+    if backend == "redis":
+        return requests_cache.RedisCache(namespace, connection=redis.from_url(location))
+    if backend == "sqlite":
+        return requests_cache.SQLiteCache(location)
+    return requests_cache.backends.init_backend(namespace, backend)
+
+
+class CachedHttpClient(requests_cache.CacheMixin, PooledHttpClient):
+    """
+    Pooled client that keeps the responses of GET requests, for the time
+    set for each kind of endpoint. Expired responses are revalidated with
+    the server when they have an ETag or Last-Modified header, and are
+    still used when the server can not be reached.
+    """
+
+    def __init__(self, purpose, **kw):
+        super().__init__(
+            purpose=purpose,
+            backend=get_http_cache_backend(purpose),
+            expire_after=app_settings.Http.actor_cache_ttl,
+            urls_expire_after={
+                "*/.well-known/nodeinfo": app_settings.Http.nodeinfo_cache_ttl,
+                "*/nodeinfo/*": app_settings.Http.nodeinfo_cache_ttl,
+                "*/api/v3/site": app_settings.Http.site_cache_ttl,
+            },
+            cache_control=True,
+            stale_if_error=True,
+            **kw,
+        )
+
+    def request(self, method, url, *args, **kw):
+        response = super().request(method, url, *args, **kw)
+        if method.upper() == "GET":
+            record = metrics.record_hit if response.from_cache else metrics.record_miss
+            record(f"http.{self.purpose}.cache", later=True)
+        return response
+
+
+HTTP_CLIENTS = {}
+HTTP_CLIENTS_LOCK = threading.Lock()
+
+
+def make_http_client(purpose="default", headers=None, cached=False):
+    """
+    Returns the client of the calling thread for the given purpose,
+    creating it on first use. Asking for an existing purpose with
+    different options is an error, instead of silently getting a client
+    that was set up for someone else.
+    """
+
+    options = (dict(headers or {}), cached)
+    with HTTP_CLIENTS_LOCK:
+        if purpose not in HTTP_CLIENTS:
+            HTTP_CLIENTS[purpose] = {
+                "options": options,
+                "adapters": None,
+                "local": threading.local(),
+            }
+
+        clients = HTTP_CLIENTS[purpose]
+        if clients["options"] != options:
+            raise ValueError(f"HTTP client for {purpose} was created with other options")
+
+        client = getattr(clients["local"], "client", None)
+        if client is None:
+            client_class = CachedHttpClient if cached else PooledHttpClient
+            client = client_class(purpose=purpose, adapters=clients["adapters"])
+            client.headers.update(headers or {})
+            clients["adapters"] = clients["adapters"] or dict(client.adapters)
+            clients["local"].client = client
+        return client
+
+
+class DomainUnavailable(requests.exceptions.ConnectionError):
+    pass
+
+
+class DomainHealth(models.Model):
+    """
+    Circuit breaker for the domains that we send requests to. After a
+    number of connection failures in a row, requests to the domain fail
+    right away until a cool-down has passed, and the cool-down doubles
+    with every failure after that. A successful request closes it.
+
+    The breaker only lives in the cache, because requests are sent from
+    many threads and processes. The state of every domain that changed
+    is also kept in the cache, and written to the table by flush(),
+    which only runs from tasks so that requests never touch the table.
+    """
+
+    domain = models.CharField(max_length=255, unique=True)
+    failures = models.PositiveIntegerField(default=0)
+    down_since = models.DateTimeField(null=True, blank=True)
+    open_until = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True, default="")
+    flagged = models.BooleanField(
+        default=False, help_text="Instance was marked as closed for being unreachable"
     )
 
+    OPEN_CACHE_KEY = "fediverser:domains:open"
+    FAILURES_CACHE_KEY = "fediverser:domains:failures"
+    DOWN_SINCE_CACHE_KEY = "fediverser:domains:down_since"
+    STATE_CACHE_KEY = "fediverser:domains:state"
+    PENDING_CACHE_KEY = "fediverser:domains:pending"
+    SLOT_CACHE_KEY = "fediverser:domains:slot"
+    SLOT_COUNT_CACHE_KEY = "fediverser:domains:slots"
+    SLOT_CURSOR_CACHE_KEY = "fediverser:domains:flushed"
+
+    # Domains that were changed are written to numbered slots. If a slot
+    # goes missing, the domain is registered again once this is over.
+    PENDING_TIMEOUT = 3600
+
+    def __str__(self):
+        return self.domain
+
+    @staticmethod
+    def get_cool_down(failures):
+        retries = failures - app_settings.Http.circuit_breaker_threshold
+        delay = app_settings.Http.circuit_breaker_cool_down * 2 ** max(retries, 0)
+        return datetime.timedelta(
+            seconds=min(delay, app_settings.Http.circuit_breaker_max_cool_down)
+        )
+
+    @staticmethod
+    def is_failure(error):
+        # Slow instances are not down, so only failures to connect count
+        return isinstance(error, requests.exceptions.ConnectionError) and not isinstance(
+            error, DomainUnavailable
+        )
+
+    @classmethod
+    def ensure_reachable(cls, domain):
+        open_until = cache.get(f"{cls.OPEN_CACHE_KEY}:{domain}")
+        if open_until is not None:
+            metrics.increment("http.circuit_breaker.rejected")
+            raise DomainUnavailable(f"{domain} is unreachable, will retry after {open_until}")
+
+    @classmethod
+    def _set_state(cls, domain, state):
+        cache.set(f"{cls.STATE_CACHE_KEY}:{domain}", state, timeout=None)
+        if not cache.add(f"{cls.PENDING_CACHE_KEY}:{domain}", 1, timeout=cls.PENDING_TIMEOUT):
+            return
+
+        cache.add(cls.SLOT_COUNT_CACHE_KEY, 0, timeout=None)
+        try:
+            slot = cache.incr(cls.SLOT_COUNT_CACHE_KEY)
+        except ValueError:
+            # Evicted between the add and the incr
+            slot = 1
+            cache.set(cls.SLOT_COUNT_CACHE_KEY, slot, timeout=None)
+        cache.set(f"{cls.SLOT_CACHE_KEY}:{slot}", domain, timeout=None)
+
+    @classmethod
+    def record_failure(cls, domain, error):
+        now = timezone.now()
+        failures_key = f"{cls.FAILURES_CACHE_KEY}:{domain}"
+        cache.add(failures_key, 0, timeout=None)
+        try:
+            failures = cache.incr(failures_key)
+        except ValueError:
+            # Deleted by a success in between
+            failures = 1
+            cache.set(failures_key, failures, timeout=None)
+
+        open_until = None
+        if failures >= app_settings.Http.circuit_breaker_threshold:
+            cool_down = cls.get_cool_down(failures)
+            open_until = now + cool_down
+            cache.set(
+                f"{cls.OPEN_CACHE_KEY}:{domain}",
+                open_until.isoformat(),
+                timeout=cool_down.total_seconds(),
+            )
+
+        down_since_key = f"{cls.DOWN_SINCE_CACHE_KEY}:{domain}"
+        cache.add(down_since_key, now, timeout=None)
+        cls._set_state(
+            domain,
+            {
+                "failures": failures,
+                "down_since": cache.get(down_since_key, now),
+                "open_until": open_until,
+                "last_error": str(error),
+            },
+        )
+
+    @classmethod
+    def record_success(cls, domain):
+        # Only domains that were failing have anything to write
+        if cache.delete(f"{cls.FAILURES_CACHE_KEY}:{domain}"):
+            cache.delete(f"{cls.DOWN_SINCE_CACHE_KEY}:{domain}")
+            cls._set_state(domain, {"failures": 0})
+
+    @classmethod
+    def _take_pending(cls):
+        count = cache.get(cls.SLOT_COUNT_CACHE_KEY, 0)
+        cursor = min(cache.get(cls.SLOT_CURSOR_CACHE_KEY, 0), count)
+        slot_keys = [f"{cls.SLOT_CACHE_KEY}:{slot}" for slot in range(cursor + 1, count + 1)]
+        if not slot_keys:
+            return {}
+
+        domains = set(cache.get_many(slot_keys).values())
+        cache.set(cls.SLOT_CURSOR_CACHE_KEY, count, timeout=None)
+        cache.delete_many(slot_keys)
+
+        # Changes made from here on register the domain again
+        cache.delete_many([f"{cls.PENDING_CACHE_KEY}:{domain}" for domain in domains])
+        states = cache.get_many([f"{cls.STATE_CACHE_KEY}:{domain}" for domain in domains])
+        return {key.rsplit(":", 1)[1]: state for key, state in states.items()}
+
+    @classmethod
+    def flush(cls):
+        """
+        Writes the state of the domains that changed since the last flush.
+        """
+
+        pending = cls._take_pending()
+
+        recovered = [domain for domain, state in pending.items() if not state["failures"]]
+        failing = {domain: state for domain, state in pending.items() if state["failures"]}
+
+        if recovered:
+            cls.objects.filter(domain__in=recovered, failures__gt=0).update(
+                failures=0, down_since=None, open_until=None
+            )
+
+        if not failing:
+            return
+
+        cls.objects.bulk_create([cls(domain=domain) for domain in failing], ignore_conflicts=True)
+        with transaction.atomic():
+            rows = list(cls.objects.select_for_update().filter(domain__in=failing))
+            for health in rows:
+                state = failing[health.domain]
+                health.failures = state["failures"]
+                health.down_since = health.down_since or state["down_since"]
+                health.open_until = state["open_until"] or health.open_until
+                health.last_error = state["last_error"]
+            cls.objects.bulk_update(rows, ["failures", "down_since", "open_until", "last_error"])
+
+    class Meta:
+        verbose_name_plural = "Domain Health"
+
 
 @deconstructible
 class UserUpload:
@@ -61,4 +390,4 @@ class Category(TreeNode):
         verbose_name_plural = "Categories"
 
 
-__all__ = ("Category",)
+__all__ = ("Category", "DomainHealth", "DomainUnavailable")
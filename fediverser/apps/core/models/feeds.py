@@ -1,18 +1,27 @@
 import datetime
+import hashlib
+import json
 import logging
+import math
 import re
+import time
 from functools import cached_property
 
 import feedparser
+from django.contrib.contenttypes.models import ContentType
 from django.contrib.humanize.templatetags.humanize import naturaltime
-from django.db import models
+from django.db import connection, models, transaction
 from django.template.defaultfilters import slugify
 from django.utils import timezone
 from model_utils.managers import QueryManager
 from model_utils.models import TimeStampedModel
 from taggit.managers import TaggableManager
+from taggit.models import Tag, TaggedItem
 
+from .. import metrics
+from ..signals import feed_entries_created
 from .activitypub import Community
+from .reddit import RedditCommunity, RedditSubmission
 
 EPOCH = timezone.make_aware(datetime.datetime.fromtimestamp(0))
 
@@ -23,15 +32,44 @@ def parsed_datetime(time_tuple):
     return timezone.make_aware(datetime.datetime(*time_tuple[:6]))
 
 
-class Feed(TimeStampedModel):
-    FETCH_INTERVAL = datetime.timedelta(seconds=15 * 60)
+def get_entry_guid(entry):
+    return entry.get("id") or entry.get("post-id")
+
+
+def get_entry_tags(entry):
+    tags = [t.get("term") if isinstance(t, dict) else str(t) for t in entry.get("tags", [])]
+    return {slugify(tag) for tag in tags if slugify(tag)}
+
+
+def get_entry_content_hash(entry):
+    content = [entry.get("title"), entry.get("summary"), sorted(get_entry_tags(entry))]
+    return hashlib.sha1(json.dumps(content).encode()).hexdigest()
+
+
+def is_newest_first(entries):
+    dates = [parsed_datetime(entry.updated_parsed) for entry in entries]
+    return all(current >= following for current, following in zip(dates, dates[1:]))
 
-    url = models.URLField(unique=True)
+
+class Feed(TimeStampedModel):
+    MIN_FETCH_INTERVAL = datetime.timedelta(minutes=15)
+    MAX_FETCH_INTERVAL = datetime.timedelta(hours=6)
+    ENTRY_RATE_WINDOW = datetime.timedelta(days=1)
+    FETCH_BATCH_SIZE = 100
+    MULTIREDDIT_MAX_SUBREDDITS = 50
+    MULTIREDDIT_ENTRIES_PER_FETCH = 100
+
+    # Multireddit urls list the names of all subreddits in the group
+    url = models.URLField(max_length=2000, unique=True)
     title = models.TextField(null=True)
     subtitle = models.TextField(null=True, blank=True)
-    etag = models.CharField(max_length=50, null=True, blank=True, db_index=True)
+    etag = models.CharField(max_length=255, null=True, blank=True, db_index=True)
+    last_modified = models.CharField(max_length=50, null=True, blank=True)
     last_fetched = models.DateTimeField(null=True, blank=True)
+    last_entry_guid = models.CharField(max_length=500, null=True, blank=True)
+    next_fetch_at = models.DateTimeField(null=True, blank=True, db_index=True)
     is_active = models.BooleanField(db_index=True, default=True)
+    subreddits = models.ManyToManyField(RedditCommunity, related_name="feeds", blank=True)
 
     objects = models.Manager()
     active = QueryManager(is_active=True)
@@ -42,35 +80,237 @@ class Feed(TimeStampedModel):
 
         return f"{self.title} ({self.url})"
 
+    @property
+    def is_due(self):
+        return self.next_fetch_at is None or self.next_fetch_at <= timezone.now()
+
+    def get_fetch_interval(self):
+        """
+        Spreads the fetches so that we expect about one new entry per
+        fetch, based on how many entries were published recently.
+        Quiet feeds back off to MAX_FETCH_INTERVAL, busy ones are
+        fetched every MIN_FETCH_INTERVAL.
+        """
+
+        since = timezone.now() - Feed.ENTRY_RATE_WINDOW
+        recent_entries = self.entries.filter(created__gte=since).count()
+        interval = Feed.ENTRY_RATE_WINDOW / (recent_entries + 1)
+        return min(max(interval, Feed.MIN_FETCH_INTERVAL), Feed.MAX_FETCH_INTERVAL)
+
+    def schedule_next_fetch(self, save=True):
+        self.next_fetch_at = timezone.now() + self.get_fetch_interval()
+        if save:
+            self.save(update_fields=["next_fetch_at", "modified"])
+
+    def get_validators(self, force=False):
+        # Validators are only sent back if they came from a response we
+        # processed. A forced fetch always asks for the full document.
+        return {} if force else {"etag": self.etag, "modified": self.last_modified}
+
     def fetch(self, force=False):
         logger.info(f"Feed {self.url} requested")
 
+        if not force and not self.is_due:
+            time_to_fetch = naturaltime(self.next_fetch_at)
+            logger.info(f"Skipping {self.url} because it is only due {time_to_fetch}")
+            return
+
+        result = feedparser.parse(self.url, **self.get_validators(force=force))
+        self.process(result, force=force)
+
+    def process(self, result, force=False):
         last_checked = self.last_fetched or EPOCH
         now = timezone.now()
-        if not force and (now - last_checked < Feed.FETCH_INTERVAL):
-            time_ago = naturaltime(last_checked)
-            logger.info(f"Skipping {self.url} because it was fetched only {time_ago}")
-            return
 
-        result = feedparser.parse(self.url)
-        for entry in result.entries:
-            if not entry.get("link"):
-                continue
+        if result.get("status") == 304:
+            metrics.record_hit("feeds.conditional_get")
+            logger.info(f"Feed {self.url} has not been modified")
+            self.last_fetched = now
+            self.schedule_next_fetch(save=False)
+            self.save(update_fields=["last_fetched", "next_fetch_at", "modified"])
+            return
 
-            entry_age = now - parsed_datetime(entry.updated_parsed)
+        metrics.record_miss("feeds.conditional_get")
+        entries = [entry for entry in result.entries if entry.get("link")]
+
+        # When the feed lists its newest entries first, everything after
+        # the first entry we have already seen is old, and we can stop
+        # there. Feeds in any other order (e.g, reddit's "hot") need to
+        # be checked entry by entry.
+        stop_at_seen = not force and is_newest_first(entries)
+
+        accepted = []
+        for entry in entries:
+            updated = parsed_datetime(entry.updated_parsed)
+            if stop_at_seen and (
+                updated <= last_checked or get_entry_guid(entry) == self.last_entry_guid
+            ):
+                logger.info(f"Reached entries of {self.url} seen before at {entry.link}")
+                break
+
+            entry_age = now - updated
             try:
                 assert entry_age < Entry.MAX_AGE, "too old"
-                assert parsed_datetime(entry.updated_parsed) > last_checked, "already checked"
-                Entry.make(entry=entry, feed=self)
+                assert updated > last_checked, "already checked"
+                accepted.append(entry)
             except AssertionError as exc:
                 if force:
-                    Entry.make(entry=entry, feed=self)
+                    accepted.append(entry)
                 else:
                     logger.info(f"Skipping entry {entry.link}: {exc}")
 
+        Entry.bulk_make(entries=accepted, feed=self)
+
+        if entries:
+            self.last_entry_guid = get_entry_guid(entries[0])
+        self.etag = result.get("etag")
+        self.last_modified = result.get("modified")
         self.last_fetched = now
+        self.schedule_next_fetch(save=False)
         self.save()
 
+    @classmethod
+    def claim_due_feeds(cls, batch_size=None):
+        """
+        Returns the next batch of active feeds that are due for fetching.
+
+        Claimed feeds are pushed forward by MIN_FETCH_INTERVAL, so that
+        concurrent runs of the scheduler don't pick the same ones. They
+        get their real schedule once they are processed.
+        """
+
+        now = timezone.now()
+        is_due = models.Q(next_fetch_at__isnull=True) | models.Q(next_fetch_at__lte=now)
+        due_feeds = cls.active.filter(is_due).order_by(
+            models.F("next_fetch_at").asc(nulls_first=True)
+        )
+
+        with transaction.atomic():
+            feeds = list(
+                due_feeds.select_for_update(skip_locked=True)[: batch_size or cls.FETCH_BATCH_SIZE]
+            )
+            cls.objects.filter(id__in=[feed.id for feed in feeds]).update(
+                next_fetch_at=now + cls.MIN_FETCH_INTERVAL
+            )
+        return feeds
+
+    @classmethod
+    def get_multireddit_url(cls, subreddit_names):
+        names = "+".join(sorted(subreddit_names, key=str.lower))
+        return f"https://reddit.com/r/{names}/new.rss?limit={cls.MULTIREDDIT_ENTRIES_PER_FETCH}"
+
+    @classmethod
+    def group_subreddits(cls, subreddits):
+        """
+        Splits the subreddits in groups that can be read from a single
+        multireddit feed. Busy subreddits end up in smaller groups, so
+        that no group publishes more than a feed can carry.
+
+        Groups of the active multireddit feeds are kept as they are, so
+        that their feeds keep their urls and fetching state. Only groups
+        that lost subreddits or got too busy change, and new subreddits
+        are added to the first group with room for them.
+        """
+
+        since = timezone.now() - cls.ENTRY_RATE_WINDOW
+        activity = dict(
+            RedditSubmission.objects.filter(subreddit__in=subreddits, created__gte=since)
+            .values("subreddit")
+            .annotate(total=models.Count("id"))
+            .values_list("subreddit", "total")
+        )
+
+        # Each feed is fetched at most every MIN_FETCH_INTERVAL. We
+        # keep half of what it can return in that time as headroom.
+        fetches_per_window = cls.ENTRY_RATE_WINDOW / cls.MIN_FETCH_INTERVAL
+        capacity = cls.MULTIREDDIT_ENTRIES_PER_FETCH * fetches_per_window / 2
+
+        max_url_length = cls._meta.get_field("url").max_length
+
+        def fits(group, load, subreddit):
+            url = cls.get_multireddit_url([s.name for s in group] + [subreddit.name])
+            return (
+                len(group) < cls.MULTIREDDIT_MAX_SUBREDDITS
+                and load + activity.get(subreddit.id, 0) <= capacity
+                and len(url) <= max_url_length
+            )
+
+        def sort_key(subreddit):
+            magnitude = int(math.log2(activity.get(subreddit.id, 0) + 1))
+            return (-magnitude, subreddit.name.lower())
+
+        def pack(subreddits):
+            groups = []
+            group = []
+            load = 0
+            for subreddit in sorted(subreddits, key=sort_key):
+                if group and not fits(group, load, subreddit):
+                    groups.append(group)
+                    group = []
+                    load = 0
+                group.append(subreddit)
+                load += activity.get(subreddit.id, 0)
+
+            if group:
+                groups.append(group)
+            return groups
+
+        by_id = {subreddit.id: subreddit for subreddit in subreddits}
+        existing = cls.active.filter(subreddits__in=by_id.keys()).distinct().order_by("id")
+
+        groups = []
+        grouped = set()
+        for feed in existing.prefetch_related("subreddits"):
+            members = [
+                by_id[s.id] for s in feed.subreddits.all() if s.id in by_id and s.id not in grouped
+            ]
+            grouped.update(subreddit.id for subreddit in members)
+            groups.extend(pack(members))
+
+        loads = [sum(activity.get(subreddit.id, 0) for subreddit in group) for group in groups]
+        ungrouped = []
+        new_subreddits = [s for s in by_id.values() if s.id not in grouped]
+        for subreddit in sorted(new_subreddits, key=sort_key):
+            for index, group in enumerate(groups):
+                if fits(group, loads[index], subreddit):
+                    group.append(subreddit)
+                    loads[index] += activity.get(subreddit.id, 0)
+                    break
+            else:
+                ungrouped.append(subreddit)
+
+        return groups + pack(ungrouped)
+
+    @classmethod
+    def make_subreddit_feeds(cls, subreddits):
+        """
+        Makes sure that the given subreddits are followed through
+        multireddit feeds, and deactivates the feeds (multireddit or
+        single subreddit) that are replaced by them.
+        """
+
+        subreddits = list(subreddits)
+        feeds = []
+        for group in cls.group_subreddits(subreddits):
+            url = cls.get_multireddit_url([subreddit.name for subreddit in group])
+            feed, _ = cls.objects.update_or_create(url=url, defaults={"is_active": True})
+            feed.subreddits.set(group)
+            feeds.append(feed)
+
+        replaced_multireddits = cls.objects.filter(subreddits__isnull=False).exclude(
+            id__in=[feed.id for feed in feeds]
+        )
+        single_subreddit_urls = [
+            f"https://reddit.com/r/{subreddit.name}/hot.rss" for subreddit in subreddits
+        ]
+        cls.objects.filter(
+            models.Q(id__in=replaced_multireddits.values("id"))
+            | models.Q(url__in=single_subreddit_urls)
+        ).update(is_active=False)
+
+        logger.info(f"{len(subreddits)} subreddits are followed through {len(feeds)} feeds")
+        return feeds
+
     @classmethod
     def make(cls, url):
         feed = cls.objects.filter(url=url).first()
@@ -81,19 +321,20 @@ class Feed(TimeStampedModel):
                 url=url,
                 title=result.feed.title,
                 subtitle=getattr(result.feed, "subtitle", None),
-                etag=getattr(result, "etag", None),
             )
         return feed
 
 
 class Entry(TimeStampedModel):
     MAX_AGE = datetime.timedelta(days=7)
+    PURGE_BATCH_SIZE = 1000
 
     feed = models.ForeignKey(Feed, related_name="entries", on_delete=models.CASCADE)
     link = models.URLField(unique=True)
     title = models.TextField(null=True, blank=True)
     guid = models.CharField(max_length=500, null=True, blank=True, db_index=True)
     summary = models.TextField(null=True, blank=True)
+    content_hash = models.CharField(max_length=40, null=True, blank=True)
     tags = TaggableManager()
 
     def __str__(self):
@@ -121,26 +362,158 @@ class Entry(TimeStampedModel):
 
     @classmethod
     def make(cls, entry, feed):
-        link = entry.get("link")
-        tag_list = entry.get("tags", [])
-        tags = [t.get("term") if isinstance(t, dict) else str(t) for t in tag_list]
-        obj, _ = cls.objects.update_or_create(
-            feed=feed,
-            link=link,
-            defaults={
-                "title": entry.title,
-                "summary": entry.summary,
-                "created": parsed_datetime(entry.published_parsed),
-                "modified": parsed_datetime(entry.updated_parsed),
-                "guid": entry.get("id") or entry.get("post-id"),
-                "tags": ", ".join([slugify(tag) for tag in tags]),
-            },
+        written = cls.bulk_make(entries=[entry], feed=feed)
+        return written[0] if written else cls.objects.filter(link=entry.get("link")).first()
+
+    @classmethod
+    def _set_tags(cls, entries, tag_names):
+        """
+        Replaces the tags of the given entries, with one query to find
+        the existing tags and a bulk insert for the missing ones and for
+        all the tag links.
+        """
+
+        names = {name for entry in entries for name in tag_names[entry.link]}
+        content_type = ContentType.objects.get_for_model(cls)
+
+        def resolve_tags():
+            tags = Tag.objects.filter(models.Q(name__in=names) | models.Q(slug__in=names))
+            return {key: tag.id for tag in tags for key in (tag.name, tag.slug)}
+
+        tag_ids = resolve_tags()
+        missing = names.difference(tag_ids)
+        if missing:
+            Tag.objects.bulk_create(
+                [Tag(name=name, slug=name) for name in missing], ignore_conflicts=True
+            )
+            tag_ids = resolve_tags()
+
+        TaggedItem.objects.filter(
+            content_type=content_type, object_id__in=[entry.id for entry in entries]
+        ).delete()
+        TaggedItem.objects.bulk_create(
+            [
+                TaggedItem(content_type=content_type, object_id=entry.id, tag_id=tag_ids[name])
+                for entry in entries
+                for name in tag_names[entry.link]
+                if name in tag_ids
+            ],
+            ignore_conflicts=True,
         )
 
-        return obj
+    @classmethod
+    def bulk_make(cls, entries, feed):
+        """
+        Upserts all the parsed entries from one feed in a single
+        statement, and sends feed_entries_created with the ones that
+        were not in the database yet.
+
+        Entries that we have already seen (by link or by guid) with the
+        same content hash are left alone, so feeds that keep
+        re-publishing the same items don't cause any writes. Returns
+        the entries that were written.
+        """
+
+        objects = {}
+        tag_names = {}
+        for entry in entries:
+            link = entry.get("link")
+            tag_names[link] = get_entry_tags(entry)
+            objects[link] = cls(
+                feed=feed,
+                link=link,
+                title=entry.title,
+                summary=entry.summary,
+                created=parsed_datetime(entry.published_parsed),
+                modified=parsed_datetime(entry.updated_parsed),
+                guid=get_entry_guid(entry),
+                content_hash=get_entry_content_hash(entry),
+            )
+
+        if not objects:
+            return []
+
+        guids = [obj.guid for obj in objects.values() if obj.guid]
+        seen = cls.objects.filter(
+            models.Q(link__in=objects.keys()) | models.Q(feed=feed, guid__in=guids)
+        ).values_list("link", "guid", "content_hash")
+
+        existing = set()
+        unchanged = set()
+        for link, guid, content_hash in seen:
+            existing.add(link)
+            unchanged.update({(link, content_hash), (guid, content_hash)})
+
+        changed = [
+            obj
+            for obj in objects.values()
+            if (obj.link, obj.content_hash) not in unchanged
+            and (obj.guid is None or (obj.guid, obj.content_hash) not in unchanged)
+        ]
+        logger.info(f"{len(objects) - len(changed)} unchanged entries from {feed.url}")
+
+        if not changed:
+            return []
+
+        with transaction.atomic():
+            saved = cls.objects.bulk_create(
+                changed,
+                update_conflicts=True,
+                unique_fields=["link"],
+                update_fields=["title", "summary", "created", "modified", "guid", "content_hash"],
+            )
+            cls._set_tags(saved, tag_names)
+
+        created = [entry for entry in saved if entry.link not in existing]
+        if created:
+            feed_entries_created.send(sender=cls, feed=feed, entries=created)
+        return saved
+
+    @classmethod
+    def purge(cls, cutoff, batch_size=None):
+        """
+        Deletes all entries last modified before the cutoff.
+
+        Rows are removed in keyset-ordered batches, each in its own
+        short transaction, and the tag links are deleted with plain SQL
+        instead of going through the cascade collector, so we never
+        have to load the entries (or their tags) in memory.
+        """
+
+        batch_size = batch_size or cls.PURGE_BATCH_SIZE
+        content_type = ContentType.objects.get_for_model(cls)
+        expired = cls.objects.filter(modified__lte=cutoff).order_by("id")
+
+        started = time.monotonic()
+        last_id = 0
+        total_deleted = 0
+
+        while True:
+            entry_ids = list(
+                expired.filter(id__gt=last_id).values_list("id", flat=True)[:batch_size]
+            )
+            if not entry_ids:
+                break
+
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(
+                    f"DELETE FROM {TaggedItem._meta.db_table} "
+                    "WHERE content_type_id = %s AND object_id = ANY(%s)",
+                    [content_type.id, entry_ids],
+                )
+                cursor.execute(f"DELETE FROM {cls._meta.db_table} WHERE id = ANY(%s)", [entry_ids])
+                total_deleted += cursor.rowcount
+
+            last_id = entry_ids[-1]
+
+        elapsed = time.monotonic() - started
+        rate = total_deleted / elapsed if elapsed else 0
+        logger.info(f"Removed {total_deleted} feed entries in {elapsed:.2f}s ({rate:.0f} rows/s)")
+        return total_deleted
 
     class Meta:
         verbose_name_plural = "Feed Entries"
+        indexes = [models.Index(fields=["modified"], name="core_entry_modified_idx")]
 
 
 class CommunityFeed(models.Model):
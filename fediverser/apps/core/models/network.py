@@ -1,10 +1,21 @@
+import datetime
+import hashlib
+import json
 import logging
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urlencode, urlparse
 
-from django.db import models
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models, transaction
+from django.db.models import Max, Q
 from django.utils import timezone
 from model_utils.managers import InheritanceManager
 from model_utils.models import StatusModel, TimeStampedModel
+from requests.exceptions import ConnectionError
 
 from fediverser.apps.core.models.common import AP_SERVER_SOFTWARE, INSTANCE_STATUSES
 from fediverser.apps.core.settings import app_settings
@@ -25,8 +36,16 @@ class FediversedInstanceQuerySet(models.QuerySet):
     def get_current(self):
         return self.filter(portal_url=app_settings.Portal.url).first()
 
+    def with_sync_status(self):
+        return self.annotate(
+            last_sync_attempt=Max("sync_jobs__run_on"),
+            last_sync_success=Max("sync_jobs__run_on", filter=Q(sync_jobs__succeeded=True)),
+        )
+
 
-class FediversedInstancePartnerModelManager(models.Manager):
+class FediversedInstancePartnerModelManager(
+    models.Manager.from_queryset(FediversedInstanceQuerySet)
+):
     def get_queryset(self):
         qs = super().get_queryset()
         return qs.exclude(portal_url=app_settings.Portal.url)
@@ -53,16 +72,27 @@ class FediversedInstance(models.Model):
     accepts_community_requests = models.BooleanField(
         default=False, help_text="Accepts Community Requests"
     )
+    change_feed_cursor = models.BigIntegerField(
+        null=True, blank=True, help_text="Id of the last change feed entry pulled from partner"
+    )
+    push_secret = models.CharField(
+        max_length=64, null=True, blank=True, help_text="Secret to verify pushed entries"
+    )
+    sync_failures = models.PositiveIntegerField(
+        default=0, help_text="Consecutive failed attempts to pull the change feed from partner"
+    )
 
     objects = FediversedInstanceQuerySet.as_manager()
     partners = FediversedInstancePartnerModelManager()
 
+    _current = None
+    _current_lock = threading.RLock()
+
     def submit_registration(self, partner):
         if self == partner:
             raise ValueError("Attempt to submit registration to itself")
 
-        client = make_http_client()
-        client.headers.update({"Content-Type": "application/json"})
+        client = make_http_client("federation")
         url = f"{partner.portal_url}/api/fediverser-instances"
         response = client.post(url, json={"portal_url": self.portal_url})
         response.raise_for_status()
@@ -89,13 +119,17 @@ class FediversedInstance(models.Model):
         return self.portal_url
 
     @classmethod
-    def current(cls):
-        NODE_CONFIGURATION = {
+    def get_node_configuration(cls):
+        return {
             "accepts_community_requests": app_settings.Portal.accepts_community_requests,
             "allows_reddit_signup": app_settings.Portal.signup_with_reddit,
             "allows_reddit_mirrored_content": lemmy_settings.Instance.reddit_mirror_bots_enabled,
             "creates_reddit_mirror_bots": app_settings.Reddit.mirroring_enabled,
         }
+
+    @classmethod
+    def register_current(cls):
+        NODE_CONFIGURATION = cls.get_node_configuration()
         lemmy_instance = InstanceProxy.get_connected_instance()
 
         if lemmy_instance is not None:
@@ -116,6 +150,29 @@ class FediversedInstance(models.Model):
         )
         return fediversed_instance
 
+    @classmethod
+    def current(cls):
+        """
+        Returns the instance representing this node. It is registered
+        on first use in each process and kept in memory, and registered
+        again only when the settings it is derived from change.
+        """
+
+        settings_key = (
+            app_settings.Portal.url,
+            lemmy_settings.Instance.domain,
+            *cls.get_node_configuration().values(),
+        )
+        with cls._current_lock:
+            if cls._current is None or cls._current[0] != settings_key:
+                cls._current = (settings_key, cls.register_current())
+            return cls._current[1]
+
+    @classmethod
+    def clear_current(cls):
+        with cls._current_lock:
+            cls._current = None
+
     @classmethod
     def fetch(cls, url):
         url = url.removesuffix("/")
@@ -123,7 +180,7 @@ class FediversedInstance(models.Model):
         scheme = parsed_url.scheme
         domain = parsed_url.hostname
 
-        client = make_http_client()
+        client = make_http_client("federation")
 
         nodeinfo_url = f"{scheme}://{domain}/api/nodeinfo"
         response = client.get(nodeinfo_url, headers={"Accept": "application/json"})
@@ -137,45 +194,97 @@ class FediversedInstance(models.Model):
         instance, _ = cls.objects.update_or_create(portal_url=url, defaults=data)
         return instance
 
-    def sync_change_feeds(self, since=None):
-        client = make_http_client()
-        url = f"{self.portal_url}/api/changes?page=1"
+    def get_sync_lag(self, now=None):
+        """
+        Time since the change feed of the partner was last pulled
+        successfully, or None if it never was. Relies on the annotation
+        from `with_sync_status` when it is available.
+        """
 
-        keep_going = True
+        try:
+            last_sync_success = self.last_sync_success
+        except AttributeError:
+            last_sync_success = self.sync_jobs.filter(succeeded=True).aggregate(
+                run_on=Max("run_on")
+            )["run_on"]
+
+        return last_sync_success and (now or timezone.now()) - last_sync_success
+
+    def get_sync_backoff(self):
+        delay = app_settings.Federation.sync_retry_delay * 2 ** max(self.sync_failures - 1, 0)
+        return datetime.timedelta(seconds=min(delay, app_settings.Federation.sync_max_retry_delay))
+
+    def advance_change_feed_cursor(self, previous_id, cursor):
+        # Only moves forward, and only when nothing between the current
+        # cursor and the given entries would be skipped.
+        continues = Q(change_feed_cursor__gte=previous_id, change_feed_cursor__lt=cursor)
+        if previous_id == 0:
+            continues |= Q(change_feed_cursor__isnull=True)
+
+        if FediversedInstance.objects.filter(continues, id=self.id).update(
+            change_feed_cursor=cursor
+        ):
+            self.change_feed_cursor = cursor
+
+    def sync_change_feeds(self, since=None, max_pages=None, max_seconds=None):
+        """
+        Pulls the change feed of the partner, until it is exhausted or
+        the budget of pages or seconds runs out, and records the
+        attempt as a SyncJob. Pages that were ingested are kept even if
+        a later one fails, the cursor tells where to pick up again.
+        """
+
+        client = make_http_client("federation")
+        timeout = app_settings.Federation.sync_timeout
+        deadline = max_seconds and time.monotonic() + max_seconds
 
         # Ensure we alawys have a timezone-aware datetime
         if since is not None and since.tzinfo is None:
             since = timezone.make_aware(since)
 
-        while keep_going:
-            if since:
-                url += "&" + urlencode({"since": since.isoformat()})
+        # Once we have a cursor, it alone tells where to continue from.
+        # Partners that don't support it will ignore it and give us their
+        # regular pages.
+        params = {"after_id": self.change_feed_cursor or 0}
+        if since and self.change_feed_cursor is None:
+            params["since"] = since.isoformat()
+
+        resolver = ChangeFeedResolver()
+        url = f"{self.portal_url}/api/changes?{urlencode(params)}"
+        pages = entry_count = 0
+        succeeded = True
+        while url:
+            if (max_pages and pages >= max_pages) or (deadline and time.monotonic() >= deadline):
+                logger.info(f"Sync budget for {self} is exhausted, will continue from {url}")
+                break
+
             try:
-                response = client.get(url, headers={"Accept": "application/json"})
+                response = client.get(url, headers={"Accept": "application/json"}, timeout=timeout)
                 response.raise_for_status()
                 entries = response.json()
-                for entry in entries:
-                    try:
-                        feed_entry = ChangeFeedEntry.make(instance=self, entry=entry)
-                        logger.debug(f"Created {feed_entry}")
-                    except Exception as exc:
-                        logger.warning(
-                            f"Failed to parse feed entry: {exc}", extra={"entry": entry}
-                        )
-                try:
-                    url = [
-                        st.strip().split(";")[0].removeprefix("<").removesuffix(">")
-                        for st in response.headers["link"].split(",")
-                        if 'rel="next"' in st
-                    ].pop()
+                ChangeFeedEntry.ingest(instance=self, entries=entries, resolver=resolver)
+                pages += 1
+                entry_count += len(entries)
+
+                cursor = max((entry["id"] for entry in entries if "id" in entry), default=None)
+                if cursor is not None:
+                    self.change_feed_cursor = cursor
+                    self.save(update_fields=["change_feed_cursor"])
+
+                url = response.links.get("next", {}).get("url")
+                if url:
                     logger.debug(f"Will continue pull from {url}")
-                except (IndexError, KeyError):
-                    keep_going = False
             except Exception:
                 logger.exception(f"Failed to sync change feed from {self}")
-                keep_going = False
+                succeeded = False
+                break
+
+        self.sync_failures = 0 if succeeded else self.sync_failures + 1
+        self.save(update_fields=["sync_failures"])
 
-        self.sync_jobs.create()
+        return self.sync_jobs.create(
+            succeeded=succeeded, caught_up=succeeded and not url, entry_count=entry_count
+        )
 
 
 class Endorsement(models.Model):
@@ -190,6 +299,96 @@ class Endorsement(models.Model):
         unique_together = ("endorser", "endorsed")
 
 
+class TrustScore(models.Model):
+    """
+    Transitive trust that this portal places on every other portal,
+    derived from the endorsement graph with a personalised PageRank that
+    starts from us. Kept in a table so that listings and rankings can
+    use it without walking the endorsements on every request.
+    """
+
+    instance = models.OneToOneField(
+        FediversedInstance, related_name="trust_score", on_delete=models.CASCADE
+    )
+    score = models.FloatField(default=0.0, db_index=True)
+    endorsed = models.BooleanField(default=False, help_text="Directly endorsed by this portal")
+    updated = models.DateTimeField(auto_now=True)
+
+    @staticmethod
+    def compute(edges, source, previous=None):
+        """
+        Runs the power iteration over the (endorser, endorsed) edges,
+        returning the score of every node reachable from the source.
+        Scores from a previous run are used as the starting point, so
+        that small changes to the graph converge in a few iterations.
+        """
+
+        damping = app_settings.Federation.trust_damping
+
+        endorsements = defaultdict(list)
+        for endorser, endorsed in edges:
+            endorsements[endorser].append(endorsed)
+
+        nodes = {
+            source,
+            *endorsements,
+            *(node for nodes in endorsements.values() for node in nodes),
+        }
+        scores = {node: (previous or {}).get(node, 0.0) for node in nodes}
+        total = sum(scores.values())
+        if total > 0:
+            scores = {node: score / total for node, score in scores.items()}
+        else:
+            scores[source] = 1.0
+
+        for _ in range(app_settings.Federation.trust_max_iterations):
+            updated = dict.fromkeys(nodes, 0.0)
+
+            # Trust from portals that endorse no one goes back to us
+            returned = 1.0 - damping
+            for node, score in scores.items():
+                targets = endorsements.get(node)
+                if not targets:
+                    returned += damping * score
+                    continue
+                share = damping * score / len(targets)
+                for target in targets:
+                    updated[target] += share
+            updated[source] += returned
+
+            delta = sum(abs(updated[node] - scores[node]) for node in nodes)
+            scores = updated
+            if delta < app_settings.Federation.trust_tolerance:
+                break
+
+        return scores
+
+    @classmethod
+    def rebuild(cls):
+        source = FediversedInstance.current()
+        edges = list(Endorsement.objects.values_list("endorser_id", "endorsed_id"))
+        previous = dict(cls.objects.values_list("instance_id", "score"))
+        scores = cls.compute(edges, source.id, previous=previous)
+        endorsed = {target for endorser, target in edges if endorser == source.id}
+
+        return cls.objects.bulk_create(
+            [
+                cls(
+                    instance_id=instance_id,
+                    score=scores.get(instance_id, 0.0),
+                    endorsed=instance_id in endorsed,
+                )
+                for instance_id in FediversedInstance.objects.values_list("id", flat=True)
+            ],
+            update_conflicts=True,
+            unique_fields=["instance"],
+            update_fields=["score", "endorsed", "updated"],
+        )
+
+    def __str__(self):
+        return f"Trust on {self.instance}: {self.score:.4f}"
+
+
 class ConnectedRedditAccount(models.Model):
     reddit_account = models.ForeignKey(
         RedditAccount, related_name="connected_activitypub_accounts", on_delete=models.CASCADE
@@ -202,6 +401,159 @@ class ConnectedRedditAccount(models.Model):
         unique_together = ("reddit_account", "actor")
 
 
+class ChangeFeedResolver:
+    """
+    Resolves the accounts, actors and subreddits referenced by change
+    feed entries, so that the entries themselves can be created without
+    any remote calls.
+
+    Remote lookups run concurrently in a bounded thread pool, while all
+    database writes happen on the calling thread. Results are kept for
+    the lifetime of the resolver, so a sync does not look up the same
+    reference twice, not even when it failed the first time.
+    """
+
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers or app_settings.Federation.resolver_threads
+        self.resolved = defaultdict(dict)
+        self.failed = set()
+
+    def _get_key(self, kind, key):
+        return key.lower() if kind == "subreddit" else key
+
+    def get(self, kind, key):
+        try:
+            return self.resolved[kind][self._get_key(kind, key)]
+        except KeyError:
+            raise ValueError(f"could not resolve {kind} {key}")
+
+    def _run_concurrently(self, func, items):
+        def call(item):
+            try:
+                return func(item)
+            except Exception as exc:
+                return exc
+
+        items = list(items)
+        if not items:
+            return {}
+
+        with ThreadPoolExecutor(min(self.max_workers, len(items))) as pool:
+            return dict(zip(items, pool.map(call, items)))
+
+    def _get_pending(self, kind, keys):
+        return {
+            key
+            for key in keys
+            if self._get_key(kind, key) not in self.resolved[kind]
+            and (kind, self._get_key(kind, key)) not in self.failed
+        }
+
+    def _resolve_instances(self, domains):
+        known = Instance.objects.filter(domain__in=domains)
+        instances = {instance.domain: instance for instance in known}
+
+        software_infos = self._run_concurrently(
+            lambda domain: Instance.get_software_info(f"https://{domain}"),
+            [domain for domain in domains if domain not in instances],
+        )
+        for domain, software_info in software_infos.items():
+            if isinstance(software_info, ConnectionError):
+                software_info = None
+            elif isinstance(software_info, Exception):
+                logger.warning(f"Failed to get software info from {domain}: {software_info}")
+                continue
+
+            try:
+                instances[domain] = Instance.make(domain, software_info)
+            except Exception as exc:
+                logger.warning(f"Failed to register instance {domain}: {exc}")
+
+        return instances
+
+    def _resolve_actors(self, person_urls, community_urls):
+        actor_models = {"person": Person, "community": Community}
+        pending = {"person": set(person_urls), "community": set(community_urls)}
+
+        for kind, model in actor_models.items():
+            for actor in model.objects.filter(url__in=pending[kind]).select_related("instance"):
+                self.resolved[kind][actor.url] = actor
+                pending[kind].discard(actor.url)
+
+        inactive_domains = set(
+            Instance.objects.filter(
+                domain__in={urlparse(url).hostname for url in pending["community"]},
+                annotation__status__in=[INSTANCE_STATUSES.closed, INSTANCE_STATUSES.abandoned],
+            ).values_list("domain", flat=True)
+        )
+        for url in list(pending["community"]):
+            if urlparse(url).hostname in inactive_domains:
+                logger.info(f"{url} is from an inactive instance")
+                self.failed.add(("community", url))
+                pending["community"].discard(url)
+
+        urls = {url: kind for kind, kind_urls in pending.items() for url in kind_urls}
+        instances = self._resolve_instances({urlparse(url).hostname for url in urls})
+
+        reachable = [url for url in urls if urlparse(url).hostname in instances]
+        for url in urls.keys() - set(reachable):
+            self.failed.add((urls[url], url))
+
+        for url, metadata in self._run_concurrently(Person.get_metadata, reachable).items():
+            kind = urls[url]
+            try:
+                if isinstance(metadata, Exception):
+                    raise metadata
+                instance = instances[urlparse(url).hostname]
+                self.resolved[kind][url] = actor_models[kind].make(url, instance, metadata)
+            except Exception as exc:
+                logger.warning(f"Failed to resolve {url}: {exc}")
+                self.failed.add((kind, url))
+
+    def _resolve_subreddits(self, names):
+        try:
+            subreddits = RedditCommunity.fetch_many(names)
+        except Exception as exc:
+            logger.warning(f"Failed to resolve subreddits: {exc}")
+            subreddits = {}
+
+        self.resolved["subreddit"].update(subreddits)
+        self.failed.update(
+            ("subreddit", name.lower()) for name in names if name.lower() not in subreddits
+        )
+
+    def _resolve_portals(self, portal_urls):
+        FediversedInstance.objects.bulk_create(
+            [FediversedInstance(portal_url=url) for url in portal_urls], ignore_conflicts=True
+        )
+        self.resolved["portal"].update(
+            (portal.portal_url, portal)
+            for portal in FediversedInstance.objects.filter(portal_url__in=portal_urls)
+        )
+
+    def resolve(self, references):
+        """
+        Takes a mapping of reference kind to the set of keys that need
+        to be resolved and resolves all the ones not seen before.
+        """
+
+        pending = {kind: self._get_pending(kind, keys) for kind, keys in references.items()}
+
+        if pending.get("reddit_account"):
+            self.resolved["reddit_account"].update(
+                RedditAccount.bulk_make(pending["reddit_account"])
+            )
+
+        if pending.get("portal"):
+            self._resolve_portals(pending["portal"])
+
+        if pending.get("subreddit"):
+            self._resolve_subreddits(pending["subreddit"])
+
+        if pending.get("person") or pending.get("community"):
+            self._resolve_actors(pending.get("person", ()), pending.get("community", ()))
+
+
 class ChangeFeedEntry(TimeStampedModel):
     TYPE = None
     published_by = models.ForeignKey(
@@ -220,6 +572,14 @@ class ChangeFeedEntry(TimeStampedModel):
         except AttributeError:
             return None
 
+    def get_payload(self):
+        return {
+            "id": self.id,
+            "description": self.description,
+            "type": self.TYPE,
+            "created": self.created,
+        }
+
     def merge(self):
         self._merge()
         MergedEntry.objects.create(entry=self)
@@ -228,9 +588,60 @@ class ChangeFeedEntry(TimeStampedModel):
         raise NotImplementedError("This needs to be implemented by the child class")
 
     @classmethod
-    def make(cls, instance, entry):
-        change_subclass = {klass.TYPE: klass for klass in cls.__subclasses__()}.get(entry["type"])
-        return change_subclass.make(instance, entry)
+    def get_entry_class(cls, entry_type):
+        return {klass.TYPE: klass for klass in cls.__subclasses__()}.get(entry_type)
+
+    @classmethod
+    def collect_references(cls, entry, references):
+        raise NotImplementedError("This needs to be implemented by the child class")
+
+    @classmethod
+    def ingest(cls, instance, entries, resolver=None):
+        """
+        Creates the entries of one page of a partner's change feed.
+
+        Everything the entries refer to is collected first and resolved
+        in one go by the resolver, so that the remote lookups for the
+        whole page can run concurrently. Entries that can not be parsed
+        or resolved are logged and skipped.
+        """
+
+        resolver = resolver or ChangeFeedResolver()
+        references = defaultdict(set)
+        parsed = []
+
+        for entry in entries:
+            try:
+                change_subclass = cls.get_entry_class(entry["type"])
+                assert change_subclass is not None, f"unknown entry type {entry['type']}"
+                change_subclass.collect_references(entry, references)
+                parsed.append((change_subclass, entry))
+            except Exception as exc:
+                logger.warning(f"Failed to parse feed entry: {exc}", extra={"entry": entry})
+
+        resolver.resolve(references)
+
+        feed_entries = []
+        with transaction.atomic():
+            for change_subclass, entry in parsed:
+                try:
+                    with transaction.atomic():
+                        feed_entry = change_subclass.make(instance, entry, resolver=resolver)
+                    logger.debug(f"Created {feed_entry}")
+                    feed_entries.append(feed_entry)
+                except Exception as exc:
+                    logger.warning(f"Failed to create feed entry: {exc}", extra={"entry": entry})
+        return feed_entries
+
+    @classmethod
+    def make(cls, instance, entry, resolver=None):
+        change_subclass = cls if cls.TYPE else cls.get_entry_class(entry["type"])
+        if resolver is None:
+            resolver = ChangeFeedResolver()
+            references = defaultdict(set)
+            change_subclass.collect_references(entry, references)
+            resolver.resolve(references)
+        return change_subclass.make(instance, entry, resolver=resolver)
 
     class Meta:
         verbose_name_plural = "Change Entries"
@@ -249,16 +660,30 @@ class ConnectedRedditAccountEntry(ChangeFeedEntry):
     def description(self):
         return f"{self.reddit_account} connected to {self.actor.url}"
 
+    def get_payload(self):
+        return {
+            **super().get_payload(),
+            "reddit_account": self.reddit_account.username,
+            "actor": self.actor.url,
+        }
+
     def _merge(self):
         ConnectedRedditAccount.objects.get_or_create(
             reddit_account=self.reddit_account, actor=self.actor
         )
 
     @classmethod
-    def make(cls, instance, entry):
-        reddit_account, _ = RedditAccount.objects.get_or_create(username=entry["reddit_account"])
-        actor_url = entry["actor"]
-        actor = Person.objects.filter(url=actor_url).first() or Person.fetch(actor_url)
+    def collect_references(cls, entry, references):
+        references["reddit_account"].add(entry["reddit_account"])
+        references["person"].add(entry["actor"])
+
+    @classmethod
+    def make(cls, instance, entry, resolver=None):
+        if resolver is None:
+            return super().make(instance, entry)
+
+        reddit_account = resolver.get("reddit_account", entry["reddit_account"])
+        actor = resolver.get("person", entry["actor"])
 
         entry, _ = cls.objects.get_or_create(
             published_by=instance, reddit_account=reddit_account, actor=actor
@@ -276,12 +701,30 @@ class EndorsementEntry(ChangeFeedEntry):
     def description(self):
         return f"{self.endorsement.endorser} endorses {self.endorsement.endorsed}"
 
+    def get_payload(self):
+        return {
+            **super().get_payload(),
+            "endorser": self.endorsement.endorser.portal_url,
+            "endorsed": self.endorsement.endorsed.portal_url,
+        }
+
     def _merge(self):
         return
 
     @classmethod
-    def make(cls, instance, entry):
-        endorsed, _ = FediversedInstance.objects.get_or_create(portal_url=entry["endorsed"])
+    def collect_references(cls, entry, references):
+        references["portal"].add(entry["endorsed"])
+
+    @classmethod
+    def make(cls, instance, entry, resolver=None):
+        if resolver is None:
+            return super().make(instance, entry)
+
+        # Partners can only vouch for themselves
+        if entry.get("endorser") != instance.portal_url:
+            raise ValueError(f"{instance} can not publish endorsements by {entry.get('endorser')}")
+
+        endorsed = resolver.get("portal", entry["endorsed"])
         endorsement, _ = Endorsement.objects.get_or_create(endorser=instance, endorsed=endorsed)
         entry, _ = cls.objects.get_or_create(published_by=instance, endorsement=endorsement)
         return entry
@@ -301,34 +744,37 @@ class RedditToCommunityRecommendationEntry(ChangeFeedEntry):
     def description(self):
         return f"{self.community} as alternative to {self.subreddit}"
 
+    def get_payload(self):
+        return {
+            **super().get_payload(),
+            "subreddit": self.subreddit.name,
+            "community": self.community.url,
+        }
+
     def _merge(self):
         RedditToCommunityRecommendationEntry.objects.get_or_create(
             subreddit=self.subreddit, community=self.community
         )
 
     @classmethod
-    def make(cls, instance, entry):
+    def collect_references(cls, entry, references):
         subreddit_name = entry["subreddit"]
         actor_url = entry["community"]
 
         assert subreddit_name is not None, "invalid subreddit name"
         assert actor_url is not None, "invalid url for community"
 
-        subreddit = RedditCommunity.objects.filter(
-            name__iexact=subreddit_name
-        ).first() or RedditCommunity.fetch(subreddit_name)
+        references["subreddit"].add(subreddit_name)
+        references["community"].add(actor_url)
 
-        community = Community.objects.filter(url=actor_url).first()
+    @classmethod
+    def make(cls, instance, entry, resolver=None):
+        if resolver is None:
+            return super().make(instance, entry)
 
-        if not community:
-            domain = urlparse(actor_url).hostname
-            if Instance.objects.filter(
-                domain=domain,
-                annotation__status__in=[INSTANCE_STATUSES.closed, INSTANCE_STATUSES.abandoned],
-            ).exists():
-                raise ValueError(f"{actor_url} is from an inactive instance")
+        subreddit = resolver.get("subreddit", entry["subreddit"])
+        community = resolver.get("community", entry["community"])
 
-            community = Community.fetch(actor_url)
         entry, _ = cls.objects.get_or_create(
             published_by=instance, subreddit=subreddit, community=community
         )
@@ -336,6 +782,93 @@ class RedditToCommunityRecommendationEntry(ChangeFeedEntry):
         return entry
 
 
+class ChangeFeedRecord(models.Model):
+    """
+    Read model for the change feed. Holds the serialized form of each
+    entry, written once when the entry is created, so that the feed can
+    be served without joining every entry table.
+    """
+
+    entry = models.OneToOneField(
+        ChangeFeedEntry, primary_key=True, related_name="record", on_delete=models.CASCADE
+    )
+    published_by = models.ForeignKey(
+        FediversedInstance, related_name="published_feed_records", on_delete=models.CASCADE
+    )
+    type = models.CharField(max_length=50)
+    created = models.DateTimeField()
+    payload = models.JSONField(encoder=DjangoJSONEncoder)
+    digest = models.CharField(max_length=40, default="")
+
+    VERSION_CACHE_KEY = "fediverser:changefeed:version"
+    LOCAL_PAYLOAD_FIELDS = ("id", "description", "created")
+
+    @property
+    def description(self):
+        return self.payload.get("description")
+
+    @classmethod
+    def get_version(cls, local=False):
+        """
+        Returns a string built from the newest record id and the number of
+        records, which changes whenever records are added or removed. It is
+        kept in the cache until invalidate_versions() is called.
+        """
+
+        cache_key = f"{cls.VERSION_CACHE_KEY}:{'local' if local else 'all'}"
+        version = cache.get(cache_key)
+        if version is None:
+            records = cls.objects.all()
+            if local:
+                records = records.filter(published_by__portal_url=app_settings.Portal.url)
+            stats = records.aggregate(newest=models.Max("pk"), total=models.Count("pk"))
+            version = f"{stats['newest'] or 0}-{stats['total']}"
+            cache.set(cache_key, version, timeout=app_settings.Federation.change_feed_cache_ttl)
+        return version
+
+    @classmethod
+    def invalidate_versions(cls):
+        cache.delete_many([f"{cls.VERSION_CACHE_KEY}:{scope}" for scope in ("local", "all")])
+
+    @classmethod
+    def get_digest(cls, payload):
+        """
+        Hashes what the change is about, leaving out the fields that each
+        portal assigns on its own, so that the copy of an entry pulled by
+        a partner has the same digest as the original.
+        """
+
+        identity = {
+            key: value for key, value in payload.items() if key not in cls.LOCAL_PAYLOAD_FIELDS
+        }
+        return hashlib.sha1(json.dumps(identity, sort_keys=True).encode()).hexdigest()
+
+    @classmethod
+    def make(cls, entry):
+        payload = entry.get_payload()
+        record, _ = cls.objects.update_or_create(
+            entry_id=entry.pk,
+            defaults={
+                "published_by_id": entry.published_by_id,
+                "type": entry.TYPE,
+                "created": entry.created,
+                "payload": payload,
+                "digest": cls.get_digest(payload),
+            },
+        )
+        return record
+
+    def __str__(self):
+        return self.description
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["published_by", "entry"], name="core_changerecord_cursor_idx"),
+            models.Index(fields=["published_by", "created"], name="core_changerecord_date_idx"),
+            models.Index(fields=["published_by", "digest"], name="core_changerecord_digest_idx"),
+        ]
+
+
 class MergedEntry(TimeStampedModel):
     entry = models.OneToOneField(
         ChangeFeedEntry, related_name="merge_info", on_delete=models.CASCADE
@@ -347,6 +880,12 @@ class SyncJob(models.Model):
     instance = models.ForeignKey(
         FediversedInstance, related_name="sync_jobs", on_delete=models.CASCADE
     )
+    succeeded = models.BooleanField(default=True)
+    caught_up = models.BooleanField(default=True)
+    entry_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [models.Index(fields=["instance", "run_on"], name="core_syncjob_instance_idx")]
 
     def __str__(self):
         return f"{self.instance.portal_url} sync run on {self.run_on.isoformat()}"
@@ -356,11 +895,14 @@ __all__ = (
     "InstanceStatus",
     "FediversedInstance",
     "Endorsement",
+    "TrustScore",
     "ConnectedRedditAccount",
+    "ChangeFeedResolver",
     "ChangeFeedEntry",
     "EndorsementEntry",
     "ConnectedRedditAccountEntry",
     "RedditToCommunityRecommendationEntry",
+    "ChangeFeedRecord",
     "MergedEntry",
     "SyncJob",
 )
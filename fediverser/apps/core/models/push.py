@@ -0,0 +1,279 @@
+import datetime
+import hashlib
+import hmac
+import json
+import logging
+import secrets
+import time
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models, transaction
+from django.urls import reverse
+from django.utils import timezone
+from model_utils.models import TimeStampedModel
+
+from ..settings import app_settings
+from .common import make_http_client
+from .network import ChangeFeedRecord, FediversedInstance
+
+logger = logging.getLogger(__name__)
+
+SIGNATURE_HEADER = "X-Fediverser-Signature"
+TIMESTAMP_HEADER = "X-Fediverser-Timestamp"
+PORTAL_HEADER = "X-Fediverser-Portal"
+PREVIOUS_ID_HEADER = "X-Fediverser-Previous-Id"
+
+
+class InvalidSignature(Exception):
+    pass
+
+
+def sign_payload(secret, timestamp, body, previous_id=None):
+    prefix = f"{timestamp}." if previous_id is None else f"{timestamp}.{previous_id}."
+    message = prefix.encode() + body
+    return hmac.new(secret.encode(), message, hashlib.sha256).hexdigest()
+
+
+def verify_signature(secret, timestamp, body, signature, previous_id=None):
+    try:
+        age = abs(time.time() - int(timestamp))
+    except (TypeError, ValueError):
+        raise InvalidSignature("Missing or invalid timestamp")
+
+    if age > app_settings.Federation.push_signature_max_age:
+        raise InvalidSignature("Signature is too old")
+
+    expected = sign_payload(secret, timestamp, body, previous_id=previous_id)
+    if not hmac.compare_digest(expected, signature or ""):
+        raise InvalidSignature("Signature does not match")
+
+
+class ChangeFeedSubscription(TimeStampedModel):
+    """
+    A partner that asked to have our change feed entries pushed to it.
+    Entries are signed with the secret that was handed to the partner
+    when it subscribed.
+    """
+
+    subscriber = models.OneToOneField(
+        FediversedInstance, related_name="change_feed_subscription", on_delete=models.CASCADE
+    )
+    callback_url = models.URLField()
+    secret = models.CharField(max_length=64)
+    active = models.BooleanField(default=True)
+    last_delivered_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Push to {self.callback_url}"
+
+    @classmethod
+    def make(cls, subscriber, callback_url, secret):
+        """
+        Registers the subscription after checking that the callback
+        belongs to the subscriber and that it knows the secret, so that
+        nobody can subscribe a portal without its consent.
+        """
+
+        # Only deliver to the push endpoint of the portal itself, so that
+        # subscribing can not be used to point our requests to arbitrary
+        # hosts, ports or paths.
+        expected_url = get_push_callback_url(subscriber.portal_url)
+        if callback_url != expected_url:
+            raise ValueError(f"{callback_url} is not the push endpoint of {subscriber.portal_url}")
+
+        subscription = cls(subscriber=subscriber, callback_url=callback_url, secret=secret)
+        subscription.verify()
+
+        subscription, _ = cls.objects.update_or_create(
+            subscriber=subscriber,
+            defaults={"callback_url": callback_url, "secret": secret, "active": True},
+        )
+        return subscription
+
+    def _post(self, payload, previous_id=None):
+        body = json.dumps(payload, cls=DjangoJSONEncoder).encode()
+        timestamp = str(int(time.time()))
+        headers = {
+            "Content-Type": "application/json",
+            PORTAL_HEADER: app_settings.Portal.url,
+            TIMESTAMP_HEADER: timestamp,
+            SIGNATURE_HEADER: sign_payload(self.secret, timestamp, body, previous_id=previous_id),
+        }
+        if previous_id is not None:
+            headers[PREVIOUS_ID_HEADER] = str(previous_id)
+
+        response = make_http_client("federation").post(
+            self.callback_url,
+            data=body,
+            headers=headers,
+            timeout=app_settings.Federation.push_timeout,
+        )
+        response.raise_for_status()
+        return response
+
+    def verify(self):
+        # The subscriber only answers challenges signed with the secret it
+        # gave us when subscribing.
+        challenge = secrets.token_hex(16)
+        try:
+            response = self._post({"challenge": challenge})
+            assert response.json().get("challenge") == challenge
+        except Exception as exc:
+            raise ValueError(f"Could not verify subscription of {self.subscriber}: {exc}")
+
+    @classmethod
+    def enqueue(cls, record):
+        subscriptions = cls.objects.filter(active=True).exclude(subscriber=record.published_by)
+        deliveries = ChangeFeedDelivery.objects.bulk_create(
+            [
+                ChangeFeedDelivery(subscription=subscription, record=record)
+                for subscription in subscriptions
+            ],
+            ignore_conflicts=True,
+        )
+        return len(deliveries)
+
+    def claim_deliveries(self):
+        # Claimed deliveries are pushed back by the request timeout, so
+        # that other workers leave them alone while they are being sent.
+        now = timezone.now()
+        lease = datetime.timedelta(seconds=2 * app_settings.Federation.push_timeout)
+        with transaction.atomic():
+            deliveries = list(
+                self.deliveries.filter(next_attempt_at__lte=now)
+                .select_related("record")
+                .order_by("record_id")
+                .select_for_update(skip_locked=True, of=("self",))[
+                    : app_settings.Federation.push_batch_size
+                ]
+            )
+            ChangeFeedDelivery.objects.filter(id__in=[d.id for d in deliveries]).update(
+                next_attempt_at=now + lease
+            )
+        return deliveries
+
+    @staticmethod
+    def get_previous_id(records):
+        """
+        Returns the id of the local record that comes right before the
+        given ones in our change feed, when they follow it without gaps,
+        so that the subscriber can move its cursor past them. Returns
+        None when records are missing in between, as happens while a
+        failed batch waits to be retried.
+        """
+
+        first_id, last_id = records[0].pk, records[-1].pk
+        local = ChangeFeedRecord.objects.filter(published_by_id=records[0].published_by_id)
+        if local.filter(pk__gte=first_id, pk__lte=last_id).count() != len(records):
+            return None
+
+        previous = local.filter(pk__lt=first_id).order_by("-pk").first()
+        return previous.pk if previous else 0
+
+    def deliver(self):
+        """
+        Sends the next batch of due deliveries in a single signed request,
+        returning the number of entries that were delivered. Failed
+        deliveries are retried with exponential backoff, until they run
+        out of attempts and are left for the partner to pull.
+        """
+
+        deliveries = self.claim_deliveries()
+        if not deliveries:
+            return 0
+
+        records = [delivery.record for delivery in deliveries]
+        try:
+            self._post(
+                [record.payload for record in records],
+                previous_id=self.get_previous_id(records),
+            )
+        except Exception as exc:
+            logger.info(f"Failed to push {len(deliveries)} entries to {self.subscriber}: {exc}")
+            ChangeFeedDelivery.retry_later(deliveries)
+            return 0
+
+        ChangeFeedDelivery.objects.filter(id__in=[d.id for d in deliveries]).delete()
+        self.last_delivered_at = timezone.now()
+        self.save(update_fields=["last_delivered_at"])
+        return len(deliveries)
+
+
+class ChangeFeedDelivery(models.Model):
+    subscription = models.ForeignKey(
+        ChangeFeedSubscription, related_name="deliveries", on_delete=models.CASCADE
+    )
+    record = models.ForeignKey(
+        ChangeFeedRecord, related_name="deliveries", on_delete=models.CASCADE
+    )
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    @classmethod
+    def retry_later(cls, deliveries):
+        now = timezone.now()
+        retrying = []
+        for delivery in deliveries:
+            delivery.attempts += 1
+            if delivery.attempts < app_settings.Federation.push_max_attempts:
+                delivery.next_attempt_at = now + cls.get_backoff(delivery.attempts)
+                retrying.append(delivery)
+
+        cls.objects.filter(id__in=[d.id for d in deliveries if d not in retrying]).delete()
+        cls.objects.bulk_update(retrying, ["attempts", "next_attempt_at"])
+
+    @staticmethod
+    def get_backoff(attempts):
+        delay = app_settings.Federation.push_retry_delay * 2 ** (attempts - 1)
+        return datetime.timedelta(seconds=min(delay, app_settings.Federation.push_max_retry_delay))
+
+    class Meta:
+        unique_together = ("subscription", "record")
+        verbose_name_plural = "Change Feed Deliveries"
+
+
+def get_push_callback_url(portal_url=None):
+    portal_url = (portal_url or app_settings.Portal.url).rstrip("/")
+    return portal_url + reverse("fediverser-core:changefeed-push")
+
+
+def subscribe_to_partner(partner):
+    """
+    Asks the partner to push its change feed entries to us. The secret is
+    stored before the request, because the partner will use it to sign
+    the challenge that it sends to our callback while handling it.
+    """
+
+    previous_secret = partner.push_secret
+    partner.push_secret = secrets.token_hex()
+    partner.save(update_fields=["push_secret"])
+
+    client = make_http_client("federation")
+    try:
+        response = client.post(
+            f"{partner.portal_url}/api/changes/subscriptions",
+            json={
+                "portal_url": app_settings.Portal.url,
+                "callback_url": get_push_callback_url(),
+                "secret": partner.push_secret,
+            },
+            timeout=app_settings.Federation.push_timeout,
+        )
+        response.raise_for_status()
+    except Exception:
+        # The partner did not take the new secret, so keep the one that it
+        # may still be using to push to us.
+        partner.push_secret = previous_secret
+        partner.save(update_fields=["push_secret"])
+        raise
+
+
+__all__ = (
+    "InvalidSignature",
+    "ChangeFeedSubscription",
+    "ChangeFeedDelivery",
+    "sign_payload",
+    "verify_signature",
+    "get_push_callback_url",
+    "subscribe_to_partner",
+)
@@ -7,6 +7,7 @@ from allauth.socialaccount.models import SocialToken
 from django.conf import settings
 from django.db import models
 from django.db.models import Max, Q
+from django.db.models.functions import Lower
 from django.db.utils import DataError
 from django.utils import timezone
 from django.utils.timezone import make_aware
@@ -88,7 +89,7 @@ class RedditCommunity(models.Model):
     over18 = models.BooleanField(default=False)
     metadata = models.JSONField(null=True, blank=True)
     tags = TaggableManager(blank=True)
-    last_synced_at = models.DateTimeField(null=True, blank=True)
+    last_synced_at = models.DateTimeField(null=True, blank=True, db_index=True)
 
     @property
     def comments(self):
@@ -197,6 +198,49 @@ class RedditCommunity(models.Model):
             subreddit, _ = cls.objects.update_or_create(name=name, defaults={"metadata": {}})
         return subreddit
 
+    @classmethod
+    def fetch_many(cls, names):
+        """
+        Returns a dict of subreddits keyed by their lowercased name.
+        Subreddits that we don't know yet are looked up on reddit with
+        one info request per 100 names.
+        """
+
+        def get_known(lowercased_names):
+            known = cls.objects.annotate(lowercased_name=Lower("name")).filter(
+                lowercased_name__in=lowercased_names
+            )
+            return {subreddit.name.lower(): subreddit for subreddit in known}
+
+        names = {name.lower(): name for name in names}
+        subreddits = get_known(names.keys())
+        missing = [name for key, name in names.items() if key not in subreddits]
+
+        if missing:
+            client = make_reddit_client()
+            found = {
+                praw_subreddit.display_name.lower(): praw_subreddit
+                for praw_subreddit in client.info(subreddits=missing)
+            }
+            cls.objects.bulk_create(
+                [
+                    (
+                        cls(
+                            name=found[name.lower()].display_name,
+                            description=found[name.lower()].description,
+                            over18=found[name.lower()].over18,
+                        )
+                        if name.lower() in found
+                        else cls(name=name, metadata={})
+                    )
+                    for name in missing
+                ],
+                ignore_conflicts=True,
+            )
+            subreddits.update(get_known([name.lower() for name in missing]))
+
+        return subreddits
+
     class Meta:
         verbose_name_plural = "Subreddit"
         verbose_name_plural = "Subreddits"
@@ -251,6 +295,22 @@ class RedditAccount(TimeStampedModel):
         account, _ = cls.objects.update_or_create(username=redditor.name, defaults=defaults)
         return account
 
+    @classmethod
+    def bulk_make(cls, usernames):
+        """
+        Returns a dict of accounts keyed by username, creating the
+        missing ones. Unlike make, this does not look up the redditor
+        profiles, which would cost one request per account.
+        """
+
+        usernames = set(usernames)
+        cls.objects.bulk_create(
+            [cls(username=username) for username in usernames], ignore_conflicts=True
+        )
+        return {
+            account.username: account for account in cls.objects.filter(username__in=usernames)
+        }
+
     def __str__(self):
         return f"/u/{self.username}"
 
@@ -396,9 +456,6 @@ class RedditSubmission(AbstractRedditItem):
 
     @classmethod
     def make(cls, subreddit: RedditCommunity, post: praw.models.Submission, make_comments=False):
-        def get_date(timestamp):
-            return timestamp and make_aware(datetime.datetime.fromtimestamp(timestamp))
-
         def make_comment_thread(submission, comment: praw.models.Comment, parent=None):
             reddit_comment = RedditComment.make(
                 submission=submission, comment=comment, parent=parent
@@ -411,23 +468,7 @@ class RedditSubmission(AbstractRedditItem):
         author = RedditAccount.make(post.author)
         try:
             submission, _ = subreddit.posts.update_or_create(
-                id=post.id,
-                defaults=dict(
-                    author=author,
-                    url=post.url,
-                    title=post.title,
-                    created=get_date(post.created_utc),
-                    selftext=post.selftext,
-                    selftext_html=post.selftext_html,
-                    media_only=post.media_only,
-                    approved_at=get_date(post.approved_at_utc),
-                    banned_at=get_date(post.banned_at_utc),
-                    archived=post.archived,
-                    locked=post.locked,
-                    quarantined=post.quarantine,
-                    removed=post.removed_by is not None,
-                    over_18=post.over_18,
-                ),
+                id=post.id, defaults=dict(author=author, **cls.get_post_fields(post))
             )
 
             if make_comments:
@@ -445,9 +486,86 @@ class RedditSubmission(AbstractRedditItem):
         except DataError:
             logger.warning("Failed to make reddit submission", extra={"post_url": post.url})
 
+    @classmethod
+    def get_post_fields(cls, post: praw.models.Submission):
+        def get_date(timestamp):
+            return timestamp and make_aware(datetime.datetime.fromtimestamp(timestamp))
+
+        return dict(
+            url=post.url,
+            title=post.title,
+            created=get_date(post.created_utc),
+            selftext=post.selftext,
+            selftext_html=post.selftext_html,
+            media_only=post.media_only,
+            approved_at=get_date(post.approved_at_utc),
+            banned_at=get_date(post.banned_at_utc),
+            archived=post.archived,
+            locked=post.locked,
+            quarantined=post.quarantine,
+            removed=post.removed_by is not None,
+            over_18=post.over_18,
+        )
+
+    @classmethod
+    def bulk_make(cls, posts):
+        """
+        Upserts all the given posts with a single statement. Their
+        subreddits and authors are resolved in bulk as well.
+        """
+
+        max_url_length = cls._meta.get_field("url").max_length
+        for post in posts:
+            if len(post.url) > max_url_length:
+                logger.warning("Failed to make reddit submission", extra={"post_url": post.url})
+        posts = [post for post in posts if len(post.url) <= max_url_length]
+
+        if not posts:
+            return []
+
+        subreddits = RedditCommunity.fetch_many({post.subreddit.display_name for post in posts})
+        authors = RedditAccount.bulk_make({post.author.name for post in posts if post.author})
+
+        submissions = [
+            cls(
+                id=post.id,
+                subreddit=subreddits[post.subreddit.display_name.lower()],
+                author=post.author and authors[post.author.name],
+                **cls.get_post_fields(post),
+            )
+            for post in posts
+        ]
+        update_fields = ["subreddit", "author", *cls.get_post_fields(posts[0])]
+        return cls.objects.bulk_create(
+            submissions, update_conflicts=True, unique_fields=["id"], update_fields=update_fields
+        )
+
+    @classmethod
+    def fetch_many(cls, submission_ids):
+        """
+        Retrieves the submissions that we don't have yet. Reddit's info
+        endpoint takes up to 100 ids per request, and praw takes care
+        of splitting larger lists in batches.
+        """
+
+        known = set(cls.objects.filter(id__in=submission_ids).values_list("id", flat=True))
+        pending = [
+            submission_id for submission_id in set(submission_ids) if submission_id not in known
+        ]
+        if not pending:
+            return []
+
+        client = make_reddit_client()
+        posts = list(client.info(fullnames=[f"t3_{submission_id}" for submission_id in pending]))
+        logger.info(f"Got {len(posts)} out of {len(pending)} reddit submissions")
+        return cls.bulk_make(posts)
+
     def __str__(self):
         return f"{self.url} ({self.subreddit})"
 
+    class Meta:
+        indexes = [models.Index(fields=["status", "created"], name="core_submission_queue_idx")]
+
 
 class RedditComment(AbstractRedditItem):
     MAXIMUM_AGE_FOR_MIRRORING = datetime.timedelta(days=1)
@@ -525,6 +643,12 @@ class RedditComment(AbstractRedditItem):
         )
         return reddit_comment
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "created"], name="core_comment_queue_idx"),
+            models.Index(fields=["submission", "status"], name="core_comment_thread_idx"),
+        ]
+
 
 class RedditApplicationKey(models.Model):
     client_id = models.CharField(max_length=32)
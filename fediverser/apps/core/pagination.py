@@ -0,0 +1,41 @@
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Paginates in ascending order of primary key, starting after the one
+    given in the query. Unlike page numbers, the cost of a page does not depend
+    on how deep it is, and rows are never repeated. Rows can still be
+    missed: ids are handed out when rows are inserted, not when their
+    transactions commit, so a row can become visible after a client has
+    already read past its id. Partners recover those through hash tree
+    reconciliation of their change feeds.
+    """
+
+    cursor_query_param = "after_id"
+    page_size = api_settings.PAGE_SIZE
+
+    def paginate_queryset(self, queryset, request, view=None):
+        # Filtering by the cursor itself is done by the filterset, so
+        # that invalid values are reported just like any other filter.
+        self.request = request
+        self.page = list(queryset.order_by("pk")[: self.page_size])
+        return self.page
+
+    def get_next_link(self):
+        if len(self.page) < self.page_size:
+            return None
+
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.page[-1].pk)
+
+    def get_paginated_response(self, data):
+        next_link = self.get_next_link()
+        headers = {"Link": f'<{next_link}>; rel="next"'} if next_link else {}
+        return Response(data, headers=headers)
+
+
+__all__ = ("KeysetPagination",)
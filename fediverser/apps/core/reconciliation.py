@@ -0,0 +1,119 @@
+import hashlib
+import logging
+from itertools import groupby, islice
+
+from django.core.cache import cache
+from rest_framework.settings import api_settings
+
+from .models.common import make_http_client
+from .models.network import ChangeFeedEntry, ChangeFeedRecord, ChangeFeedResolver
+from .settings import app_settings
+
+logger = logging.getLogger(__name__)
+
+DIGEST_LENGTH = 16
+TREE_CACHE_KEY = "fediverser:changefeed:tree"
+
+
+def _hash(values):
+    digest = hashlib.sha1()
+    for value in values:
+        digest.update(value.encode())
+    return digest.hexdigest()[:DIGEST_LENGTH]
+
+
+def get_local_records():
+    return ChangeFeedRecord.objects.filter(published_by__portal_url=app_settings.Portal.url)
+
+
+def build_tree(records, digits=None):
+    """
+    Summarises a set of change feed records as a two level hash tree.
+    Records are put in buckets by the leading digits of their digest,
+    each bucket is hashed from the digests it holds and the root from
+    the hashes of all buckets. Empty buckets are left out.
+    """
+
+    digits = digits or app_settings.Federation.reconciliation_bucket_digits
+    digests = records.order_by("digest").values_list("digest", flat=True)
+
+    buckets = {
+        prefix: _hash(leaves)
+        for prefix, leaves in groupby(
+            digests.iterator(chunk_size=1000), key=lambda digest: digest[:digits]
+        )
+    }
+    root = _hash(f"{prefix}:{bucket}" for prefix, bucket in buckets.items())
+    return {"digits": digits, "root": root, "buckets": buckets}
+
+
+def get_local_tree():
+    # The tree only changes along with the feed, so it is cached by its version
+    version = ChangeFeedRecord.get_version(local=True)
+    cache_key = f"{TREE_CACHE_KEY}:{version}"
+    tree = cache.get(cache_key)
+    if tree is None:
+        tree = build_tree(get_local_records())
+        cache.set(cache_key, tree, timeout=app_settings.Federation.change_feed_cache_ttl)
+    return tree
+
+
+def get_bucket(records, prefix):
+    return dict(records.filter(digest__startswith=prefix).values_list("digest", "entry_id"))
+
+
+def reconcile_with_partner(partner):
+    """
+    Compares the entries published by the partner with the ones that we
+    have pulled from it, and pulls the ones that are missing. Only the
+    buckets whose hashes differ are listed, so that partners that are
+    already in sync exchange nothing but the bucket hashes.
+    """
+
+    client = make_http_client("federation")
+    timeout = app_settings.Federation.sync_timeout
+    base_url = f"{partner.portal_url}/api/changes"
+    headers = {"Accept": "application/json"}
+
+    response = client.get(f"{base_url}/digest", headers=headers, timeout=timeout)
+    response.raise_for_status()
+    remote_tree = response.json()
+
+    records = ChangeFeedRecord.objects.filter(published_by=partner)
+    local_tree = build_tree(records, digits=remote_tree["digits"])
+    if local_tree["root"] == remote_tree["root"]:
+        logger.debug(f"Change feed of {partner} is consistent")
+        return []
+
+    missing = []
+    for prefix, bucket in remote_tree["buckets"].items():
+        if local_tree["buckets"].get(prefix) == bucket:
+            continue
+
+        response = client.get(f"{base_url}/digest/{prefix}", headers=headers, timeout=timeout)
+        response.raise_for_status()
+        known = get_bucket(records, prefix)
+        missing.extend(
+            entry_id
+            for digest, entry_id in response.json()["leaves"].items()
+            if digest not in known
+        )
+
+    logger.info(f"Found {len(missing)} entries from {partner} that were never pulled")
+
+    resolver = ChangeFeedResolver()
+    created = []
+    entry_ids = iter(sorted(missing))
+    while batch := list(islice(entry_ids, api_settings.PAGE_SIZE)):
+        response = client.get(
+            base_url,
+            params={"id": ",".join(str(entry_id) for entry_id in batch)},
+            headers=headers,
+            timeout=timeout,
+        )
+        response.raise_for_status()
+        created.extend(ChangeFeedEntry.ingest(partner, response.json(), resolver=resolver))
+    return created
+
+
+__all__ = ("build_tree", "get_local_tree", "get_bucket", "reconcile_with_partner")
@@ -1,6 +1,7 @@
 from collections.abc import Mapping
 
 from rest_framework import serializers
+from rest_framework.reverse import reverse
 from rest_polymorphic.serializers import PolymorphicSerializer
 
 from .models.activitypub import Community, Instance
@@ -149,7 +150,7 @@ class ChangeFeedEntrySerializer(serializers.HyperlinkedModelSerializer):
 
     class Meta:
         model = ChangeFeedEntry
-        fields = read_only_fields = ("url", "description", "type", "created")
+        fields = read_only_fields = ("id", "url", "description", "type", "created")
 
 
 class ConnectedRedditAccountEntrySerializer(ChangeFeedEntrySerializer):
@@ -188,6 +189,27 @@ class RedditToCommunityRecommendationEntrySerializer(ChangeFeedEntrySerializer):
         )
 
 
+class ChangeFeedSubscriptionSerializer(serializers.Serializer):
+    portal_url = serializers.URLField()
+    callback_url = serializers.URLField()
+    secret = serializers.CharField(min_length=32, max_length=64)
+
+
+class ChangeFeedRecordSerializer(serializers.BaseSerializer):
+    # Same output as PolymorphicChangeFeedEntrySerializer, from the stored payload.
+    # The payload keeps dates as DjangoJSONEncoder writes them, so they are
+    # formatted again like the model serializers do.
+    def to_representation(self, instance):
+        payload = dict(instance.payload)
+        url = reverse(
+            "fediverser-core:changefeedentry-detail",
+            args=[instance.pk],
+            request=self.context.get("request"),
+        )
+        payload["created"] = serializers.DateTimeField().to_representation(instance.created)
+        return {"id": payload.pop("id"), "url": url, **payload}
+
+
 class PolymorphicChangeFeedEntrySerializer(PolymorphicSerializer):
     model_serializer_mapping = {
         ConnectedRedditAccountEntry: ConnectedRedditAccountEntrySerializer,
@@ -1,4 +1,7 @@
+import datetime
 import logging
+import os
+import tempfile
 
 import environ
 from allauth.socialaccount.models import SocialApp
@@ -29,6 +32,93 @@ class AppSettings:
         bot_username = None
         bot_password = None
 
+    class Archive:
+        horizon = datetime.timedelta(
+            days=env.int("FEDIVERSER_REDDIT_ARCHIVE_HORIZON_DAYS", default=30)
+        )
+        path = env.str(
+            "FEDIVERSER_REDDIT_ARCHIVE_PATH",
+            default=os.path.join(settings.MEDIA_ROOT, "archive", "reddit"),
+        )
+
+    class Feeds:
+        max_connections = env.int("FEDIVERSER_FEED_MAX_CONNECTIONS", default=20)
+        max_connections_per_host = env.int("FEDIVERSER_FEED_MAX_CONNECTIONS_PER_HOST", default=4)
+        max_reddit_connections = env.int("FEDIVERSER_FEED_MAX_REDDIT_CONNECTIONS", default=2)
+        parser_threads = env.int("FEDIVERSER_FEED_PARSER_THREADS", default=4)
+        timeout = env.int("FEDIVERSER_FEED_FETCH_TIMEOUT", default=30)
+
+    class Federation:
+        resolver_threads = env.int("FEDIVERSER_FEDERATION_RESOLVER_THREADS", default=8)
+        snapshot_path = env.str(
+            "FEDIVERSER_FEDERATION_SNAPSHOT_PATH",
+            default=os.path.join(settings.MEDIA_ROOT, "snapshots", "fediverser.ndjson.gz"),
+        )
+        change_feed_cache_ttl = env.int(
+            "FEDIVERSER_FEDERATION_CHANGE_FEED_CACHE_TTL", default=3600
+        )
+        push_batch_size = env.int("FEDIVERSER_FEDERATION_PUSH_BATCH_SIZE", default=100)
+        push_timeout = env.int("FEDIVERSER_FEDERATION_PUSH_TIMEOUT", default=10)
+        push_max_attempts = env.int("FEDIVERSER_FEDERATION_PUSH_MAX_ATTEMPTS", default=10)
+        push_retry_delay = env.int("FEDIVERSER_FEDERATION_PUSH_RETRY_DELAY", default=30)
+        push_max_retry_delay = env.int("FEDIVERSER_FEDERATION_PUSH_MAX_RETRY_DELAY", default=3600)
+        push_signature_max_age = env.int(
+            "FEDIVERSER_FEDERATION_PUSH_SIGNATURE_MAX_AGE", default=300
+        )
+        subscription_rate = env.str("FEDIVERSER_FEDERATION_SUBSCRIPTION_RATE", default="6/hour")
+        push_fallback_interval = datetime.timedelta(
+            minutes=env.int("FEDIVERSER_FEDERATION_PUSH_FALLBACK_INTERVAL_MINUTES", default=60)
+        )
+        sync_timeout = env.int("FEDIVERSER_FEDERATION_SYNC_TIMEOUT", default=30)
+        sync_budget_pages = env.int("FEDIVERSER_FEDERATION_SYNC_BUDGET_PAGES", default=20)
+        sync_budget_seconds = env.int("FEDIVERSER_FEDERATION_SYNC_BUDGET_SECONDS", default=120)
+        sync_retry_delay = env.int("FEDIVERSER_FEDERATION_SYNC_RETRY_DELAY", default=60)
+        sync_max_retry_delay = env.int("FEDIVERSER_FEDERATION_SYNC_MAX_RETRY_DELAY", default=21600)
+        reconciliation_bucket_digits = env.int(
+            "FEDIVERSER_FEDERATION_RECONCILIATION_BUCKET_DIGITS", default=2
+        )
+        trust_damping = env.float("FEDIVERSER_FEDERATION_TRUST_DAMPING", default=0.85)
+        trust_tolerance = env.float("FEDIVERSER_FEDERATION_TRUST_TOLERANCE", default=1e-6)
+        trust_max_iterations = env.int("FEDIVERSER_FEDERATION_TRUST_MAX_ITERATIONS", default=100)
+        sync_lag_warning = datetime.timedelta(
+            minutes=env.int("FEDIVERSER_FEDERATION_SYNC_LAG_WARNING_MINUTES", default=360)
+        )
+
+    class Http:
+        connect_timeout = env.float("FEDIVERSER_HTTP_CONNECT_TIMEOUT", default=5)
+        read_timeout = env.float("FEDIVERSER_HTTP_READ_TIMEOUT", default=30)
+        pooled_hosts = env.int("FEDIVERSER_HTTP_POOLED_HOSTS", default=100)
+        connections_per_host = env.int("FEDIVERSER_HTTP_CONNECTIONS_PER_HOST", default=4)
+        crawler_concurrency = env.int("FEDIVERSER_HTTP_CRAWLER_CONCURRENCY", default=50)
+        crawler_connections_per_host = env.int(
+            "FEDIVERSER_HTTP_CRAWLER_CONNECTIONS_PER_HOST", default=2
+        )
+        circuit_breaker_threshold = env.int("FEDIVERSER_HTTP_CIRCUIT_BREAKER_THRESHOLD", default=3)
+        circuit_breaker_cool_down = env.int(
+            "FEDIVERSER_HTTP_CIRCUIT_BREAKER_COOL_DOWN", default=60
+        )
+        circuit_breaker_max_cool_down = env.int(
+            "FEDIVERSER_HTTP_CIRCUIT_BREAKER_MAX_COOL_DOWN", default=86400
+        )
+        unreachable_instance_period = datetime.timedelta(
+            days=env.int("FEDIVERSER_HTTP_UNREACHABLE_INSTANCE_DAYS", default=30)
+        )
+        cache_backend = env.str("FEDIVERSER_HTTP_CACHE_BACKEND", default="redis")
+        cache_location = env.str(
+            "FEDIVERSER_HTTP_CACHE_LOCATION",
+            default=(
+                os.path.join(tempfile.gettempdir(), "fediverser-http-cache.sqlite")
+                if cache_backend == "sqlite"
+                else settings.CACHES["default"]["LOCATION"]
+            ),
+        )
+        actor_cache_ttl = env.int("FEDIVERSER_HTTP_ACTOR_CACHE_TTL", default=3600)
+        nodeinfo_cache_ttl = env.int("FEDIVERSER_HTTP_NODEINFO_CACHE_TTL", default=86400)
+        site_cache_ttl = env.int("FEDIVERSER_HTTP_SITE_CACHE_TTL", default=21600)
+
+    class Tasks:
+        deduplication_ttl = env.int("FEDIVERSER_TASK_DEDUPLICATION_TTL", default=60)
+
     @property
     def registration_methods(self):
         methods = []
@@ -0,0 +1,361 @@
+import gzip
+import json
+import logging
+import os
+import tempfile
+from itertools import groupby, islice
+from operator import attrgetter
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Exists, Max, OuterRef, Q
+from django.utils import timezone
+
+from .models.activitypub import Community, Instance, Person
+from .models.common import make_http_client
+from .models.mapping import RedditToCommunityRecommendation
+from .models.network import (
+    ChangeFeedEntry,
+    ConnectedRedditAccount,
+    ConnectedRedditAccountEntry,
+    Endorsement,
+    EndorsementEntry,
+    FediversedInstance,
+    RedditToCommunityRecommendationEntry,
+)
+from .models.reddit import RedditAccount, RedditCommunity
+from .settings import app_settings
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_VERSION = 1
+BATCH_SIZE = 1000
+
+
+class InvalidSnapshot(Exception):
+    pass
+
+
+def _get_record(obj, fields):
+    # Related objects are referred to by their natural keys, so that the
+    # snapshot does not depend on the primary keys of the exporting portal.
+    return {field.split(".")[0]: attrgetter(field)(obj) for field in fields}
+
+
+def _get_records():
+    """
+    Yields (kind, data) pairs, with every record coming after the
+    records it refers to, so that a snapshot can be imported in a single
+    pass.
+    """
+
+    # Only the state that we published ourselves is exported. Whatever was
+    # merged from other partners is left for them to share.
+    published_by_us = Q(published_by__portal_url=app_settings.Portal.url)
+    connections = ConnectedRedditAccount.objects.filter(
+        Exists(
+            ConnectedRedditAccountEntry.objects.filter(
+                published_by_us,
+                reddit_account=OuterRef("reddit_account"),
+                actor=OuterRef("actor"),
+            )
+        )
+    )
+    recommendations = RedditToCommunityRecommendation.objects.filter(
+        Exists(
+            RedditToCommunityRecommendationEntry.objects.filter(
+                published_by_us,
+                subreddit=OuterRef("subreddit"),
+                community=OuterRef("community"),
+            )
+        )
+    )
+    endorsements = Endorsement.objects.filter(endorser__portal_url=app_settings.Portal.url)
+
+    communities = Community.objects.filter(id__in=recommendations.values("community_id"))
+    people = Person.objects.filter(id__in=connections.values("actor_id"))
+    instances = Instance.objects.filter(
+        Q(id__in=communities.values("instance_id")) | Q(id__in=people.values("instance_id"))
+    )
+    subreddits = RedditCommunity.objects.filter(id__in=recommendations.values("subreddit_id"))
+
+    sources = (
+        (
+            "instance",
+            instances.order_by("id"),
+            ("domain", "name", "description", "over18", "open_registrations", "software"),
+        ),
+        ("person", people.select_related("instance"), ("url", "name", "instance.domain")),
+        (
+            "community",
+            communities.select_related("instance"),
+            ("url", "name", "description", "instance.domain"),
+        ),
+        ("subreddit", subreddits, ("name", "description", "over18")),
+        (
+            "connection",
+            connections.select_related("reddit_account", "actor"),
+            ("reddit_account.username", "actor.url"),
+        ),
+        (
+            "recommendation",
+            recommendations.select_related("subreddit", "community"),
+            ("subreddit.name", "community.url"),
+        ),
+        (
+            "endorsement",
+            endorsements.select_related("endorser", "endorsed"),
+            ("endorser.portal_url", "endorsed.portal_url"),
+        ),
+    )
+
+    for kind, queryset, fields in sources:
+        for obj in queryset.iterator(chunk_size=BATCH_SIZE):
+            yield kind, _get_record(obj, fields)
+
+
+def export_snapshot(snapshot_file):
+    """
+    Writes the current state of the recommendations, account connections
+    and endorsements published by this portal as gzipped JSON lines, preceded by a header with the
+    change feed cursor that the snapshot is consistent with. Partners
+    that import the snapshot can tail the change feed from that cursor.
+    """
+
+    # The cursor is taken before the state is read. Changes that happen
+    # while the snapshot is written will be replayed by the partner, and
+    # merging a change twice does no harm.
+    cursor = ChangeFeedEntry.objects.filter(
+        published_by__portal_url=app_settings.Portal.url
+    ).aggregate(cursor=Max("id"))["cursor"]
+
+    header = {
+        "version": SNAPSHOT_VERSION,
+        "portal_url": app_settings.Portal.url,
+        "cursor": cursor or 0,
+        "created": timezone.now(),
+    }
+
+    counts = {}
+    with gzip.open(snapshot_file, "wt", encoding="utf-8") as output:
+        output.write(json.dumps({"kind": "header", "data": header}, cls=DjangoJSONEncoder) + "\n")
+        for kind, data in _get_records():
+            output.write(json.dumps({"kind": kind, "data": data}) + "\n")
+            counts[kind] = counts.get(kind, 0) + 1
+    return header, counts
+
+
+def write_snapshot(path=None):
+    """
+    Exports a snapshot to the configured path. The file is replaced
+    atomically, so that it can be served while a new one is written.
+    """
+
+    path = path or app_settings.Federation.snapshot_path
+    folder = os.path.dirname(path)
+    os.makedirs(folder, exist_ok=True)
+
+    with tempfile.NamedTemporaryFile(dir=folder, suffix=".tmp", delete=False) as snapshot_file:
+        try:
+            header, counts = export_snapshot(snapshot_file)
+        except Exception:
+            os.unlink(snapshot_file.name)
+            raise
+    os.replace(snapshot_file.name, path)
+    logger.info(f"Wrote snapshot at cursor {header['cursor']} to {path}: {counts}")
+    return path
+
+
+def _get_ids(model, field_name, keys):
+    return dict(
+        model.objects.filter(**{f"{field_name}__in": set(keys)}).values_list(field_name, "id")
+    )
+
+
+def _import_instances(partner, records):
+    Instance.objects.bulk_create(
+        [
+            Instance(
+                domain=data["domain"],
+                name=data["name"],
+                description=data["description"],
+                over18=data["over18"],
+                open_registrations=data["open_registrations"],
+                software=data["software"],
+            )
+            for data in records
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def _import_people(partner, records):
+    instance_ids = _get_ids(Instance, "domain", [data["instance"] for data in records])
+    Person.objects.bulk_create(
+        [
+            Person(url=data["url"], name=data["name"], instance_id=instance_ids[data["instance"]])
+            for data in records
+            if data["instance"] in instance_ids
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def _import_communities(partner, records):
+    instance_ids = _get_ids(Instance, "domain", [data["instance"] for data in records])
+    Community.objects.bulk_create(
+        [
+            Community(
+                url=data["url"],
+                name=data["name"],
+                description=data["description"],
+                instance_id=instance_ids[data["instance"]],
+            )
+            for data in records
+            if data["instance"] in instance_ids
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def _import_subreddits(partner, records):
+    RedditCommunity.objects.bulk_create(
+        [
+            RedditCommunity(
+                name=data["name"], description=data["description"], over18=data["over18"]
+            )
+            for data in records
+        ],
+        ignore_conflicts=True,
+    )
+
+
+# Connections and recommendations become change feed entries published
+# by the partner, to be reviewed and merged like the ones that we pull.
+# Entries are created one by one, because the change feed records are
+# written when they are saved.
+
+
+def _import_connections(partner, records):
+    accounts = RedditAccount.bulk_make([data["reddit_account"] for data in records])
+    actor_ids = _get_ids(Person, "url", [data["actor"] for data in records])
+    for data in records:
+        if data["actor"] in actor_ids:
+            ConnectedRedditAccountEntry.objects.get_or_create(
+                published_by=partner,
+                reddit_account=accounts[data["reddit_account"]],
+                actor_id=actor_ids[data["actor"]],
+            )
+
+
+def _import_recommendations(partner, records):
+    subreddit_ids = _get_ids(RedditCommunity, "name", [data["subreddit"] for data in records])
+    community_ids = _get_ids(Community, "url", [data["community"] for data in records])
+    for data in records:
+        if data["subreddit"] in subreddit_ids and data["community"] in community_ids:
+            RedditToCommunityRecommendationEntry.objects.get_or_create(
+                published_by=partner,
+                subreddit_id=subreddit_ids[data["subreddit"]],
+                community_id=community_ids[data["community"]],
+            )
+
+
+def _import_endorsements(partner, records):
+    # Just like in the change feed, partners can only vouch for themselves
+    endorsed_urls = {
+        data["endorsed"] for data in records if data["endorser"] == partner.portal_url
+    }
+    FediversedInstance.objects.bulk_create(
+        [FediversedInstance(portal_url=url) for url in endorsed_urls], ignore_conflicts=True
+    )
+    for endorsed_id in _get_ids(FediversedInstance, "portal_url", endorsed_urls).values():
+        endorsement, _ = Endorsement.objects.get_or_create(
+            endorser=partner, endorsed_id=endorsed_id
+        )
+        EndorsementEntry.objects.get_or_create(published_by=partner, endorsement=endorsement)
+
+
+IMPORTERS = {
+    "instance": _import_instances,
+    "person": _import_people,
+    "community": _import_communities,
+    "subreddit": _import_subreddits,
+    "connection": _import_connections,
+    "recommendation": _import_recommendations,
+    "endorsement": _import_endorsements,
+}
+
+
+def import_snapshot(snapshot_file, partner):
+    """
+    Loads a snapshot produced by the partner, keeping any rows that
+    already exist. Its connections, recommendations and endorsements
+    are added as entries published by the partner, nothing is merged.
+    The change feed cursor of the partner is moved to the one of the
+    snapshot.
+    """
+
+    counts = {}
+    with gzip.open(snapshot_file, "rt", encoding="utf-8") as snapshot:
+        lines = (json.loads(line) for line in snapshot if line.strip())
+        try:
+            header = next(lines)
+            assert header["kind"] == "header"
+            header = header["data"]
+        except (StopIteration, KeyError, AssertionError):
+            raise InvalidSnapshot("Snapshot does not start with a header")
+
+        if header.get("version") != SNAPSHOT_VERSION:
+            raise InvalidSnapshot(f"Unsupported snapshot version {header.get('version')}")
+
+        if header.get("portal_url") != partner.portal_url:
+            raise InvalidSnapshot(f"Snapshot was not produced by {partner.portal_url}")
+
+        with transaction.atomic():
+            for kind, records in groupby(lines, key=lambda record: record["kind"]):
+                importer = IMPORTERS.get(kind)
+                if importer is None:
+                    logger.warning(f"Ignoring unknown snapshot records of kind {kind}")
+                    continue
+
+                while batch := [record["data"] for record in islice(records, BATCH_SIZE)]:
+                    importer(partner, batch)
+                    counts[kind] = counts.get(kind, 0) + len(batch)
+
+            if (partner.change_feed_cursor or 0) < header["cursor"]:
+                partner.change_feed_cursor = header["cursor"]
+                partner.save(update_fields=["change_feed_cursor"])
+
+    return header, counts
+
+
+def bootstrap_from_partner(partner):
+    """
+    Downloads and imports the latest snapshot published by the partner.
+    """
+
+    client = make_http_client("federation")
+    response = client.get(
+        f"{partner.portal_url}/api/snapshot",
+        stream=True,
+        timeout=app_settings.Federation.sync_timeout,
+    )
+    response.raise_for_status()
+
+    with tempfile.TemporaryFile() as snapshot_file:
+        for chunk in response.iter_content(chunk_size=64 * 1024):
+            snapshot_file.write(chunk)
+        snapshot_file.seek(0)
+        header, counts = import_snapshot(snapshot_file, partner=partner)
+
+    logger.info(f"Bootstrapped from {partner} at cursor {header['cursor']}: {counts}")
+    return header, counts
+
+
+__all__ = (
+    "InvalidSnapshot",
+    "export_snapshot",
+    "write_snapshot",
+    "import_snapshot",
+    "bootstrap_from_partner",
+)
@@ -1,10 +1,13 @@
 import datetime
+import hashlib
+import json
 import logging
 import random
 
 from celery import shared_task
+from django.core.cache import cache
 from django.db import transaction
-from django.db.models import Max, Q
+from django.db.models import Exists, F, Max, OuterRef, Q
 from django.template.loader import render_to_string
 from django.urls import reverse
 from django.utils import timezone
@@ -12,19 +15,59 @@ from django.utils import timezone
 from fediverser.apps.lemmy.services import InstanceProxy, LemmyClientRateLimited, LocalUserProxy
 
 from .choices import AutomaticCommentPolicies, AutomaticSubmissionPolicies
+from .crawler import crawl_instances
+from .fetchers import FeedFetcher
 from .models.activitypub import Community, Instance, make_ap_client
-from .models.common import AP_SERVER_SOFTWARE
+from .models.archive import RedditArchive
+from .models.common import AP_SERVER_SOFTWARE, INSTANCE_STATUSES, DomainHealth
 from .models.feeds import Entry, Feed
 from .models.invites import RedditorInvite
-from .models.mapping import InstanceExtraInformation
-from .models.mirroring import LemmyMirroredComment, LemmyMirroredPost
-from .models.network import FediversedInstance
+from .models.mapping import InstanceAnnotation, InstanceExtraInformation
+from .models.mirroring import LemmyMirroredComment, LemmyMirroredPost, RedditMirrorStrategy
+from .models.network import ChangeFeedEntry, FediversedInstance, InstanceStatus, TrustScore
+from .models.push import ChangeFeedSubscription, subscribe_to_partner
 from .models.reddit import RedditComment, RedditCommunity, RedditSubmission, RejectedPost
+from .reconciliation import reconcile_with_partner
 from .settings import app_settings
+from .snapshots import write_snapshot
 
 logger = logging.getLogger(__name__)
 
 
+def _get_enqueued_key(task, args, kw):
+    call_signature = json.dumps([args, kw], sort_keys=True, default=str)
+    digest = hashlib.sha1(call_signature.encode()).hexdigest()
+    return f"fediverser:tasks:enqueued:{task.name}:{digest}"
+
+
+def enqueue(task, *args, **kw):
+    """
+    Schedules a task, unless an identical call (same task, same
+    arguments) was already scheduled within the deduplication window.
+    Returns the AsyncResult or None if the call was dropped.
+    """
+
+    key = _get_enqueued_key(task, args, kw)
+    ttl = app_settings.Tasks.deduplication_ttl
+
+    if not cache.add(key, timezone.now().isoformat(), timeout=ttl):
+        logger.debug(f"Skipping {task.name}, identical call is already scheduled")
+        return None
+
+    return task.delay(*args, **kw)
+
+
+def release(task, *args, **kw):
+    """
+    Lets identical calls be scheduled again. Tasks that rebuild state
+    from the database call it when they start, so that changes made
+    while they run are picked up by another run instead of being
+    dropped until the deduplication window expires.
+    """
+
+    cache.delete(_get_enqueued_key(task, args, kw))
+
+
 @shared_task
 def post_mirror_disclosure(mirrored_post_id):
     try:
@@ -97,6 +140,52 @@ def send_invite_to_redditor(invite_id):
         invite.save()
 
 
+@shared_task
+def crawl_fediverse_instances():
+    crawl_instances()
+
+
+def _set_instance_status(domains, status, previous):
+    for instance in Instance.objects.filter(domain__in=domains):
+        InstanceStatus.objects.update_or_create(instance=instance, defaults={"status": status})
+        annotation, _ = InstanceAnnotation.objects.get_or_create(instance=instance)
+        if not annotation.locked and annotation.status == previous:
+            annotation.status = status
+            annotation.save()
+
+
+@shared_task
+def flush_domain_health():
+    DomainHealth.flush()
+
+
+@shared_task
+def flag_unreachable_instances():
+    """
+    Marks as closed the instances that could not be reached for longer
+    than the configured period, and reopens the ones flagged before
+    that are reachable again. Annotations that were locked by a
+    moderator are left as they are.
+    """
+
+    DomainHealth.flush()
+    cutoff = timezone.now() - app_settings.Http.unreachable_instance_period
+    unreachable = DomainHealth.objects.filter(
+        failures__gt=0, down_since__lte=cutoff, flagged=False
+    )
+    recovered = DomainHealth.objects.filter(failures=0, flagged=True)
+
+    with transaction.atomic():
+        domains = list(unreachable.values_list("domain", flat=True))
+        _set_instance_status(domains, INSTANCE_STATUSES.closed, previous=INSTANCE_STATUSES.active)
+        DomainHealth.objects.filter(domain__in=domains).update(flagged=True)
+
+    with transaction.atomic():
+        domains = list(recovered.values_list("domain", flat=True))
+        _set_instance_status(domains, INSTANCE_STATUSES.active, previous=INSTANCE_STATUSES.closed)
+        DomainHealth.objects.filter(domain__in=domains).delete()
+
+
 @shared_task
 def get_instance_details(domain):
     try:
@@ -125,6 +214,11 @@ def fetch_subreddit(subreddit_name):
     RedditCommunity.fetch(subreddit_name)
 
 
+@shared_task
+def fetch_reddit_submissions(submission_ids):
+    RedditSubmission.fetch_many(submission_ids)
+
+
 @shared_task
 def fetch_new_posts(subreddit_name):
     try:
@@ -155,8 +249,7 @@ def mirror_comment_to_lemmy(comment_id):
             logger.exception(f"Failed to mirror comment {comment_id} to {community_name}")
 
 
-@shared_task
-def push_new_comments_to_lemmy():
+def get_subreddits_with_comment_mirroring():
     allows_mirroring = Q(
         mirroring_strategies__automatic_comment_policy__in=[
             AutomaticCommentPolicies.FULL,
@@ -167,7 +260,56 @@ def push_new_comments_to_lemmy():
 
     mapped = Q(mirroring_strategies__isnull=False)
 
-    for subreddit in RedditCommunity.objects.filter(mapped & allows_mirroring):
+    return RedditCommunity.objects.filter(mapped & allows_mirroring)
+
+
+def get_comments_to_mirror(subreddit, threshold):
+    candidates = RedditComment.objects.filter(
+        created__gte=threshold,
+        submission__subreddit=subreddit,
+        status=RedditComment.STATUS.retrieved,
+    )
+
+    # Correlated EXISTS subqueries (instead of joins on the reverse
+    # relations) let postgres probe the foreign key indexes row by row,
+    # instead of hashing the whole table of mirrored posts.
+    with_mirrored_submissions = Exists(
+        LemmyMirroredPost.objects.filter(reddit_submission_id=OuterRef("submission_id"))
+    )
+    no_pending_parent = Q(parent=None) | Q(parent__status=RedditComment.STATUS.mirrored)
+
+    return candidates.filter(with_mirrored_submissions).filter(no_pending_parent)
+
+
+def get_submissions_to_mirror(now):
+    is_retrieved = Q(status=RedditSubmission.STATUS.retrieved)
+    is_recent = Q(created__gt=now - datetime.timedelta(days=1))
+    allows_automatic_mirroring = Exists(
+        RedditMirrorStrategy.objects.filter(
+            subreddit_id=OuterRef("subreddit_id"),
+            automatic_submission_policy__in=[
+                AutomaticSubmissionPolicies.FULL,
+                AutomaticSubmissionPolicies.SELF_POST_ONLY,
+                AutomaticSubmissionPolicies.LINK_ONLY,
+            ],
+        )
+    )
+
+    already_posted = Exists(LemmyMirroredPost.objects.filter(reddit_submission_id=OuterRef("pk")))
+    from_spammer = Q(author__marked_as_spammer=True)
+    from_bot = Q(author__marked_as_bot=True)
+
+    return (
+        RedditSubmission.objects.filter(is_retrieved & is_recent)
+        .filter(allows_automatic_mirroring)
+        .exclude(already_posted)
+        .exclude(from_spammer | from_bot)
+    )
+
+
+@shared_task
+def push_new_comments_to_lemmy():
+    for subreddit in get_subreddits_with_comment_mirroring():
         logger.info(f"Checking comments for {subreddit}")
         mirrored_comments = LemmyMirroredComment.objects.filter(
             lemmy_mirrored_post__reddit_submission__subreddit=subreddit
@@ -177,18 +319,9 @@ def push_new_comments_to_lemmy():
         threshold = most_recent or timezone.now() - datetime.timedelta(minutes=10)
 
         logger.info(f"Finding all comments created after {threshold}")
-        candidates = RedditComment.objects.filter(
-            created__gte=threshold,
-            submission__subreddit=subreddit,
-            status=RedditComment.STATUS.retrieved,
-        )
-
-        with_mirrored_submissions = Q(submission__lemmy_mirrored_posts__isnull=False)
-        no_pending_parent = Q(parent=None) | Q(parent__status=RedditComment.STATUS.mirrored)
+        comments = get_comments_to_mirror(subreddit, threshold)
 
-        comments = candidates.filter(with_mirrored_submissions).filter(no_pending_parent)
-
-        for comment in comments.distinct().iterator():
+        for comment in comments.iterator():
             comment.status = RedditComment.STATUS.accepted
             comment.save()
 
@@ -198,29 +331,9 @@ def push_new_comments_to_lemmy():
 
 @shared_task
 def push_new_submissions_to_lemmy():
-    NOW = timezone.now()
+    submissions = get_submissions_to_mirror(timezone.now())
 
-    is_retrieved = Q(status=RedditSubmission.STATUS.retrieved)
-    allows_automatic_mirroring = Q(
-        subreddit__mirroring_strategies__automatic_submission_policy__in=[
-            AutomaticSubmissionPolicies.FULL,
-            AutomaticSubmissionPolicies.SELF_POST_ONLY,
-            AutomaticSubmissionPolicies.LINK_ONLY,
-        ]
-    )
-
-    unmapped = Q(subreddit__mirroring_strategies__isnull=True)
-    old_post = Q(created__lte=NOW - datetime.timedelta(days=1))
-
-    already_posted = Q(lemmy_mirrored_posts__isnull=False)
-    from_spammer = Q(author__marked_as_spammer=True)
-    from_bot = Q(author__marked_as_bot=True)
-
-    submissions = RedditSubmission.objects.filter(
-        is_retrieved & allows_automatic_mirroring
-    ).exclude(unmapped | from_spammer | from_bot | old_post | already_posted)
-
-    for reddit_submission in submissions.distinct().order_by("?"):
+    for reddit_submission in submissions.order_by("?"):
         logger.info(f"Checking submission {reddit_submission.url}")
 
         if not reddit_submission.can_be_submitted_automatically:
@@ -263,42 +376,195 @@ def fetch_feed(feed_url):
 
 @shared_task
 def fetch_feeds():
-    for feed in Feed.objects.all():
-        feed.fetch()
+    fetcher = FeedFetcher()
+    while feeds := Feed.claim_due_feeds():
+        for feed, result in fetcher.fetch(feeds):
+            try:
+                if result is None:
+                    feed.schedule_next_fetch()
+                else:
+                    feed.process(result)
+            except Exception:
+                logger.exception(f"Failed to process entries from {feed.url}")
+
+
+@shared_task
+def make_subreddit_feeds():
+    release(make_subreddit_feeds)
+    tracked_subreddits = RedditCommunity.objects.filter(useraccount__isnull=False).distinct()
+    Feed.make_subreddit_feeds(tracked_subreddits)
 
 
 @shared_task
 def clear_old_feed_entries():
     now = timezone.now()
     cutoff = now - Entry.MAX_AGE
-    Entry.objects.filter(modified__lte=cutoff).delete()
+    Entry.purge(cutoff)
+
+
+@shared_task
+def archive_reddit_content():
+    RedditArchive.make()
+
+
+@shared_task
+def export_snapshot():
+    write_snapshot()
+
+
+def _is_sync_due(partner, now):
+    if partner.last_sync_attempt is None:
+        return True
+
+    elapsed = now - partner.last_sync_attempt
+
+    # Partners that keep failing are left alone for longer each time,
+    # so that they do not take workers away from the healthy ones.
+    if partner.sync_failures:
+        return elapsed >= partner.get_sync_backoff()
+
+    # Partner pushes its changes to us, pulling is only a fallback for
+    # deliveries that it gave up on.
+    if partner.push_secret:
+        return elapsed >= app_settings.Federation.push_fallback_interval
+
+    # To avoid "thundering herd" types of issues, the actual sync is
+    # scheduled X% of the time, where X is the amount of minutes elapsed
+    # since the last sync job. This will mean each instance will have a
+    # 50% of being synced after 50 minutes, and 100% after 1h40minutes.
+    minutes_elapsed = int(elapsed.total_seconds() / 60)
+    return (minutes_elapsed / 100) >= random.random()
 
 
 @shared_task
 def sync_change_feeds():
-    # We are going to set this task to run every minute, but to avoid
-    # "thundering herd" types of issues, we are going to execute the
-    # actual sync call X% of the time, where X is the amount of
-    # minutes elapsed since the last sync job.
+    """
+    Runs every minute, logging how far behind each partner we are and
+    scheduling a separate sync for each partner that is due, so that a
+    slow or unreachable partner does not hold back the others.
+    """
 
-    # This will mean each instance will have a 50% of being synced
-    # after 20 minutes, and 100% after 1h40minutes.
+    now = timezone.now()
 
-    instances_to_sync = FediversedInstance.partners.all()
+    # Partners we trust the most are scheduled first, so that they are
+    # ahead in the queue when there are more syncs due than workers.
+    partners = FediversedInstance.partners.with_sync_status().order_by(
+        F("trust_score__score").desc(nulls_last=True), "id"
+    )
 
-    if not instances_to_sync:
+    if not partners:
         logger.info("No active partners to pull changes from")
-    logger.debug(
-        f"Attempting sync for {', '.join(instances_to_sync.values_list('portal_url', flat=True))}"
-    )
 
-    for instance in instances_to_sync:
-        last_sync = instance.sync_jobs.order_by("run_on").first()
+    for partner in partners:
+        lag = partner.get_sync_lag(now=now)
+        if lag is not None and lag > app_settings.Federation.sync_lag_warning:
+            logger.warning(f"Change feed of {partner} was last synced {lag} ago")
+
+        if _is_sync_due(partner, now):
+            enqueue(sync_partner_change_feed, partner.id)
+
+
+SYNC_TIME_LIMIT = (
+    app_settings.Federation.sync_budget_seconds + 4 * app_settings.Federation.sync_timeout
+)
+
+
+@shared_task(
+    soft_time_limit=app_settings.Federation.sync_budget_seconds
+    + 2 * app_settings.Federation.sync_timeout,
+    time_limit=SYNC_TIME_LIMIT,
+)
+def sync_partner_change_feed(partner_id):
+    try:
+        partner = FediversedInstance.partners.get(id=partner_id)
+    except FediversedInstance.DoesNotExist:
+        logger.warning(f"Partner {partner_id} not found")
+        return
+
+    # The supervisor and the continuation of a run can both schedule a
+    # sync, only one of them may pull at a time.
+    lock_key = f"fediverser:tasks:sync_partner_change_feed:{partner_id}"
+    if not cache.add(lock_key, timezone.now().isoformat(), timeout=SYNC_TIME_LIMIT):
+        logger.info(f"Change feed of {partner} is already being synced")
+        return
+
+    try:
+        # Runs that stopped halfway did not see the older entries, only
+        # the ones that caught up tell from where to pull.
+        last_sync = (
+            partner.sync_jobs.filter(succeeded=True, caught_up=True).order_by("-run_on").first()
+        )
         since = last_sync and last_sync.run_on
-        if not since:
-            instance.sync_change_feeds()
-        else:
-            minutes_elapsed = int((timezone.now() - since).seconds / 60)
 
-            if (minutes_elapsed / 100) >= random.random():
-                instance.sync_change_feeds(since=since)
+        # Without a cursor, a run that stopped halfway can not be
+        # continued, so the feed is pulled in full.
+        budget = {}
+        if partner.change_feed_cursor is not None:
+            budget = {
+                "max_pages": app_settings.Federation.sync_budget_pages,
+                "max_seconds": app_settings.Federation.sync_budget_seconds,
+            }
+        job = partner.sync_change_feeds(since=since, **budget)
+    finally:
+        cache.delete(lock_key)
+
+    # Going back to the queue lets the other partners have their turn
+    # before we continue with the pages that did not fit in the budget.
+    if job.succeeded and not job.caught_up:
+        sync_partner_change_feed.delay(partner_id)
+
+
+@shared_task
+def update_trust_scores():
+    release(update_trust_scores)
+    TrustScore.rebuild()
+
+
+@shared_task
+def reconcile_change_feeds():
+    for partner in FediversedInstance.partners.filter(change_feed_cursor__isnull=False):
+        enqueue(reconcile_partner_change_feed, partner.id)
+
+
+@shared_task
+def reconcile_partner_change_feed(partner_id):
+    try:
+        partner = FediversedInstance.partners.get(id=partner_id)
+        reconcile_with_partner(partner)
+    except FediversedInstance.DoesNotExist:
+        logger.warning(f"Partner {partner_id} not found")
+    except Exception:
+        logger.exception(f"Failed to reconcile change feed with partner {partner_id}")
+
+
+@shared_task
+def subscribe_to_partners():
+    for partner in FediversedInstance.partners.filter(push_secret__isnull=True):
+        try:
+            subscribe_to_partner(partner)
+        except Exception as exc:
+            logger.info(f"Could not subscribe to changes from {partner}: {exc}")
+
+
+@shared_task
+def push_change_feed_entries():
+    release(push_change_feed_entries)
+    subscriptions = ChangeFeedSubscription.objects.filter(
+        active=True, deliveries__next_attempt_at__lte=timezone.now()
+    ).distinct()
+
+    for subscription in subscriptions:
+        while subscription.deliver() == app_settings.Federation.push_batch_size:
+            continue
+
+
+@shared_task
+def ingest_pushed_change_feed_entries(instance_id, entries, previous_id=None):
+    instance = FediversedInstance.objects.get(id=instance_id)
+    ChangeFeedEntry.ingest(instance=instance, entries=entries)
+
+    # Batches that continue from our cursor spare the fallback pull from
+    # downloading them again.
+    ids = [entry["id"] for entry in entries if "id" in entry]
+    if previous_id is not None and ids:
+        instance.advance_change_feed_cursor(previous_id, max(ids))
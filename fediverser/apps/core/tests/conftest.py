@@ -0,0 +1,27 @@
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def clear_current_fediversed_instance():
+    # The node identity is kept in memory, but each test rolls back the
+    # row it points to.
+    from fediverser.apps.core.models.network import FediversedInstance
+
+    FediversedInstance.clear_current()
+    yield
+    FediversedInstance.clear_current()
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    # Outcomes of requests are kept in the cache until they are flushed,
+    # and counters in memory until they are added to the cache.
+    from django.core.cache import cache
+
+    from fediverser.apps.core import metrics
+
+    metrics.flush()
+    cache.clear()
+    yield
+    metrics.flush()
+    cache.clear()
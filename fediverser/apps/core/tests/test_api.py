@@ -1,6 +1,13 @@
+from unittest import mock
+
+from django.core.cache import cache
 from rest_framework.test import APIClient
 
 from fediverser.apps.core import factories
+from fediverser.apps.core.models import activitypub, network
+from fediverser.apps.core.models.network import ChangeFeedEntry, ChangeFeedResolver
+from fediverser.apps.core.pagination import KeysetPagination
+from fediverser.apps.core.serializers import PolymorphicChangeFeedEntrySerializer
 from fediverser.apps.core.settings import app_settings
 
 from .common import BaseTestCase
@@ -8,6 +15,7 @@ from .common import BaseTestCase
 
 class APITestCase(BaseTestCase):
     def setUp(self):
+        cache.clear()
         self.client = APIClient()
 
 
@@ -29,6 +37,22 @@ class SubredditAPITestCase(APITestCase):
         self.assertEqual(len(response.data), 1)
 
 
+class NodeInfoAPITestCase(APITestCase):
+    def test_node_identity_is_kept_in_memory(self):
+        self.client.get("/api/nodeinfo")
+
+        with self.assertNumQueries(0):
+            response = self.client.get("/api/nodeinfo")
+        self.assertEqual(response.data["portal_url"], app_settings.Portal.url)
+
+    def test_node_identity_follows_settings(self):
+        self.client.get("/api/nodeinfo")
+
+        with mock.patch.object(app_settings.Portal, "accepts_community_requests", True):
+            response = self.client.get("/api/nodeinfo")
+        self.assertTrue(response.data["accepts_community_requests"])
+
+
 class ChangeFeedAPITestCase(APITestCase):
 
     def test_can_get_connected_account_entry(self):
@@ -39,8 +63,232 @@ class ChangeFeedAPITestCase(APITestCase):
         response = self.client.get("/api/changes")
         self.assertEqual(response.status_code, 200)
 
+    def test_entries_are_served_without_looking_up_the_node(self):
+        portal = factories.FediversedInstanceFactory(portal_url=app_settings.Portal.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            entry = factories.ConnectedRedditAccountEntryFactory(published_by=portal)
+        self.client.get(f"/api/changes/{entry.pk}")
+
+        with self.assertNumQueries(1):
+            response = self.client.get(f"/api/changes/{entry.pk}")
+        self.assertEqual(response.status_code, 200)
+
+    def test_entries_are_served_from_records(self):
+        portal = factories.FediversedInstanceFactory(portal_url=app_settings.Portal.url)
+        entry = factories.ConnectedRedditAccountEntryFactory(published_by=portal)
+
+        # Feed version, count for the pagination and the records
+        with self.assertNumQueries(3):
+            response = self.client.get("/api/changes")
+
+        self.assertEqual(len(response.data), 1)
+        self.assertEqual(response.data[0]["id"], entry.id)
+        self.assertEqual(response.data[0]["type"], "connection:reddit")
+        self.assertEqual(response.data[0]["reddit_account"], entry.reddit_account.username)
+        self.assertEqual(response.data[0]["actor"], entry.actor.url)
+        self.assertEqual(response.data[0]["description"], entry.description)
+
+        expected = PolymorphicChangeFeedEntrySerializer(
+            ChangeFeedEntry.objects.get_subclass(id=entry.id), context={"request": None}
+        ).data
+        self.assertEqual(response.data[0]["created"], expected["created"])
+
+    def test_cached_pages_link_to_the_requested_host(self):
+        portal = factories.FediversedInstanceFactory(portal_url=app_settings.Portal.url)
+        factories.ConnectedRedditAccountEntryFactory.create_batch(2, published_by=portal)
+
+        with mock.patch.object(KeysetPagination, "page_size", 1):
+            for host in ("one.example.com", "two.example.com"):
+                response = self.client.get("/api/changes", {"after_id": 0}, HTTP_HOST=host)
+                self.assertIn(f"http://{host}/api/changes", response["Link"])
+
+    def test_unchanged_feed_is_not_modified(self):
+        portal = factories.FediversedInstanceFactory(portal_url=app_settings.Portal.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            factories.ConnectedRedditAccountEntryFactory(published_by=portal)
+
+        response = self.client.get("/api/changes")
+        etag = response["ETag"]
+        self.assertIn("Accept", response["Vary"])
+
+        with self.assertNumQueries(0):
+            response = self.client.get("/api/changes", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertIn("Accept", response["Vary"])
+
+        with self.assertNumQueries(0):
+            response = self.client.get("/api/changes")
+        self.assertEqual(len(response.data), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            factories.ConnectedRedditAccountEntryFactory(published_by=portal)
+
+        response = self.client.get("/api/changes", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(len(response.data), 2)
+
+    def test_unchanged_atom_feed_is_not_modified(self):
+        factories.ConnectedRedditAccountEntryFactory()
+
+        response = self.client.get("/feed/changes")
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.get("/feed/changes", HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 304)
+
+    def test_can_page_entries_after_cursor(self):
+        portal = factories.FediversedInstanceFactory(portal_url=app_settings.Portal.url)
+        entries = [
+            factories.ConnectedRedditAccountEntryFactory(published_by=portal) for _ in range(4)
+        ]
+
+        with mock.patch.object(KeysetPagination, "page_size", 2):
+            response = self.client.get(f"/api/changes?after_id={entries[0].id}")
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual([e["id"] for e in response.data], [entries[1].id, entries[2].id])
+            self.assertIn(f"after_id={entries[2].id}", response["Link"])
+
+            response = self.client.get(f"/api/changes?after_id={entries[2].id}")
+            self.assertEqual([e["id"] for e in response.data], [entries[3].id])
+            self.assertNotIn("Link", response)
+
+
+class ChangeFeedSyncTestCase(BaseTestCase):
+    def setUp(self):
+        self.partner = factories.FediversedInstanceFactory()
+        self.client = mock.Mock()
+        patcher = mock.patch.object(network, "make_http_client", return_value=self.client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def make_response(self, entries, next_url=None):
+        response = mock.Mock(links={"next": {"url": next_url}} if next_url else {})
+        response.json.return_value = entries
+        return response
+
+    def test_cursor_is_advanced_across_pages(self):
+        next_url = f"{self.partner.portal_url}/api/changes?after_id=2"
+        self.client.get.side_effect = [
+            self.make_response([{"id": 1, "type": "unknown"}, {"id": 2}], next_url=next_url),
+            self.make_response([{"id": 3, "type": "unknown"}]),
+        ]
+        self.partner.sync_change_feeds()
+
+        urls = [call.args[0] for call in self.client.get.call_args_list]
+        self.assertEqual(urls, [f"{self.partner.portal_url}/api/changes?after_id=0", next_url])
+        self.partner.refresh_from_db()
+        self.assertEqual(self.partner.change_feed_cursor, 3)
+
+    def test_sync_resumes_from_stored_cursor(self):
+        self.partner.change_feed_cursor = 42
+        self.client.get.return_value = self.make_response([])
+        self.partner.sync_change_feeds()
+
+        self.client.get.assert_called_once()
+        self.assertTrue(self.client.get.call_args.args[0].endswith("/api/changes?after_id=42"))
+
+    def test_sync_stops_when_page_budget_is_exhausted(self):
+        next_url = f"{self.partner.portal_url}/api/changes?after_id=1"
+        self.client.get.return_value = self.make_response(
+            [{"id": 1, "type": "unknown"}], next_url=next_url
+        )
+        job = self.partner.sync_change_feeds(max_pages=1)
+
+        self.client.get.assert_called_once()
+        self.assertIsNotNone(self.client.get.call_args.kwargs["timeout"])
+        self.assertTrue(job.succeeded)
+        self.assertFalse(job.caught_up)
+        self.assertEqual(job.entry_count, 1)
+
+    def test_failures_are_counted_until_a_sync_succeeds(self):
+        self.client.get.side_effect = ConnectionError("Timed out")
+        self.partner.sync_change_feeds()
+        job = self.partner.sync_change_feeds()
+
+        self.assertFalse(job.succeeded)
+        self.assertEqual(self.partner.sync_failures, 2)
+
+        self.client.get.side_effect = None
+        self.client.get.return_value = self.make_response([])
+        self.partner.sync_change_feeds()
+        self.partner.refresh_from_db()
+        self.assertEqual(self.partner.sync_failures, 0)
+
+
+class ChangeFeedIngestTestCase(BaseTestCase):
+    def setUp(self):
+        self.partner = factories.FediversedInstanceFactory()
+        self.resolver = ChangeFeedResolver(max_workers=2)
+
+        patchers = [
+            mock.patch.object(
+                activitypub.Instance,
+                "get_software_info",
+                return_value={"software": {"name": "lemmy"}},
+            ),
+            mock.patch.object(
+                activitypub.ActorMixin, "get_metadata", side_effect=self.get_metadata
+            ),
+        ]
+        self.get_software_info, self.get_metadata_mock = [p.start() for p in patchers]
+        for patcher in patchers:
+            self.addCleanup(patcher.stop)
+
+    def get_metadata(self, url):
+        if "missing" in url:
+            raise ValueError("Not found")
+        return {"type": "Person", "preferredUsername": url.rsplit("/", 1)[-1]}
+
+    def make_entry(self, username, actor_url):
+        return {"type": "connection:reddit", "reddit_account": username, "actor": actor_url}
+
+    def test_references_are_resolved_once_per_page(self):
+        entries = [
+            self.make_entry("alice", "https://lemmy.example.com/u/alice"),
+            self.make_entry("alice_alt", "https://lemmy.example.com/u/alice"),
+            self.make_entry("bob", "https://lemmy.example.com/u/bob"),
+        ]
+        created = ChangeFeedEntry.ingest(self.partner, entries, resolver=self.resolver)
+
+        self.assertEqual(len(created), 3)
+        self.get_software_info.assert_called_once_with("https://lemmy.example.com")
+        self.assertEqual(self.get_metadata_mock.call_count, 2)
+
+    def test_unresolved_references_only_skip_their_entries(self):
+        entries = [
+            self.make_entry("alice", "https://lemmy.example.com/u/alice"),
+            self.make_entry("ghost", "https://lemmy.example.com/u/missing"),
+        ]
+        created = ChangeFeedEntry.ingest(self.partner, entries, resolver=self.resolver)
+        self.assertEqual([entry.reddit_account.username for entry in created], ["alice"])
+
+        # Failures are remembered, and not looked up again on the next page
+        ChangeFeedEntry.ingest(self.partner, entries[1:], resolver=self.resolver)
+        self.assertEqual(self.get_metadata_mock.call_count, 2)
+
+    def test_endorsements_by_other_portals_are_rejected(self):
+        other, endorsed = factories.FediversedInstanceFactory.create_batch(2)
+        entries = [
+            {
+                "type": "endorsement",
+                "endorser": endorser.portal_url,
+                "endorsed": endorsed.portal_url,
+            }
+            for endorser in (self.partner, other)
+        ]
+
+        with self.assertLogs(network.logger, "WARNING"):
+            created = ChangeFeedEntry.ingest(self.partner, entries, resolver=self.resolver)
+
+        self.assertEqual(len(created), 1)
+        self.assertFalse(network.Endorsement.objects.filter(endorser=other).exists())
+
 
 __all__ = (
     "SubredditAPITestCase",
+    "NodeInfoAPITestCase",
     "ChangeFeedAPITestCase",
+    "ChangeFeedSyncTestCase",
+    "ChangeFeedIngestTestCase",
 )
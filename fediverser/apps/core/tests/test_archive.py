@@ -0,0 +1,109 @@
+import datetime
+import io
+import os
+import tempfile
+from unittest import mock
+
+from django.core.management import call_command
+from django.db.models import signals
+from django.utils import timezone
+from factory.django import mute_signals
+
+from fediverser.apps.core import factories
+from fediverser.apps.core.models.archive import RedditArchive
+from fediverser.apps.core.models.mirroring import LemmyMirroredPost
+from fediverser.apps.core.models.reddit import RedditSubmission
+from fediverser.apps.core.settings import app_settings
+from fediverser.apps.core.views.reddit import RedditSubmissionView
+
+from .common import BaseTestCase
+
+
+class RedditArchiveTestCase(BaseTestCase):
+    def setUp(self):
+        self.archive_folder = tempfile.TemporaryDirectory()
+        patcher = mock.patch.object(app_settings.Archive, "path", self.archive_folder.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        long_ago = timezone.now() - datetime.timedelta(days=90)
+        self.old_post = factories.RedditSubmissionFactory(selftext="old news")
+        self.mirrored_post = factories.RedditSubmissionFactory(selftext="mirrored")
+        self.recent_post = factories.RedditSubmissionFactory(selftext="breaking news")
+        RedditSubmission.objects.filter(id__in=[self.old_post.id, self.mirrored_post.id]).update(
+            created=long_ago
+        )
+
+        with mute_signals(signals.post_save):
+            LemmyMirroredPost.objects.create(
+                reddit_submission=self.mirrored_post,
+                community=factories.CommunityFactory(),
+                lemmy_post_id=1,
+            )
+
+    def tearDown(self):
+        self.archive_folder.cleanup()
+
+    def test_old_content_is_moved_to_archive(self):
+        archive = RedditArchive.make()
+
+        self.assertEqual(archive.submission_count, 2)
+        self.assertFalse(RedditSubmission.objects.filter(id=self.old_post.id).exists())
+        self.assertTrue(RedditSubmission.objects.filter(id=self.recent_post.id).exists())
+
+        stub = RedditSubmission.objects.get(id=self.mirrored_post.id)
+        self.assertIsNone(stub.selftext)
+
+    def test_can_read_archived_submission(self):
+        RedditArchive.make()
+
+        submission = RedditArchive.find_submission(self.old_post.id)
+        self.assertEqual(submission.title, self.old_post.title)
+        self.assertEqual(submission.selftext, "old news")
+        self.assertEqual(submission.subreddit, self.old_post.subreddit)
+
+    def test_stubs_are_shown_with_archived_text(self):
+        RedditArchive.make()
+
+        view = RedditSubmissionView(kwargs={"submission_id": self.mirrored_post.id})
+        submission = view.get_object()
+        self.assertEqual(submission.id, self.mirrored_post.id)
+        self.assertEqual(submission.selftext, "mirrored")
+
+    def test_link_posts_do_not_read_the_archive(self):
+        RedditArchive.make()
+        link_post = factories.RedditSubmissionFactory(selftext=None)
+
+        with mock.patch.object(RedditArchive, "read") as read:
+            view = RedditSubmissionView(kwargs={"submission_id": link_post.id})
+            self.assertEqual(view.get_object().id, link_post.id)
+        read.assert_not_called()
+
+    def test_database_is_untouched_when_archive_cannot_be_written(self):
+        with mock.patch.object(RedditArchive, "_write", side_effect=OSError("disk full")):
+            with self.assertRaises(OSError):
+                RedditArchive.make()
+
+        self.assertFalse(RedditArchive.objects.exists())
+        self.assertTrue(RedditSubmission.objects.filter(id=self.old_post.id).exists())
+        self.assertEqual(len(os.listdir(self.archive_folder.name)), 0)
+
+    def test_content_that_can_be_mirrored_is_kept_whatever_the_cutoff(self):
+        RedditSubmission.objects.filter(id=self.recent_post.id).update(
+            created=timezone.now() - datetime.timedelta(days=2)
+        )
+
+        call_command("archive_reddit_content", days=1, stdout=io.StringIO())
+
+        self.assertFalse(RedditSubmission.objects.filter(id=self.old_post.id).exists())
+        recent_post = RedditSubmission.objects.get(id=self.recent_post.id)
+        self.assertEqual(recent_post.selftext, "breaking news")
+
+    def test_nothing_is_written_when_nothing_qualifies(self):
+        RedditArchive.make()
+
+        self.assertIsNone(RedditArchive.make())
+        self.assertEqual(RedditArchive.objects.count(), 1)
+
+
+__all__ = ("RedditArchiveTestCase",)
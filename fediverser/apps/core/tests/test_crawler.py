@@ -0,0 +1,66 @@
+from unittest import mock
+
+from fediverser.apps.core import crawler, factories
+from fediverser.apps.core.models.activitypub import Instance
+from fediverser.apps.core.models.mapping import InstanceExtraInformation
+
+from .common import BaseTestCase
+
+
+class InstanceCrawlerTestCase(BaseTestCase):
+    def setUp(self):
+        self.client = mock.Mock()
+        self.client.get.side_effect = self.serve
+        patcher = mock.patch.object(crawler, "make_ap_client", return_value=self.client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.software = {
+            "lemmy.example.com": "lemmy",
+            "mbin.example.com": "mbin",
+            "mastodon.example.com": "mastodon",
+            "pixelfed.example.com": "pixelfed",
+        }
+
+    def serve(self, url):
+        domain = url.split("/")[2]
+        if domain not in self.software:
+            raise ConnectionError(f"Could not reach {domain}")
+
+        if url.endswith("/.well-known/nodeinfo"):
+            data = {"links": [{"href": f"https://{domain}/nodeinfo/2.0.json"}]}
+        elif url.endswith("/nodeinfo/2.0.json"):
+            data = {"software": {"name": self.software[domain]}, "openRegistrations": True}
+        else:
+            site = {"name": "Lemmy Example", "description": "A test instance"}
+            local_site = {"registration_mode": "RequireApplication"}
+            data = {"site_view": {"site": site, "local_site": local_site}}
+        return mock.Mock(json=mock.Mock(return_value=data))
+
+    def test_supported_instances_are_stored_in_bulk(self):
+        factories.InstanceFactory(domain="mbin.example.com", name="Existing")
+        found = crawler.crawl_instances(
+            list(self.software) + ["unreachable.example.com"], concurrency=4, per_host=1
+        )
+
+        self.assertEqual(len(found), 3)
+        self.assertFalse(Instance.objects.filter(domain="pixelfed.example.com").exists())
+        self.assertFalse(Instance.objects.filter(domain="unreachable.example.com").exists())
+
+        lemmy = Instance.objects.get(domain="lemmy.example.com")
+        self.assertEqual((lemmy.name, lemmy.software), ("Lemmy Example", "lemmy"))
+        self.assertTrue(lemmy.open_registrations)
+        self.assertTrue(InstanceExtraInformation.objects.get(instance=lemmy).application_required)
+
+        mbin = Instance.objects.get(domain="mbin.example.com")
+        self.assertEqual((mbin.name, mbin.software), ("Existing", "mbin"))
+
+    def test_site_details_are_only_requested_from_lemmy(self):
+        crawler.crawl_instances(["mbin.example.com", "lemmy.example.com"])
+
+        urls = [call.args[0] for call in self.client.get.call_args_list]
+        self.assertIn("https://lemmy.example.com/api/v3/site", urls)
+        self.assertNotIn("https://mbin.example.com/api/v3/site", urls)
+
+
+__all__ = ("InstanceCrawlerTestCase",)
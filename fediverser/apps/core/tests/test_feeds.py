@@ -0,0 +1,382 @@
+import collections
+import datetime
+import threading
+import time
+from unittest import mock
+
+import feedparser
+import requests
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import signals
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from factory.django import mute_signals
+from taggit.models import TaggedItem
+
+from fediverser.apps.core import factories, metrics, tasks
+from fediverser.apps.core.fetchers import FeedFetcher, get_host_key
+from fediverser.apps.core.models.accounts import UserAccount
+from fediverser.apps.core.models.feeds import Entry, Feed
+from fediverser.apps.core.settings import app_settings
+from fediverser.apps.core.signals import feed_entries_created
+
+from .common import BaseTestCase
+
+
+class EntryPurgeTestCase(BaseTestCase):
+    def setUp(self):
+        with mute_signals(signals.post_save):
+            self.feed = Feed.objects.create(url="https://news.example.com/rss")
+
+    def make_entry(self, n, age):
+        entry = Entry.objects.create(feed=self.feed, link=f"https://news.example.com/{n}")
+        entry.tags.add("news", f"story-{n}")
+        Entry.objects.filter(id=entry.id).update(modified=timezone.now() - age)
+        return entry
+
+    def test_can_purge_old_entries_in_batches(self):
+        for n in range(5):
+            self.make_entry(n, age=datetime.timedelta(days=30))
+        recent = self.make_entry(99, age=datetime.timedelta(hours=1))
+
+        cutoff = timezone.now() - Entry.MAX_AGE
+        deleted = Entry.purge(cutoff, batch_size=2)
+
+        self.assertEqual(deleted, 5)
+        self.assertEqual(list(Entry.objects.values_list("id", flat=True)), [recent.id])
+        self.assertEqual(set(TaggedItem.objects.values_list("object_id", flat=True)), {recent.id})
+
+
+class FeedConditionalFetchTestCase(BaseTestCase):
+    def setUp(self):
+        cache.clear()
+        with mute_signals(signals.post_save):
+            self.feed = Feed.objects.create(url="https://news.example.com/rss")
+
+    def fetch(self, **response):
+        Feed.objects.filter(id=self.feed.id).update(next_fetch_at=None)
+        self.feed.refresh_from_db()
+
+        result = feedparser.FeedParserDict(entries=[], **response)
+        with mock.patch.object(feedparser, "parse", return_value=result) as parse:
+            self.feed.fetch()
+        self.feed.refresh_from_db()
+        return parse
+
+    def test_validators_are_stored_and_sent_back(self):
+        last_modified = "Mon, 19 Oct 2026 10:00:00 GMT"
+        self.fetch(status=200, etag='"v1"', modified=last_modified)
+        self.assertEqual(self.feed.etag, '"v1"')
+        self.assertEqual(self.feed.last_modified, last_modified)
+
+        parse = self.fetch(status=304)
+
+        parse.assert_called_once_with(self.feed.url, etag='"v1"', modified=last_modified)
+        self.assertEqual(self.feed.etag, '"v1"')
+        self.assertIsNotNone(self.feed.last_fetched)
+
+    def test_not_modified_responses_are_counted_as_hits(self):
+        self.fetch(status=200, etag='"v1"')
+        self.fetch(status=304)
+
+        self.assertEqual(metrics.get_hit_ratio("feeds.conditional_get"), 0.5)
+
+
+class FeedFetcherTestCase(BaseTestCase):
+    def test_connections_per_host_are_limited(self):
+        feeds = [Feed(url=f"https://www.reddit.com/r/sub{n}/hot.rss") for n in range(6)]
+        feeds += [Feed(url=f"https://news.example.com/{n}.rss") for n in range(6)]
+
+        lock = threading.Lock()
+        in_flight = collections.Counter()
+        peak = collections.Counter()
+
+        def download(url, **validators):
+            host = get_host_key(url)
+            with lock:
+                in_flight[host] += 1
+                peak[host] = max(peak[host], in_flight[host])
+            time.sleep(0.05)
+            with lock:
+                in_flight[host] -= 1
+            return feedparser.FeedParserDict(status=200, entries=[])
+
+        fetcher = FeedFetcher(max_connections=10, max_connections_per_host=3)
+        with (
+            mock.patch.object(fetcher, "download", side_effect=download),
+            mock.patch.object(fetcher, "parse", side_effect=lambda response: response),
+        ):
+            results = fetcher.fetch(feeds)
+
+        self.assertEqual([feed for feed, _ in results], feeds)
+        self.assertEqual(peak["reddit.com"], app_settings.Feeds.max_reddit_connections)
+        self.assertEqual(peak["news.example.com"], 3)
+
+    def test_failed_downloads_have_no_result(self):
+        feed = Feed(url="https://news.example.com/rss")
+        fetcher = FeedFetcher()
+        with mock.patch.object(fetcher, "download", side_effect=requests.Timeout):
+            self.assertEqual(fetcher.fetch([feed]), [(feed, None)])
+
+    def test_only_due_and_active_feeds_are_fetched(self):
+        with mute_signals(signals.post_save):
+            due = Feed.objects.create(url="https://news.example.com/due")
+            Feed.objects.create(url="https://news.example.com/inactive", is_active=False)
+            Feed.objects.create(
+                url="https://news.example.com/fresh",
+                next_fetch_at=timezone.now() + datetime.timedelta(hours=1),
+            )
+
+        with mock.patch.object(FeedFetcher, "fetch", return_value=[]) as fetch:
+            tasks.fetch_feeds()
+
+        fetch.assert_called_once_with([due])
+
+
+class FeedSchedulingTestCase(BaseTestCase):
+    def setUp(self):
+        with mute_signals(signals.post_save):
+            self.feed = Feed.objects.create(url="https://news.example.com/rss")
+
+    def add_entries(self, count):
+        Entry.objects.bulk_create(
+            Entry(feed=self.feed, link=f"https://news.example.com/{n}", created=timezone.now())
+            for n in range(count)
+        )
+
+    def test_quiet_feeds_back_off_to_maximum_interval(self):
+        self.assertEqual(self.feed.get_fetch_interval(), Feed.MAX_FETCH_INTERVAL)
+
+    def test_busy_feeds_stay_at_minimum_interval(self):
+        self.add_entries(200)
+        self.assertEqual(self.feed.get_fetch_interval(), Feed.MIN_FETCH_INTERVAL)
+
+    def test_interval_follows_entry_rate(self):
+        self.add_entries(11)
+        self.assertEqual(self.feed.get_fetch_interval(), datetime.timedelta(hours=2))
+
+    def test_claimed_feeds_are_not_due_anymore(self):
+        self.assertEqual(Feed.claim_due_feeds(), [self.feed])
+        self.assertEqual(Feed.claim_due_feeds(), [])
+
+
+class EntryBulkMakeTestCase(BaseTestCase):
+    def setUp(self):
+        with mute_signals(signals.post_save):
+            self.feed = Feed.objects.create(url="https://news.example.com/rss")
+
+    def make_parsed_entry(self, n, tags=(), title=None):
+        published = time.gmtime()
+        return feedparser.FeedParserDict(
+            link=f"https://news.example.com/{n}",
+            id=f"story-{n}",
+            title=title or f"Story {n}",
+            summary="",
+            published_parsed=published,
+            updated_parsed=published,
+            tags=[{"term": tag} for tag in tags],
+        )
+
+    def test_entries_are_created_with_their_tags(self):
+        entries = [self.make_parsed_entry(n, tags=["World News", f"Tag {n}"]) for n in range(3)]
+        Entry.bulk_make(entries=entries, feed=self.feed)
+
+        self.assertEqual(self.feed.entries.count(), 3)
+        entry = Entry.objects.get(link="https://news.example.com/1")
+        self.assertEqual(set(entry.tags.names()), {"world-news", "tag-1"})
+
+    def test_number_of_queries_does_not_grow_with_entries(self):
+        def count_queries(entries):
+            with CaptureQueriesContext(connection) as context:
+                Entry.bulk_make(entries=entries, feed=self.feed)
+            return len(context.captured_queries)
+
+        few = count_queries([self.make_parsed_entry(n, tags=[f"a{n}"]) for n in range(2)])
+        many = count_queries([self.make_parsed_entry(n, tags=[f"b{n}"]) for n in range(10, 30)])
+        self.assertEqual(few, many)
+
+    def test_signal_is_sent_once_with_new_entries(self):
+        Entry.bulk_make(entries=[self.make_parsed_entry(1)], feed=self.feed)
+
+        handler = mock.Mock()
+        feed_entries_created.connect(handler, sender=Entry)
+        self.addCleanup(feed_entries_created.disconnect, handler, sender=Entry)
+
+        entries = [self.make_parsed_entry(n) for n in range(1, 4)]
+        Entry.bulk_make(entries=entries, feed=self.feed)
+
+        handler.assert_called_once()
+        created = handler.call_args.kwargs["entries"]
+        self.assertEqual(
+            sorted(entry.link for entry in created),
+            ["https://news.example.com/2", "https://news.example.com/3"],
+        )
+
+    def test_unchanged_entries_are_not_written_again(self):
+        entries = [self.make_parsed_entry(n, tags=["news"]) for n in range(3)]
+        Entry.bulk_make(entries=entries, feed=self.feed)
+
+        with CaptureQueriesContext(connection) as context:
+            written = Entry.bulk_make(entries=entries, feed=self.feed)
+
+        self.assertEqual(written, [])
+        self.assertEqual(len(context.captured_queries), 1)
+
+    def test_changed_entries_are_updated(self):
+        Entry.bulk_make(entries=[self.make_parsed_entry(1)], feed=self.feed)
+        written = Entry.bulk_make(
+            entries=[self.make_parsed_entry(1, title="Correction")], feed=self.feed
+        )
+
+        self.assertEqual(len(written), 1)
+        self.assertEqual(Entry.objects.get().title, "Correction")
+
+
+class FeedIncrementalProcessingTestCase(BaseTestCase):
+    def setUp(self):
+        with mute_signals(signals.post_save):
+            self.feed = Feed.objects.create(
+                url="https://news.example.com/rss", last_entry_guid="story-2"
+            )
+
+    def make_result(self, ages):
+        now = timezone.now()
+        return feedparser.FeedParserDict(
+            status=200,
+            entries=[
+                feedparser.FeedParserDict(
+                    link=f"https://news.example.com/{n}",
+                    id=f"story-{n}",
+                    title=f"Story {n}",
+                    summary="",
+                    published_parsed=(now - age).utctimetuple(),
+                    updated_parsed=(now - age).utctimetuple(),
+                )
+                for n, age in enumerate(ages, start=1)
+            ],
+        )
+
+    def test_processing_stops_at_seen_guid_when_newest_entries_come_first(self):
+        hours = [datetime.timedelta(hours=n) for n in range(1, 4)]
+        self.feed.process(self.make_result(hours))
+
+        self.assertEqual(
+            list(self.feed.entries.values_list("link", flat=True)), ["https://news.example.com/1"]
+        )
+        self.feed.refresh_from_db()
+        self.assertEqual(self.feed.last_entry_guid, "story-1")
+
+    def test_unsorted_feeds_are_processed_in_full(self):
+        hours = [datetime.timedelta(hours=n) for n in (2, 1, 3)]
+        self.feed.process(self.make_result(hours))
+
+        self.assertEqual(self.feed.entries.count(), 3)
+
+
+class MultiredditFeedTestCase(BaseTestCase):
+    def test_quiet_subreddits_are_grouped_up_to_maximum_size(self):
+        subreddits = factories.RedditCommunityFactory.create_batch(120)
+        groups = Feed.group_subreddits(subreddits)
+
+        self.assertEqual([len(group) for group in groups], [50, 50, 20])
+
+    def test_groups_of_long_subreddit_names_fit_in_the_feed_url(self):
+        subreddits = [
+            factories.RedditCommunityFactory(name=f"subreddit_with_name_{n:02}") for n in range(60)
+        ]
+        with mute_signals(signals.post_save):
+            feeds = Feed.make_subreddit_feeds(subreddits)
+
+        self.assertEqual([feed.subreddits.count() for feed in feeds], [50, 10])
+
+        with mock.patch.object(Feed._meta.get_field("url"), "max_length", 500):
+            groups = Feed.group_subreddits(subreddits)
+        self.assertTrue(
+            all(len(Feed.get_multireddit_url([s.name for s in group])) <= 500 for group in groups)
+        )
+        self.assertEqual(sum(len(group) for group in groups), 60)
+
+    def test_busy_subreddits_get_smaller_groups(self):
+        busy, active, *quiet = factories.RedditCommunityFactory.create_batch(5)
+        factories.RedditSubmissionFactory.create_batch(40, subreddit=busy)
+        factories.RedditSubmissionFactory.create_batch(20, subreddit=active)
+
+        # Allows for 48 posts per day in each feed.
+        with mock.patch.object(Feed, "MULTIREDDIT_ENTRIES_PER_FETCH", 1):
+            groups = Feed.group_subreddits([busy, active, *quiet])
+
+        self.assertEqual(groups, [[busy], [active, *sorted(quiet, key=lambda s: s.name.lower())]])
+
+    def test_adding_a_subreddit_changes_at_most_one_feed(self):
+        subreddits = factories.RedditCommunityFactory.create_batch(120)
+        factories.RedditSubmissionFactory.create_batch(3, subreddit=subreddits[60])
+        with mute_signals(signals.post_save):
+            before = {feed.url for feed in Feed.make_subreddit_feeds(subreddits)}
+
+            # Sorts before every other name, in the busiest order of magnitude
+            added = factories.RedditCommunityFactory(name="0-newcomer")
+            factories.RedditSubmissionFactory.create_batch(3, subreddit=added)
+            after = {feed.url for feed in Feed.make_subreddit_feeds([*subreddits, added])}
+
+        self.assertLessEqual(len(after - before), 1)
+        self.assertLessEqual(len(before - after), 1)
+
+    def test_multireddit_feeds_replace_single_subreddit_feeds(self):
+        subreddits = [
+            factories.RedditCommunityFactory(name=name) for name in ("lemmy", "Fediverse")
+        ]
+        with mute_signals(signals.post_save):
+            single = Feed.objects.create(url="https://reddit.com/r/lemmy/hot.rss")
+            (feed,) = Feed.make_subreddit_feeds(subreddits)
+
+        self.assertEqual(feed.url, "https://reddit.com/r/Fediverse+lemmy/new.rss?limit=100")
+        self.assertEqual(set(feed.subreddits.all()), set(subreddits))
+        single.refresh_from_db()
+        self.assertFalse(single.is_active)
+
+        with mute_signals(signals.post_save):
+            Feed.make_subreddit_feeds(subreddits[:1])
+        feed.refresh_from_db()
+        self.assertFalse(feed.is_active)
+
+    def test_subreddits_tracked_one_after_the_other_all_get_feeds(self):
+        cache.clear()
+        user = get_user_model().objects.create_user(username="tracker")
+        account, _ = UserAccount.objects.get_or_create(user=user)
+        subreddits = [factories.RedditCommunityFactory(name=name) for name in ("lemmy", "mbin")]
+
+        make_subreddit_feeds = tasks.make_subreddit_feeds
+        with (
+            mute_signals(signals.post_save),
+            mock.patch.object(make_subreddit_feeds, "delay", side_effect=make_subreddit_feeds),
+        ):
+            for subreddit in subreddits:
+                account.tracked_subreddits.add(subreddit)
+
+        self.assertTrue(all(subreddit.feeds.exists() for subreddit in subreddits))
+
+    def test_entries_are_routed_to_subreddits_of_the_group(self):
+        with mute_signals(signals.post_save):
+            (feed,) = Feed.make_subreddit_feeds([factories.RedditCommunityFactory(name="lemmy")])
+
+        entries = [
+            Entry(feed=feed, link="https://www.reddit.com/r/Lemmy/comments/abc123/hello/"),
+            Entry(feed=feed, link="https://www.reddit.com/r/other/comments/def456/hi/"),
+        ]
+        with mock.patch.object(tasks, "enqueue") as enqueue:
+            feed_entries_created.send(sender=Entry, feed=feed, entries=entries)
+
+        enqueue.assert_called_once_with(tasks.fetch_reddit_submissions, ["abc123"])
+
+
+__all__ = (
+    "MultiredditFeedTestCase",
+    "EntryBulkMakeTestCase",
+    "FeedIncrementalProcessingTestCase",
+    "EntryPurgeTestCase",
+    "FeedConditionalFetchTestCase",
+    "FeedFetcherTestCase",
+    "FeedSchedulingTestCase",
+)
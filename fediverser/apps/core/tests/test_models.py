@@ -1,9 +1,23 @@
+import importlib
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
 import pytest
+import requests
+from django.apps import apps
+from django.core.cache import cache
 from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
 
-from fediverser.apps.core import factories
+from fediverser.apps.core import factories, metrics, tasks
 from fediverser.apps.core.choices import AutomaticSubmissionPolicies
+from fediverser.apps.core.models.common import DomainHealth, DomainUnavailable, make_http_client
 from fediverser.apps.core.models.mirroring import LemmyMirroredPost
+from fediverser.apps.core.models.network import Endorsement, TrustScore
+from fediverser.apps.core.settings import app_settings
 
 
 @pytest.mark.django_db(transaction=True)
@@ -70,4 +84,262 @@ class MirroredPostTestCase(BaseTestCase):
         self.assertEqual(lemmy_post_payload["body"], "A cool URI is one which does not change.")
 
 
-__all__ = ("LemmyInstanceTestCase", "RedditMirrorStrategyTestCase", "MirroredPostTestCase")
+class TrustScoreTestCase(BaseTestCase):
+    def setUp(self):
+        self.portal = factories.FediversedInstanceFactory(portal_url=app_settings.Portal.url)
+        self.endorsed, self.transitive, self.unknown = [
+            factories.FediversedInstanceFactory() for _ in range(3)
+        ]
+        Endorsement.objects.create(endorser=self.portal, endorsed=self.endorsed)
+        Endorsement.objects.create(endorser=self.endorsed, endorsed=self.transitive)
+        Endorsement.objects.create(endorser=self.unknown, endorsed=self.endorsed)
+
+    def test_trust_is_propagated_through_endorsements(self):
+        TrustScore.rebuild()
+        scores = dict(TrustScore.objects.values_list("instance_id", "score"))
+
+        self.assertGreater(scores[self.endorsed.id], scores[self.transitive.id])
+        self.assertGreater(scores[self.transitive.id], 0)
+        self.assertEqual(scores[self.unknown.id], 0)
+        self.assertAlmostEqual(sum(scores.values()), 1.0, places=4)
+
+    def test_previous_scores_are_used_as_starting_point(self):
+        edges = list(Endorsement.objects.values_list("endorser_id", "endorsed_id"))
+        scores = TrustScore.compute(edges, self.portal.id)
+        rescored = TrustScore.compute(edges, self.portal.id, previous=scores)
+        for node, score in scores.items():
+            self.assertAlmostEqual(rescored[node], score, places=5)
+
+    def test_scores_are_populated_on_migration(self):
+        migration = importlib.import_module(
+            "fediverser.apps.core.migrations.0040_populate_trust_scores"
+        )
+        migration.populate_trust_scores(apps, None)
+
+        self.assertEqual(TrustScore.objects.count(), 4)
+        self.assertEqual(
+            list(TrustScore.objects.filter(endorsed=True).values_list("instance", flat=True)),
+            [self.endorsed.id],
+        )
+
+    def test_consecutive_endorsements_are_all_scored(self):
+        cache.clear()
+        first, second = [factories.FediversedInstanceFactory() for _ in range(2)]
+        update_trust_scores = tasks.update_trust_scores
+        with mock.patch.object(update_trust_scores, "delay", side_effect=update_trust_scores):
+            for endorsed in (first, second):
+                with self.captureOnCommitCallbacks(execute=True):
+                    Endorsement.objects.create(endorser=self.portal, endorsed=endorsed)
+
+        self.assertEqual(
+            TrustScore.objects.filter(instance__in=[first, second], endorsed=True).count(), 2
+        )
+
+    def test_own_portal_is_not_always_recommended_first(self):
+        TrustScore.rebuild()
+        for portal in (self.portal, self.endorsed):
+            portal.instance = factories.InstanceFactory()
+            portal.save()
+        url = reverse("fediverser-core:api-instancerecommendation-list")
+
+        response = self.client.get(url, headers={"Accept": "application/json"})
+        self.assertEqual(response.json()[0]["domain"], self.endorsed.instance.domain)
+
+    def test_instances_can_be_filtered_by_trust(self):
+        TrustScore.rebuild()
+        url = reverse("fediverser-core:fediverserinstance-list")
+
+        response = self.client.get(url, {"trusted": True}, headers={"Accept": "application/json"})
+        self.assertEqual(
+            [item["portal_url"] for item in response.json()], [self.endorsed.portal_url]
+        )
+
+        response = self.client.get(
+            url, {"min_trust": 0.01}, headers={"Accept": "application/json"}
+        )
+        self.assertNotIn(self.unknown.portal_url, [item["portal_url"] for item in response.json()])
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"{}")
+
+    def log_message(self, *args):
+        pass
+
+
+class HttpClientPoolTestCase(BaseTestCase):
+    def setUp(self):
+        cache.clear()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), KeepAliveHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/"
+
+    def test_clients_are_shared_by_purpose(self):
+        self.assertIs(make_http_client("testing"), make_http_client("testing"))
+        self.assertIsNot(make_http_client("testing"), make_http_client())
+
+    def test_threads_have_their_own_clients_with_shared_connections(self):
+        client = make_http_client("testing")
+        clients = []
+        thread = threading.Thread(target=lambda: clients.append(make_http_client("testing")))
+        thread.start()
+        thread.join()
+
+        (other,) = clients
+        self.assertIsNot(client, other)
+        self.assertIs(
+            client.get_adapter(self.url).poolmanager, other.get_adapter(self.url).poolmanager
+        )
+
+    def test_clients_can_not_be_shared_with_other_options(self):
+        make_http_client("testing")
+        with self.assertRaises(ValueError):
+            make_http_client("testing", cached=True)
+        with self.assertRaises(ValueError):
+            make_http_client("testing", headers={"Accept": "application/json"})
+
+    def test_connections_are_kept_alive(self):
+        client = make_http_client("testing")
+        with mock.patch.object(metrics, "FLUSH_INTERVAL", 3600):
+            for _ in range(3):
+                client.get(self.url).raise_for_status()
+
+        # Connections are counted in memory until they are flushed
+        self.assertEqual(metrics.get_count("http.testing.connections:misses"), 0)
+        metrics.flush()
+        self.assertEqual(metrics.get_count("http.testing.connections:misses"), 1)
+        self.assertEqual(metrics.get_count("http.testing.connections:hits"), 2)
+
+    def test_responses_are_cached_by_endpoint(self):
+        with mock.patch.object(app_settings.Http, "cache_backend", "memory"):
+            client = make_http_client("testing-cache", cached=True)
+
+        nodeinfo = client.get(f"{self.url}.well-known/nodeinfo")
+        actor = client.get(f"{self.url}u/someone")
+        self.assertFalse(nodeinfo.from_cache)
+        self.assertGreater(nodeinfo.expires, actor.expires)
+
+        self.assertTrue(client.get(f"{self.url}.well-known/nodeinfo").from_cache)
+        metrics.flush()
+        self.assertEqual(metrics.get_hit_ratio("http.testing-cache.cache"), 1 / 3)
+
+
+class CircuitBreakerTestCase(BaseTestCase):
+    def setUp(self):
+        cache.clear()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), KeepAliveHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/"
+
+        # Nothing listens on a port that was just released, so requests
+        # to it are refused.
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            self.dead_url = f"http://127.0.0.1:{sock.getsockname()[1]}/"
+
+        self.client = make_http_client("testing-breaker")
+
+    def fail(self, times):
+        for _ in range(times):
+            with self.assertRaises(requests.exceptions.ConnectionError):
+                self.client.get(self.dead_url)
+
+    def test_circuit_opens_after_repeated_failures(self):
+        self.fail(app_settings.Http.circuit_breaker_threshold)
+
+        with (
+            mock.patch.object(requests.adapters.HTTPAdapter, "send") as send,
+            self.assertRaises(DomainUnavailable),
+        ):
+            self.client.get(self.url)
+        send.assert_not_called()
+
+        # Nothing is written until the outcomes are flushed
+        self.assertFalse(DomainHealth.objects.exists())
+        DomainHealth.flush()
+        health = DomainHealth.objects.get(domain="127.0.0.1")
+        self.assertEqual(health.failures, app_settings.Http.circuit_breaker_threshold)
+        self.assertIsNotNone(health.open_until)
+
+    def test_cool_down_grows_with_failures(self):
+        threshold = app_settings.Http.circuit_breaker_threshold
+        first = DomainHealth.get_cool_down(threshold)
+        self.assertEqual(DomainHealth.get_cool_down(threshold + 2), 4 * first)
+        self.assertEqual(
+            DomainHealth.get_cool_down(threshold + 100).total_seconds(),
+            app_settings.Http.circuit_breaker_max_cool_down,
+        )
+
+    def test_success_closes_the_circuit(self):
+        self.fail(1)
+        DomainHealth.flush()
+        self.client.get(self.url).raise_for_status()
+        self.fail(1)
+        DomainHealth.flush()
+
+        health = DomainHealth.objects.get(domain="127.0.0.1")
+        self.assertEqual(health.failures, 1)
+
+    def test_success_resets_recorded_failures(self):
+        DomainHealth.objects.create(domain="127.0.0.1", failures=10, down_since=timezone.now())
+        self.fail(1)
+        self.client.get(self.url).raise_for_status()
+        DomainHealth.flush()
+
+        health = DomainHealth.objects.get(domain="127.0.0.1")
+        self.assertEqual(health.failures, 0)
+        self.assertIsNone(health.down_since)
+
+    def test_read_timeouts_do_not_open_the_circuit(self):
+        with mock.patch.object(
+            requests.adapters.HTTPAdapter,
+            "send",
+            side_effect=requests.exceptions.ReadTimeout("slow"),
+        ):
+            for _ in range(app_settings.Http.circuit_breaker_threshold):
+                with self.assertRaises(requests.exceptions.ReadTimeout):
+                    self.client.get(self.url)
+
+        self.client.get(self.url).raise_for_status()
+        DomainHealth.flush()
+        self.assertFalse(DomainHealth.objects.exists())
+
+    def test_server_errors_open_the_circuit(self):
+        response = requests.Response()
+        response.status_code = 503
+        response._content = b""
+        response.url = self.url
+        with mock.patch.object(requests.adapters.HTTPAdapter, "send", return_value=response):
+            for _ in range(app_settings.Http.circuit_breaker_threshold):
+                self.client.get(self.url)
+
+        with self.assertRaises(DomainUnavailable):
+            self.client.get(self.url)
+
+    def test_outcomes_are_written_by_task(self):
+        self.fail(1)
+        self.assertFalse(DomainHealth.objects.exists())
+
+        tasks.flush_domain_health()
+        self.assertEqual(DomainHealth.objects.get(domain="127.0.0.1").failures, 1)
+
+
+__all__ = (
+    "LemmyInstanceTestCase",
+    "RedditMirrorStrategyTestCase",
+    "MirroredPostTestCase",
+    "TrustScoreTestCase",
+    "HttpClientPoolTestCase",
+    "CircuitBreakerTestCase",
+)
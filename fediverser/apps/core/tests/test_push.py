@@ -0,0 +1,288 @@
+import datetime
+import json
+import time
+from unittest import mock
+from urllib.parse import urlparse
+
+from django.contrib import admin
+from django.core.cache import cache
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from fediverser.apps.core import factories, tasks
+from fediverser.apps.core.models import push
+from fediverser.apps.core.models.network import EndorsementEntry, FediversedInstance
+from fediverser.apps.core.models.push import (
+    PORTAL_HEADER,
+    PREVIOUS_ID_HEADER,
+    SIGNATURE_HEADER,
+    TIMESTAMP_HEADER,
+    ChangeFeedDelivery,
+    ChangeFeedSubscription,
+    sign_payload,
+    verify_signature,
+)
+from fediverser.apps.core.settings import app_settings
+
+from .common import BaseTestCase
+
+SECRET = "0123456789abcdef0123456789abcdef"
+
+
+class PushTestCase(BaseTestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.http_client = mock.Mock()
+        patcher = mock.patch.object(push, "make_http_client", return_value=self.http_client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.portal = factories.FediversedInstanceFactory(portal_url=app_settings.Portal.url)
+        self.partner = factories.FediversedInstanceFactory()
+
+
+class ChangeFeedDeliveryTestCase(PushTestCase):
+    def setUp(self):
+        super().setUp()
+        self.subscription = ChangeFeedSubscription.objects.create(
+            subscriber=self.partner,
+            callback_url=f"{self.partner.portal_url}/api/changes/push",
+            secret=SECRET,
+        )
+
+    def test_local_entries_are_delivered_in_signed_batches(self):
+        for _ in range(3):
+            factories.ConnectedRedditAccountEntryFactory(published_by=self.portal)
+        factories.ConnectedRedditAccountEntryFactory(published_by=self.partner)
+
+        self.assertEqual(self.subscription.deliver(), 3)
+
+        self.http_client.post.assert_called_once()
+        call = self.http_client.post.call_args
+        headers = call.kwargs["headers"]
+        verify_signature(
+            SECRET,
+            headers[TIMESTAMP_HEADER],
+            call.kwargs["data"],
+            headers[SIGNATURE_HEADER],
+            previous_id=headers[PREVIOUS_ID_HEADER],
+        )
+        self.assertEqual(headers[PREVIOUS_ID_HEADER], "0")
+        self.assertEqual(len(json.loads(call.kwargs["data"])), 3)
+        self.assertFalse(ChangeFeedDelivery.objects.exists())
+
+    def test_entries_created_one_after_the_other_are_each_pushed(self):
+        cache.clear()
+        push_change_feed_entries = tasks.push_change_feed_entries
+        with mock.patch.object(
+            push_change_feed_entries, "delay", side_effect=push_change_feed_entries
+        ):
+            for _ in range(2):
+                with self.captureOnCommitCallbacks(execute=True):
+                    factories.ConnectedRedditAccountEntryFactory(published_by=self.portal)
+
+        self.assertEqual(self.http_client.post.call_count, 2)
+        self.assertFalse(ChangeFeedDelivery.objects.exists())
+
+    def test_batches_with_gaps_do_not_claim_a_previous_entry(self):
+        entries = [
+            factories.ConnectedRedditAccountEntryFactory(published_by=self.portal)
+            for _ in range(3)
+        ]
+        ChangeFeedDelivery.objects.filter(record_id=entries[1].id).update(
+            next_attempt_at=timezone.now() + datetime.timedelta(hours=1)
+        )
+
+        self.assertEqual(self.subscription.deliver(), 2)
+        headers = self.http_client.post.call_args.kwargs["headers"]
+        self.assertNotIn(PREVIOUS_ID_HEADER, headers)
+
+    def test_failed_deliveries_are_retried_with_backoff(self):
+        factories.ConnectedRedditAccountEntryFactory(published_by=self.portal)
+        self.http_client.post.side_effect = ConnectionError("partner is down")
+
+        self.assertEqual(self.subscription.deliver(), 0)
+        delivery = ChangeFeedDelivery.objects.get()
+        self.assertEqual(delivery.attempts, 1)
+
+        # Not due yet
+        self.assertEqual(self.subscription.deliver(), 0)
+        self.assertEqual(self.http_client.post.call_count, 1)
+
+    def test_deliveries_are_dropped_after_max_attempts(self):
+        factories.ConnectedRedditAccountEntryFactory(published_by=self.portal)
+        ChangeFeedDelivery.objects.update(attempts=app_settings.Federation.push_max_attempts - 1)
+        self.http_client.post.side_effect = ConnectionError("partner is down")
+
+        self.subscription.deliver()
+        self.assertFalse(ChangeFeedDelivery.objects.exists())
+
+
+class ChangeFeedSubscriptionTestCase(PushTestCase):
+    def echo_challenge(self, url, data, headers, **kw):
+        verify_signature(SECRET, headers[TIMESTAMP_HEADER], data, headers[SIGNATURE_HEADER])
+        return mock.Mock(json=mock.Mock(return_value=json.loads(data)))
+
+    def subscribe(self, callback_url):
+        return self.client.post(
+            "/api/changes/subscriptions",
+            {
+                "portal_url": self.partner.portal_url,
+                "callback_url": callback_url,
+                "secret": SECRET,
+            },
+            format="json",
+        )
+
+    def test_partner_can_subscribe(self):
+        self.http_client.post.side_effect = self.echo_challenge
+
+        response = self.subscribe(f"{self.partner.portal_url}/api/changes/push")
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(ChangeFeedSubscription.objects.filter(subscriber=self.partner).exists())
+
+    def test_callback_must_be_on_partner_portal(self):
+        response = self.subscribe("https://elsewhere.example.com/api/changes/push")
+        self.assertEqual(response.status_code, 400)
+        self.http_client.post.assert_not_called()
+
+    def test_subscriptions_are_throttled_by_portal(self):
+        callback_url = f"{self.partner.portal_url}/api/changes/push"
+        self.http_client.post.side_effect = self.echo_challenge
+
+        with mock.patch.object(app_settings.Federation, "subscription_rate", "2/hour"):
+            responses = [self.subscribe(callback_url) for _ in range(3)]
+
+        self.assertEqual([r.status_code for r in responses], [201, 201, 429])
+        self.assertEqual(self.http_client.post.call_count, 2)
+
+    def test_callback_must_be_the_push_endpoint_of_partner(self):
+        host = urlparse(self.partner.portal_url).hostname
+        for callback_url in (
+            f"http://{host}:6379/",
+            f"{self.partner.portal_url}:8080/api/changes/push",
+            f"{self.partner.portal_url}/admin/",
+        ):
+            response = self.subscribe(callback_url)
+            self.assertEqual(response.status_code, 400, callback_url)
+        self.http_client.post.assert_not_called()
+
+    def test_only_subscriptions_can_be_changed_in_admin(self):
+        subscription = ChangeFeedSubscription.objects.create(
+            subscriber=self.partner,
+            callback_url=f"{self.partner.portal_url}/api/changes/push",
+            secret=SECRET,
+        )
+        request = mock.Mock()
+        subscription_admin = admin.site._registry[ChangeFeedSubscription]
+        partner_admin = admin.site._registry[FediversedInstance]
+
+        self.assertTrue(subscription_admin.has_change_permission(request, subscription))
+        self.assertFalse(partner_admin.has_change_permission(request, self.partner))
+        self.assertTrue(partner_admin.has_change_permission(request, self.portal))
+
+
+class SubscribeToPartnerTestCase(PushTestCase):
+    def test_secret_is_cleared_when_partner_can_not_be_reached(self):
+        self.http_client.post.side_effect = ConnectionError("partner is down")
+
+        with self.assertRaises(ConnectionError):
+            push.subscribe_to_partner(self.partner)
+
+        self.partner.refresh_from_db()
+        self.assertIsNone(self.partner.push_secret)
+
+    def test_previous_secret_is_kept_when_resubscribing_fails(self):
+        self.partner.push_secret = SECRET
+        self.partner.save()
+        self.http_client.post.side_effect = ConnectionError("partner is down")
+
+        with self.assertRaises(ConnectionError):
+            push.subscribe_to_partner(self.partner)
+
+        self.partner.refresh_from_db()
+        self.assertEqual(self.partner.push_secret, SECRET)
+
+
+class ChangeFeedPushTestCase(PushTestCase):
+    def setUp(self):
+        super().setUp()
+        self.partner.push_secret = SECRET
+        self.partner.save()
+
+    def push(self, payload, secret=SECRET, previous_id=None):
+        body = json.dumps(payload).encode()
+        timestamp = str(int(time.time()))
+        headers = {
+            PORTAL_HEADER: self.partner.portal_url,
+            TIMESTAMP_HEADER: timestamp,
+            SIGNATURE_HEADER: sign_payload(secret, timestamp, body, previous_id=previous_id),
+        }
+        if previous_id is not None:
+            headers[PREVIOUS_ID_HEADER] = str(previous_id)
+        return self.client.generic(
+            "POST", "/api/changes/push", body, content_type="application/json", headers=headers
+        )
+
+    def test_invalid_previous_id_is_rejected(self):
+        response = self.push([], previous_id="not-a-number")
+        self.assertEqual(response.status_code, 400)
+
+    def test_pushed_entries_are_ingested(self):
+        endorsed = factories.FediversedInstanceFactory()
+        entries = [
+            {
+                "id": 1,
+                "type": "endorsement",
+                "endorser": self.partner.portal_url,
+                "endorsed": endorsed.portal_url,
+            }
+        ]
+
+        with mock.patch.object(tasks.ingest_pushed_change_feed_entries, "delay") as delay:
+            response = self.push(entries)
+        self.assertEqual(response.status_code, 202)
+        delay.assert_called_once_with(self.partner.id, entries, previous_id=None)
+
+        tasks.ingest_pushed_change_feed_entries(self.partner.id, entries)
+        self.assertTrue(
+            EndorsementEntry.objects.filter(
+                published_by=self.partner, endorsement__endorsed=endorsed
+            ).exists()
+        )
+
+    def test_batches_continuing_from_the_cursor_advance_it(self):
+        endorsed = factories.FediversedInstanceFactory()
+        entries = [
+            {
+                "id": 8,
+                "type": "endorsement",
+                "endorser": self.partner.portal_url,
+                "endorsed": endorsed.portal_url,
+            }
+        ]
+        self.partner.change_feed_cursor = 5
+        self.partner.save()
+
+        with mock.patch.object(tasks.ingest_pushed_change_feed_entries, "delay") as delay:
+            self.push(entries, previous_id=5)
+        delay.assert_called_once_with(self.partner.id, entries, previous_id=5)
+
+        tasks.ingest_pushed_change_feed_entries(self.partner.id, entries, previous_id=6)
+        self.partner.refresh_from_db()
+        self.assertEqual(self.partner.change_feed_cursor, 5)
+
+        tasks.ingest_pushed_change_feed_entries(self.partner.id, entries, previous_id=5)
+        self.partner.refresh_from_db()
+        self.assertEqual(self.partner.change_feed_cursor, 8)
+
+    def test_entries_with_invalid_signature_are_rejected(self):
+        response = self.push([{"id": 1, "type": "endorsement"}], secret="not-the-secret")
+        self.assertEqual(response.status_code, 403)
+
+
+__all__ = (
+    "ChangeFeedDeliveryTestCase",
+    "ChangeFeedSubscriptionTestCase",
+    "ChangeFeedPushTestCase",
+)
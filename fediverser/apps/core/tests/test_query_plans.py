@@ -0,0 +1,170 @@
+import datetime
+import json
+import random
+import unittest
+
+from django.db import connection
+from django.utils import timezone
+
+from fediverser.apps.core import factories, tasks
+from fediverser.apps.core.choices import (
+    SOURCE_CONTENT_STATUSES,
+    AutomaticCommentPolicies,
+    AutomaticSubmissionPolicies,
+)
+from fediverser.apps.core.management.commands.pull_from_reddit import (
+    QUERYING_INTERVAL,
+    get_automated_subreddits,
+)
+from fediverser.apps.core.models.mirroring import LemmyMirroredPost
+from fediverser.apps.core.models.reddit import RedditComment, RedditCommunity, RedditSubmission
+
+from .common import BaseTestCase
+
+# Tables that grow without bound and must never be read in full by the
+# scheduling queries.
+HOT_TABLES = {
+    RedditCommunity._meta.db_table,
+    RedditSubmission._meta.db_table,
+    RedditComment._meta.db_table,
+    LemmyMirroredPost._meta.db_table,
+}
+
+INDEX_SCANS = ("Index Scan", "Index Only Scan", "Bitmap Index Scan")
+
+# Planner estimates for the seeded data, with some room over the current
+# plans. Reading any of the hot tables in full costs more than these.
+SUBMISSION_CANDIDATES_MAX_COST = 120
+COMMENT_CANDIDATES_MAX_COST = 50
+SUBREDDIT_REFRESH_MAX_COST = 25
+
+SUBREDDIT_COUNT = 20
+UNTRACKED_SUBREDDIT_COUNT = 5000
+SUBMISSIONS_PER_SUBREDDIT = 250
+COMMENTS_PER_SUBMISSION = 4
+
+SEED = 20240601
+
+
+def iter_plan_nodes(node, parent_relation=None):
+    # Bitmap index scans don't carry the relation name, so we take it
+    # from the bitmap heap scan above them.
+    relation = node.get("Relation Name")
+    if node["Node Type"] == "Bitmap Index Scan":
+        relation = parent_relation
+
+    yield node, relation
+    for child in node.get("Plans", []):
+        yield from iter_plan_nodes(child, parent_relation=relation or parent_relation)
+
+
+def is_full_scan(node):
+    if node["Node Type"] == "Seq Scan":
+        return True
+
+    # The planner may also walk a whole index (usually the primary key)
+    # without any condition, to get the rows in order.
+    if node["Node Type"] in INDEX_SCANS:
+        condition = node.get("Index Cond", "")
+        return not condition or condition.endswith("IS NOT NULL)")
+
+    return False
+
+
+@unittest.skipUnless(connection.vendor == "postgresql", "query plans are postgres-specific")
+class SchedulingQueryPlanTestCase(BaseTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        rng = random.Random(SEED)
+        now = timezone.now()
+        statuses = list(SOURCE_CONTENT_STATUSES._db_values)
+        author = factories.RedditAccountFactory()
+
+        submissions = []
+        comments = []
+        for subreddit in factories.RedditCommunityFactory.create_batch(SUBREDDIT_COUNT):
+            factories.RedditMirrorStrategyFactory(
+                subreddit=subreddit,
+                automatic_submission_policy=AutomaticSubmissionPolicies.FULL,
+                automatic_comment_policy=AutomaticCommentPolicies.FULL,
+            )
+            for n in range(SUBMISSIONS_PER_SUBREDDIT):
+                submission = factories.RedditSubmissionFactory.build(
+                    id=f"{subreddit.id:03}s{n:04}",
+                    subreddit=subreddit,
+                    author=author,
+                    status=rng.choice(statuses),
+                    created=now - datetime.timedelta(minutes=rng.randint(0, 60 * 24 * 30)),
+                )
+                submissions.append(submission)
+                comments.extend(
+                    RedditComment(
+                        id=f"{submission.id}c{c}",
+                        submission=submission,
+                        author=author,
+                        permalink=f"https://reddit.com/{submission.id}/{c}",
+                        status=rng.choice(statuses),
+                        created=submission.created + datetime.timedelta(minutes=c),
+                    )
+                    for c in range(COMMENTS_PER_SUBMISSION)
+                )
+
+        # Most subreddits are known but not mirrored
+        RedditCommunity.objects.bulk_create(
+            (RedditCommunity(name=f"untracked{n:05}") for n in range(UNTRACKED_SUBREDDIT_COUNT)),
+            batch_size=1000,
+        )
+        RedditSubmission.objects.bulk_create(submissions, batch_size=1000)
+        RedditComment.objects.bulk_create(comments, batch_size=1000)
+
+        community = factories.CommunityFactory()
+        LemmyMirroredPost.objects.bulk_create(
+            LemmyMirroredPost(reddit_submission=submission, community=community, lemmy_post_id=n)
+            for n, submission in enumerate(submissions[::10])
+        )
+
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+    def explain(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+            (result,) = cursor.fetchone()
+
+        plan = result if isinstance(result, list) else json.loads(result)
+        return plan[0]
+
+    def assertIndexable(self, queryset, max_cost):
+        plan = self.explain(queryset)
+        full_scans = [
+            relation
+            for node, relation in iter_plan_nodes(plan["Plan"])
+            if relation in HOT_TABLES and is_full_scan(node)
+        ]
+        self.assertEqual(full_scans, [], f"Full table scan on {full_scans}")
+
+        cost = plan["Plan"]["Total Cost"]
+        self.assertLessEqual(cost, max_cost, f"Estimated cost {cost} is over {max_cost}")
+
+    def test_submission_candidates_query(self):
+        self.assertIndexable(
+            tasks.get_submissions_to_mirror(timezone.now()), SUBMISSION_CANDIDATES_MAX_COST
+        )
+
+    def test_comment_candidates_query(self):
+        threshold = timezone.now() - datetime.timedelta(minutes=10)
+        for subreddit in tasks.get_subreddits_with_comment_mirroring()[:3]:
+            self.assertIndexable(
+                tasks.get_comments_to_mirror(subreddit, threshold), COMMENT_CANDIDATES_MAX_COST
+            )
+
+    def test_subreddit_refresh_query(self):
+        cutoff = timezone.now() - QUERYING_INTERVAL
+        self.assertIndexable(
+            get_automated_subreddits().filter(last_synced_at__lt=cutoff),
+            SUBREDDIT_REFRESH_MAX_COST,
+        )
+
+
+__all__ = ("SchedulingQueryPlanTestCase",)
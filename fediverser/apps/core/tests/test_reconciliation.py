@@ -0,0 +1,72 @@
+from unittest import mock
+
+from django.core.cache import cache
+from rest_framework.test import APIClient
+
+from fediverser.apps.core import factories, reconciliation
+from fediverser.apps.core.models.network import ChangeFeedRecord
+from fediverser.apps.core.settings import app_settings
+
+from .common import BaseTestCase
+
+
+class ReconciliationTestCase(BaseTestCase):
+    def setUp(self):
+        cache.clear()
+        self.portal = factories.FediversedInstanceFactory(portal_url=app_settings.Portal.url)
+        self.partner = factories.FediversedInstanceFactory()
+
+        # Entries published here play the part of the partner's feed,
+        # and their copies published_by the partner the part of ours.
+        self.published = [
+            factories.ConnectedRedditAccountEntryFactory(published_by=self.portal)
+            for _ in range(3)
+        ]
+        self.pulled = [
+            factories.ConnectedRedditAccountEntryFactory(
+                published_by=self.partner, reddit_account=entry.reddit_account, actor=entry.actor
+            )
+            for entry in self.published[:2]
+        ]
+
+        self.client = mock.Mock()
+        self.client.get.side_effect = self.serve
+        patcher = mock.patch.object(reconciliation, "make_http_client", return_value=self.client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def serve(self, url, params=None, **kw):
+        api_client = APIClient()
+        path = url.removeprefix(self.partner.portal_url)
+        response = api_client.get(path, params, headers={"Accept": "application/json"})
+        return mock.Mock(json=mock.Mock(return_value=response.data), links={})
+
+    def test_copies_of_an_entry_have_the_same_digest(self):
+        original = ChangeFeedRecord.objects.get(entry=self.published[0])
+        copy = ChangeFeedRecord.objects.get(entry=self.pulled[0])
+        self.assertEqual(original.digest, copy.digest)
+
+    def test_partners_in_sync_only_compare_the_tree(self):
+        self.pulled.append(
+            factories.ConnectedRedditAccountEntryFactory(
+                published_by=self.partner,
+                reddit_account=self.published[2].reddit_account,
+                actor=self.published[2].actor,
+            )
+        )
+        with mock.patch.object(reconciliation.ChangeFeedEntry, "ingest") as ingest:
+            reconciliation.reconcile_with_partner(self.partner)
+
+        self.client.get.assert_called_once()
+        ingest.assert_not_called()
+
+    def test_only_missing_entries_are_pulled(self):
+        with mock.patch.object(reconciliation.ChangeFeedEntry, "ingest") as ingest:
+            reconciliation.reconcile_with_partner(self.partner)
+
+        entries = ingest.call_args.args[1]
+        self.assertEqual([entry["id"] for entry in entries], [self.published[2].id])
+        self.assertEqual(self.client.get.call_args.kwargs["params"], {"id": str(entries[0]["id"])})
+
+
+__all__ = ("ReconciliationTestCase",)
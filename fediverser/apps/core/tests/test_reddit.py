@@ -0,0 +1,80 @@
+import time
+from unittest import mock
+
+import praw
+
+from fediverser.apps.core import factories
+from fediverser.apps.core.models import reddit
+from fediverser.apps.core.models.reddit import RedditCommunity, RedditSubmission
+
+from .common import BaseTestCase
+
+
+class RedditSubmissionFetchTestCase(BaseTestCase):
+    def setUp(self):
+        self.praw_client = praw.Reddit(client_id="test", client_secret="test", user_agent="test")
+        self.client = mock.Mock()
+        patcher = mock.patch.object(reddit, "make_reddit_client", return_value=self.client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def make_post(self, post_id, subreddit_name, author="someone"):
+        return praw.models.Submission(
+            self.praw_client,
+            _data={
+                "id": post_id,
+                "subreddit": subreddit_name,
+                "author": author,
+                "url": f"https://example.com/{post_id}",
+                "title": f"Post {post_id}",
+                "created_utc": time.time(),
+                "selftext": "",
+                "selftext_html": None,
+                "media_only": False,
+                "approved_at_utc": None,
+                "banned_at_utc": None,
+                "archived": False,
+                "locked": False,
+                "quarantine": False,
+                "removed_by": None,
+                "over_18": False,
+            },
+        )
+
+    def make_subreddit(self, name):
+        return praw.models.Subreddit(
+            self.praw_client,
+            _data={"display_name": name, "description": f"About {name}", "over18": False},
+        )
+
+    def test_submissions_are_fetched_with_one_info_request(self):
+        factories.RedditCommunityFactory(name="Fediverse")
+        posts = [self.make_post(f"p{n}", "fediverse") for n in range(3)]
+        posts.append(self.make_post("p3", "lemmy", author="other"))
+
+        self.client.info.side_effect = [iter(posts), iter([self.make_subreddit("Lemmy")])]
+        RedditSubmission.fetch_many(["p0", "p1", "p2", "p3"])
+
+        fullnames = self.client.info.call_args_list[0].kwargs["fullnames"]
+        self.assertEqual(sorted(fullnames), ["t3_p0", "t3_p1", "t3_p2", "t3_p3"])
+        self.client.info.assert_called_with(subreddits=["lemmy"])
+        self.assertEqual(RedditSubmission.objects.count(), 4)
+        self.assertEqual(
+            RedditSubmission.objects.get(id="p3").subreddit,
+            RedditCommunity.objects.get(name="Lemmy"),
+        )
+
+    def test_known_submissions_are_not_requested(self):
+        factories.RedditSubmissionFactory(id="known")
+        RedditSubmission.fetch_many(["known"])
+
+        self.client.info.assert_not_called()
+
+    def test_unknown_subreddits_are_still_recorded(self):
+        self.client.info.return_value = iter([])
+        subreddits = RedditCommunity.fetch_many(["Banned"])
+
+        self.assertEqual(subreddits["banned"].metadata, {})
+
+
+__all__ = ("RedditSubmissionFetchTestCase",)
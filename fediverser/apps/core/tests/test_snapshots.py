@@ -0,0 +1,186 @@
+import gzip
+import io
+import json
+from unittest import mock
+
+from fediverser.apps.core import factories
+from fediverser.apps.core.models.activitypub import Community, Instance, Person
+from fediverser.apps.core.models.mapping import RedditToCommunityRecommendation
+from fediverser.apps.core.models.network import (
+    ConnectedRedditAccount,
+    ConnectedRedditAccountEntry,
+    Endorsement,
+    RedditToCommunityRecommendationEntry,
+)
+from fediverser.apps.core.models.reddit import RedditCommunity
+from fediverser.apps.core.settings import app_settings
+from fediverser.apps.core.snapshots import InvalidSnapshot, export_snapshot, import_snapshot
+
+from .common import BaseTestCase
+
+
+class SnapshotTestCase(BaseTestCase):
+    def setUp(self):
+        self.portal = factories.FediversedInstanceFactory(portal_url=app_settings.Portal.url)
+        self.partner = factories.FediversedInstanceFactory()
+        self.other = factories.FediversedInstanceFactory()
+        self.recommendation = factories.RedditToCommunityRecommendationFactory()
+        RedditToCommunityRecommendationEntry.objects.create(
+            published_by=self.partner,
+            subreddit=self.recommendation.subreddit,
+            community=self.recommendation.community,
+        )
+        self.connection = factories.ConnectedRedditAccountFactory()
+        self.entry = factories.ConnectedRedditAccountEntryFactory(
+            published_by=self.partner,
+            reddit_account=self.connection.reddit_account,
+            actor=self.connection.actor,
+        )
+        Endorsement.objects.create(endorser=self.partner, endorsed=self.other)
+        Endorsement.objects.create(endorser=self.other, endorsed=self.portal)
+
+    def export_partner_snapshot(self):
+        # Plays the part of the partner exporting its own state
+        snapshot_file = io.BytesIO()
+        with mock.patch.object(app_settings.Portal, "url", self.partner.portal_url):
+            header, _ = export_snapshot(snapshot_file)
+        snapshot_file.seek(0)
+        return header, snapshot_file
+
+    def test_can_bootstrap_from_snapshot(self):
+        header, snapshot_file = self.export_partner_snapshot()
+        self.assertEqual(header["cursor"], self.entry.id)
+
+        Instance.objects.all().delete()
+        RedditCommunity.objects.all().delete()
+        Endorsement.objects.all().delete()
+
+        _, counts = import_snapshot(snapshot_file, partner=self.partner)
+
+        self.assertEqual(counts["recommendation"], 1)
+        self.assertTrue(
+            RedditToCommunityRecommendationEntry.objects.filter(
+                published_by=self.partner,
+                subreddit__name=self.recommendation.subreddit.name,
+                community__url=self.recommendation.community.url,
+            ).exists()
+        )
+        self.assertTrue(
+            ConnectedRedditAccountEntry.objects.filter(
+                published_by=self.partner,
+                reddit_account__username=self.connection.reddit_account.username,
+                actor__url=self.connection.actor.url,
+            ).exists()
+        )
+        self.assertTrue(Community.objects.filter(url=self.recommendation.community.url).exists())
+        self.assertTrue(Person.objects.filter(url=self.connection.actor.url).exists())
+
+        # Nothing is merged before it is reviewed
+        self.assertFalse(RedditToCommunityRecommendation.objects.exists())
+        self.assertFalse(ConnectedRedditAccount.objects.exists())
+
+        self.partner.refresh_from_db()
+        self.assertEqual(self.partner.change_feed_cursor, self.entry.id)
+
+    def test_state_merged_from_other_partners_is_not_exported(self):
+        foreign_recommendation = factories.RedditToCommunityRecommendationFactory()
+        foreign_connection = factories.ConnectedRedditAccountFactory()
+        factories.ConnectedRedditAccountEntryFactory(
+            published_by=self.other,
+            reddit_account=foreign_connection.reddit_account,
+            actor=foreign_connection.actor,
+        )
+
+        _, snapshot_file = self.export_partner_snapshot()
+        with gzip.open(snapshot_file, "rt", encoding="utf-8") as snapshot:
+            records = [json.loads(line) for line in snapshot]
+        exported = {(record["kind"], *record["data"].values()) for record in records[1:]}
+
+        self.assertIn(
+            ("connection", self.connection.reddit_account.username, self.connection.actor.url),
+            exported,
+        )
+        self.assertNotIn(
+            (
+                "recommendation",
+                foreign_recommendation.subreddit.name,
+                foreign_recommendation.community.url,
+            ),
+            exported,
+        )
+        self.assertNotIn(
+            (
+                "connection",
+                foreign_connection.reddit_account.username,
+                foreign_connection.actor.url,
+            ),
+            exported,
+        )
+        self.assertNotIn(("endorsement", self.other.portal_url, self.portal.portal_url), exported)
+
+    def test_only_endorsements_by_the_partner_are_imported(self):
+        _, snapshot_file = self.export_partner_snapshot()
+        Endorsement.objects.all().delete()
+
+        import_snapshot(snapshot_file, partner=self.partner)
+
+        self.assertEqual(
+            list(Endorsement.objects.values_list("endorser", "endorsed")),
+            [(self.partner.id, self.other.id)],
+        )
+        self.assertTrue(self.partner.published_feed_entries.filter(endorsemententry__isnull=False))
+
+    def test_unknown_fields_are_not_imported(self):
+        records = [
+            {
+                "kind": "header",
+                "data": {"version": 1, "portal_url": self.partner.portal_url, "cursor": 0},
+            },
+            {
+                "kind": "instance",
+                "data": {
+                    "id": 1000,
+                    "domain": "new.example.com",
+                    "name": "New",
+                    "description": None,
+                    "over18": False,
+                    "open_registrations": True,
+                    "software": "lemmy",
+                    "status": "closed",
+                },
+            },
+            {
+                "kind": "subreddit",
+                "data": {"id": 1000, "name": "newsub", "description": None, "over18": False},
+            },
+        ]
+        snapshot_file = io.BytesIO(
+            gzip.compress("\n".join(json.dumps(record) for record in records).encode())
+        )
+
+        _, counts = import_snapshot(snapshot_file, partner=self.partner)
+
+        self.assertEqual(counts, {"instance": 1, "subreddit": 1})
+        self.assertNotEqual(Instance.objects.get(domain="new.example.com").id, 1000)
+        self.assertNotEqual(RedditCommunity.objects.get(name="newsub").id, 1000)
+
+    def test_importing_twice_is_harmless(self):
+        _, snapshot_file = self.export_partner_snapshot()
+        import_snapshot(snapshot_file, partner=self.partner)
+        entry_count = self.partner.published_feed_entries.count()
+
+        snapshot_file.seek(0)
+        import_snapshot(snapshot_file, partner=self.partner)
+        self.assertEqual(self.partner.published_feed_entries.count(), entry_count)
+
+    def test_rejects_snapshots_of_other_portals(self):
+        _, snapshot_file = self.export_partner_snapshot()
+        with self.assertRaises(InvalidSnapshot):
+            import_snapshot(snapshot_file, partner=self.other)
+
+    def test_rejects_files_without_header(self):
+        with self.assertRaises(InvalidSnapshot):
+            import_snapshot(io.BytesIO(gzip.compress(b"")), partner=self.partner)
+
+
+__all__ = ("SnapshotTestCase",)
@@ -0,0 +1,148 @@
+import datetime
+from unittest import mock
+
+from django.core.cache import cache
+from django.utils import timezone
+
+from fediverser.apps.core import factories, tasks
+from fediverser.apps.core.models.common import INSTANCE_STATUSES, DomainHealth
+from fediverser.apps.core.models.mapping import InstanceAnnotation
+from fediverser.apps.core.models.network import SyncJob
+
+from .common import BaseTestCase
+
+
+class TaskEnqueueTestCase(BaseTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_identical_calls_are_scheduled_only_once(self):
+        with mock.patch.object(tasks.fetch_subreddit, "delay") as delay:
+            tasks.enqueue(tasks.fetch_subreddit, "fediverse")
+            tasks.enqueue(tasks.fetch_subreddit, "fediverse")
+
+        delay.assert_called_once_with("fediverse")
+
+    def test_calls_with_different_arguments_are_scheduled(self):
+        with mock.patch.object(tasks.fetch_subreddit, "delay") as delay:
+            tasks.enqueue(tasks.fetch_subreddit, "fediverse")
+            tasks.enqueue(tasks.fetch_subreddit, "lemmy")
+
+        self.assertEqual(delay.call_count, 2)
+
+
+class ChangeFeedSyncSupervisorTestCase(BaseTestCase):
+    def setUp(self):
+        cache.clear()
+        self.partner = factories.FediversedInstanceFactory()
+        self.failing_partner = factories.FediversedInstanceFactory(sync_failures=3)
+        self.make_job(self.partner, datetime.timedelta(hours=2), succeeded=True)
+        self.make_job(self.failing_partner, datetime.timedelta(minutes=2), succeeded=False)
+
+    def make_job(self, partner, age, succeeded):
+        job = SyncJob.objects.create(instance=partner, succeeded=succeeded, caught_up=succeeded)
+        SyncJob.objects.filter(id=job.id).update(run_on=timezone.now() - age)
+
+    def test_each_due_partner_is_synced_by_its_own_task(self):
+        unsynced = factories.FediversedInstanceFactory()
+        with mock.patch.object(tasks.sync_partner_change_feed, "delay") as delay:
+            tasks.sync_change_feeds()
+
+        synced = sorted(call.args[0] for call in delay.call_args_list)
+        self.assertEqual(synced, sorted([self.partner.id, unsynced.id]))
+
+    def test_failing_partners_are_retried_after_backoff(self):
+        self.failing_partner.sync_failures = 1
+        self.failing_partner.save()
+        with mock.patch.object(tasks.sync_partner_change_feed, "delay") as delay:
+            tasks.sync_change_feeds()
+
+        synced = [call.args[0] for call in delay.call_args_list]
+        self.assertIn(self.failing_partner.id, synced)
+
+    def test_lag_is_measured_from_last_successful_sync(self):
+        self.assertGreaterEqual(self.partner.get_sync_lag(), datetime.timedelta(hours=2))
+        self.assertIsNone(self.failing_partner.get_sync_lag())
+
+    def test_partner_sync_is_continued_when_budget_runs_out(self):
+        self.partner.change_feed_cursor = 10
+        self.partner.save()
+        job = SyncJob(instance=self.partner, succeeded=True, caught_up=False)
+        with (
+            mock.patch.object(
+                tasks.FediversedInstance, "sync_change_feeds", return_value=job
+            ) as sync,
+            mock.patch.object(tasks.sync_partner_change_feed, "delay") as delay,
+        ):
+            tasks.sync_partner_change_feed(self.partner.id)
+
+        self.assertIsNotNone(sync.call_args.kwargs["since"])
+        self.assertIsNotNone(sync.call_args.kwargs["max_pages"])
+        delay.assert_called_once_with(self.partner.id)
+
+    def test_runs_that_did_not_catch_up_are_not_pulled_from(self):
+        self.make_job(self.partner, datetime.timedelta(minutes=5), succeeded=True)
+        SyncJob.objects.filter(instance=self.partner).update(caught_up=False)
+        job = SyncJob(instance=self.partner, succeeded=True, caught_up=True)
+        with mock.patch.object(
+            tasks.FediversedInstance, "sync_change_feeds", return_value=job
+        ) as sync:
+            tasks.sync_partner_change_feed(self.partner.id)
+
+        # Without a cursor, there is no budget to cut the run short
+        self.assertEqual(sync.call_args.kwargs, {"since": None})
+
+    def test_partner_is_not_synced_twice_at_once(self):
+        job = SyncJob(instance=self.partner, succeeded=True, caught_up=True)
+        with mock.patch.object(
+            tasks.FediversedInstance, "sync_change_feeds", return_value=job
+        ) as sync:
+            cache.add(f"fediverser:tasks:sync_partner_change_feed:{self.partner.id}", "busy")
+            tasks.sync_partner_change_feed(self.partner.id)
+            sync.assert_not_called()
+
+            cache.clear()
+            tasks.sync_partner_change_feed(self.partner.id)
+            tasks.sync_partner_change_feed(self.partner.id)
+            self.assertEqual(sync.call_count, 2)
+
+
+class UnreachableInstancesTestCase(BaseTestCase):
+    def setUp(self):
+        long_ago = timezone.now() - datetime.timedelta(days=60)
+        self.down = factories.InstanceFactory()
+        self.locked = factories.InstanceFactory()
+        self.flaky = factories.InstanceFactory()
+        InstanceAnnotation.objects.create(instance=self.locked, locked=True, notes="")
+        for instance in (self.down, self.locked):
+            DomainHealth.objects.create(domain=instance.domain, failures=10, down_since=long_ago)
+        DomainHealth.objects.create(
+            domain=self.flaky.domain, failures=10, down_since=timezone.now()
+        )
+
+    def test_instances_down_for_long_are_closed(self):
+        tasks.flag_unreachable_instances()
+
+        self.down.refresh_from_db()
+        self.assertEqual(self.down.status.status, INSTANCE_STATUSES.closed)
+        self.assertEqual(self.down.annotation.status, INSTANCE_STATUSES.closed)
+        self.locked.refresh_from_db()
+        self.assertEqual(self.locked.annotation.status, INSTANCE_STATUSES.active)
+        self.assertFalse(InstanceAnnotation.objects.filter(instance=self.flaky).exists())
+
+    def test_recovered_instances_are_reopened(self):
+        tasks.flag_unreachable_instances()
+        DomainHealth.objects.filter(domain=self.down.domain).update(failures=0, down_since=None)
+        tasks.flag_unreachable_instances()
+
+        self.down.refresh_from_db()
+        self.assertEqual(self.down.status.status, INSTANCE_STATUSES.active)
+        self.assertEqual(self.down.annotation.status, INSTANCE_STATUSES.active)
+        self.assertFalse(DomainHealth.objects.filter(domain=self.down.domain).exists())
+
+
+__all__ = (
+    "TaskEnqueueTestCase",
+    "ChangeFeedSyncSupervisorTestCase",
+    "UnreachableInstancesTestCase",
+)
@@ -150,10 +150,23 @@ urlpatterns = [
         views.ChangeFeedEntryListView.as_view(),
         name="changefeedentry-list",
     ),
+    path(
+        "api/changes/subscriptions",
+        views.ChangeFeedSubscriptionView.as_view(),
+        name="changefeedsubscription-list",
+    ),
+    path("api/changes/push", views.ChangeFeedPushView.as_view(), name="changefeed-push"),
+    path("api/changes/digest", views.ChangeFeedDigestView.as_view(), name="changefeed-digest"),
+    path(
+        "api/changes/digest/<str:prefix>",
+        views.ChangeFeedDigestBucketView.as_view(),
+        name="changefeed-digest-bucket",
+    ),
     path(
         "api/changes/<int:pk>",
         views.ChangeFeedEntryDetailView.as_view(),
         name="changefeedentry-detail",
     ),
+    path("api/snapshot", views.SnapshotView.as_view(), name="snapshot-detail"),
     path("feed/changes", views.ChangeFeed(), name="changefeed-feed"),
 ]
@@ -1,6 +1,7 @@
 from django.contrib.auth.decorators import user_passes_test
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.db.models import F, Q, Value
+from django.db.models import Case, F, Q, Value, When
+from django.db.models.functions import Coalesce
 from django.http import Http404, HttpResponseRedirect
 from django.shortcuts import get_object_or_404
 from django.urls import reverse, reverse_lazy
@@ -16,6 +17,7 @@ from ..filters import (
     InstanceRecommendationFilter,
     RedditCommunityFilter,
 )
+from ..settings import app_settings
 from .common import CreateView, DetailView, ListView, PostActionView, build_breadcrumbs
 
 
@@ -121,7 +123,7 @@ class SubredditDetailView(DetailView):
         try:
             return self.model.objects.get(name__iexact=self.kwargs["name"])
         except self.model.DoesNotExist:
-            tasks.fetch_subreddit.delay(self.kwargs["name"])
+            tasks.enqueue(tasks.fetch_subreddit, self.kwargs["name"])
             raise Http404("Subreddit not found")
 
 
@@ -418,8 +420,14 @@ class InstanceRecommendationsListView(generics.ListAPIView):
         open_registrations_q = Q(open_registrations=True)
         can_register_via_api_q = application_not_required_q & open_registrations_q
         reddit_login_q = Q(fediverser_configuration__allows_reddit_signup=True)
+        # Instances connected to portals that we trust are suggested first.
+        # Our own portal always gets the highest score, so it is left out.
+        trust = Case(
+            When(fediverser_configuration__portal_url=app_settings.Portal.url, then=Value(0.0)),
+            default=Coalesce("fediverser_configuration__trust_score__score", Value(0.0)),
+        )
         return models.Instance.objects.filter(can_register_via_api_q | reddit_login_q).annotate(
-            score=Value(1.0)
+            score=Value(1.0) + trust
         )
 
     def filter_queryset(self, queryset, *args, **kw):
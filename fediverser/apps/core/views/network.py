@@ -1,14 +1,34 @@
+import hashlib
+
 from django.contrib.syndication.views import Feed
-from django.http import Http404
+from django.core.cache import cache
+from django.http import FileResponse, Http404, HttpResponse
 from django.urls import reverse
+from django.utils.decorators import method_decorator
 from django.utils.feedgenerator import Atom1Feed
-from rest_framework import generics
+from django.views.decorators.http import condition
+from django.views.decorators.vary import vary_on_headers
+from rest_framework import generics, status, views
+from rest_framework.exceptions import ValidationError
 from rest_framework.permissions import AllowAny
+from rest_framework.response import Response
+from rest_framework.throttling import SimpleRateThrottle
 
-from fediverser.apps.core.models import ChangeFeedEntry, FediversedInstance
+from fediverser.apps.core.models import ChangeFeedRecord, FediversedInstance
+from fediverser.apps.core.models.push import (
+    PORTAL_HEADER,
+    PREVIOUS_ID_HEADER,
+    SIGNATURE_HEADER,
+    TIMESTAMP_HEADER,
+    ChangeFeedSubscription,
+    InvalidSignature,
+    verify_signature,
+)
 
-from .. import serializers
+from .. import serializers, tasks
 from ..filters import ChangeFeedFilter, FediversedInstanceFilter
+from ..pagination import KeysetPagination
+from ..reconciliation import get_bucket, get_local_records, get_local_tree
 from ..settings import app_settings
 
 
@@ -29,32 +49,181 @@ class FediversedInstanceListView(generics.ListCreateAPIView):
         return FediversedInstance.objects.all()
 
 
+RESPONSE_CACHE_KEY = "fediverser:changefeed:response"
+
+
+def get_change_feed_etag(request, *args, **kw):
+    # Representations differ by content type, so strong tags need to as well
+    accept = hashlib.sha1(request.headers.get("Accept", "").encode()).hexdigest()[:8]
+    return f"{ChangeFeedRecord.get_version(local=True)}-{accept}"
+
+
+@method_decorator(vary_on_headers("Accept"), name="dispatch")
+@method_decorator(condition(etag_func=get_change_feed_etag), name="dispatch")
 class ChangeFeedEntryListView(generics.ListAPIView):
     permission_classes = (AllowAny,)
-    serializer_class = serializers.PolymorphicChangeFeedEntrySerializer
+    serializer_class = serializers.ChangeFeedRecordSerializer
     filterset_class = ChangeFeedFilter
 
+    @property
+    def paginator(self):
+        if not hasattr(self, "_paginator"):
+            uses_cursor = KeysetPagination.cursor_query_param in self.request.query_params
+            self._paginator = KeysetPagination() if uses_cursor else self.pagination_class()
+        return self._paginator
+
     def get_queryset(self):
-        return (
-            ChangeFeedEntry.objects.filter(published_by__portal_url=app_settings.Portal.url)
-            .order_by("-created")
-            .select_subclasses()
-        )
+        records = ChangeFeedRecord.objects.filter(published_by=FediversedInstance.current())
+        return records.order_by("-created")
+
+    def list(self, request, *args, **kw):
+        # The etag already tells the version of the feed, so cached pages
+        # never need to be invalidated. They just stop being requested.
+        # Links in the response are absolute, so the host is part of the key
+        url = hashlib.sha1(request.build_absolute_uri().encode()).hexdigest()
+        cache_key = f"{RESPONSE_CACHE_KEY}:{get_change_feed_etag(request)}:{url}"
+        cached = cache.get(cache_key)
+        if cached is None:
+            response = super().list(request, *args, **kw)
+            headers = {"Link": response["Link"]} if response.has_header("Link") else {}
+            cached = (response.data, headers)
+            cache.set(cache_key, cached, timeout=app_settings.Federation.change_feed_cache_ttl)
+
+        data, headers = cached
+        return Response(data, headers=headers)
 
 
 class ChangeFeedEntryDetailView(generics.RetrieveAPIView):
     permission_classes = (AllowAny,)
-    serializer_class = serializers.PolymorphicChangeFeedEntrySerializer
+    serializer_class = serializers.ChangeFeedRecordSerializer
 
     def get_object(self):
         try:
-            self.object = ChangeFeedEntry.objects.filter(
-                published_by__portal_url=app_settings.Portal.url
-            ).get_subclass(id=self.kwargs["pk"])
+            self.object = ChangeFeedRecord.objects.get(
+                published_by=FediversedInstance.current(), pk=self.kwargs["pk"]
+            )
             return self.object
-        except ChangeFeedEntry.DoesNotExist:
+        except ChangeFeedRecord.DoesNotExist:
+            raise Http404
+
+
+class ChangeFeedSubscriptionThrottle(SimpleRateThrottle):
+    # Each subscription makes us send a challenge to the subscriber, so
+    # requests are limited for each portal that they claim to come from.
+    scope = "changefeed-subscription"
+
+    def get_rate(self):
+        return app_settings.Federation.subscription_rate
+
+    def get_cache_key(self, request, view):
+        portal_url = request.data.get("portal_url") if hasattr(request.data, "get") else None
+        ident = portal_url or self.get_ident(request)
+        return self.cache_format % {"scope": self.scope, "ident": ident}
+
+
+class ChangeFeedSubscriptionView(views.APIView):
+    permission_classes = (AllowAny,)
+    authentication_classes = ()
+    throttle_classes = (ChangeFeedSubscriptionThrottle,)
+
+    def post(self, request, *args, **kw):
+        serializer = serializers.ChangeFeedSubscriptionSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        subscriber = FediversedInstance.partners.filter(
+            portal_url=serializer.validated_data["portal_url"]
+        ).first()
+        if subscriber is None:
+            raise ValidationError("Only registered portals can subscribe")
+
+        try:
+            ChangeFeedSubscription.make(
+                subscriber,
+                serializer.validated_data["callback_url"],
+                serializer.validated_data["secret"],
+            )
+        except ValueError as exc:
+            raise ValidationError(str(exc))
+
+        return Response(status=status.HTTP_201_CREATED)
+
+
+class ChangeFeedPushView(views.APIView):
+    permission_classes = (AllowAny,)
+    authentication_classes = ()
+
+    def post(self, request, *args, **kw):
+        body = request.body
+        publisher = FediversedInstance.partners.filter(
+            portal_url=request.headers.get(PORTAL_HEADER), push_secret__isnull=False
+        ).first()
+        if publisher is None:
+            raise Http404
+
+        previous_id = request.headers.get(PREVIOUS_ID_HEADER)
+        if previous_id is not None and not previous_id.isdigit():
+            raise ValidationError(f"Invalid {PREVIOUS_ID_HEADER} header")
+
+        try:
+            verify_signature(
+                publisher.push_secret,
+                request.headers.get(TIMESTAMP_HEADER),
+                body,
+                request.headers.get(SIGNATURE_HEADER),
+                previous_id=previous_id,
+            )
+        except InvalidSignature as exc:
+            return Response({"error": str(exc)}, status=status.HTTP_403_FORBIDDEN)
+
+        payload = request.data
+        if isinstance(payload, dict) and "challenge" in payload:
+            return Response({"challenge": payload["challenge"]})
+
+        if not isinstance(payload, list):
+            raise ValidationError("Expected a list of change feed entries")
+
+        tasks.ingest_pushed_change_feed_entries.delay(
+            publisher.id, payload, previous_id=previous_id and int(previous_id)
+        )
+        return Response(status=status.HTTP_202_ACCEPTED)
+
+
+class SnapshotView(views.APIView):
+    permission_classes = (AllowAny,)
+
+    def get(self, request, *args, **kw):
+        try:
+            snapshot_file = open(app_settings.Federation.snapshot_path, "rb")
+        except FileNotFoundError:
+            raise Http404
+
+        return FileResponse(
+            snapshot_file,
+            as_attachment=True,
+            filename="fediverser-snapshot.ndjson.gz",
+            content_type="application/gzip",
+        )
+
+
+class ChangeFeedDigestView(views.APIView):
+    permission_classes = (AllowAny,)
+
+    def get(self, request, *args, **kw):
+        return Response(get_local_tree())
+
+
+class ChangeFeedDigestBucketView(views.APIView):
+    permission_classes = (AllowAny,)
+
+    def get(self, request, *args, **kw):
+        prefix = self.kwargs["prefix"]
+        digits = app_settings.Federation.reconciliation_bucket_digits
+        if len(prefix) != digits or not set(prefix) <= set("0123456789abcdef"):
             raise Http404
 
+        leaves = get_bucket(get_local_records(), prefix)
+        return Response({"prefix": prefix, "leaves": leaves})
+
 
 class ChangeFeed(Feed):
     feed_type = Atom1Feed
@@ -62,8 +231,25 @@ class ChangeFeed(Feed):
     link = "/changes/feed"
     description = "Stream of changes done to internal dataset"
 
+    def __call__(self, request, *args, **kw):
+        version = ChangeFeedRecord.get_version()
+        cache_key = f"{RESPONSE_CACHE_KEY}:atom:{version}:{request.get_host()}"
+
+        @condition(etag_func=lambda *args, **kw: version)
+        def view(request, *args, **kw):
+            cached = cache.get(cache_key)
+            if cached is None:
+                response = super(ChangeFeed, self).__call__(request, *args, **kw)
+                cached = (response.content, response["Content-Type"])
+                cache.set(cache_key, cached, timeout=app_settings.Federation.change_feed_cache_ttl)
+
+            content, content_type = cached
+            return HttpResponse(content, content_type=content_type)
+
+        return view(request, *args, **kw)
+
     def items(self):
-        return ChangeFeedEntry.objects.select_subclasses().order_by("-modified")[:100]
+        return ChangeFeedRecord.objects.order_by("-created")[:100]
 
     def item_title(self, item):
         return item.description
@@ -83,5 +269,10 @@ __all__ = (
     "FediversedInstanceListView",
     "ChangeFeedEntryListView",
     "ChangeFeedEntryDetailView",
+    "ChangeFeedSubscriptionView",
+    "ChangeFeedPushView",
+    "SnapshotView",
+    "ChangeFeedDigestView",
+    "ChangeFeedDigestBucketView",
     "ChangeFeed",
 )
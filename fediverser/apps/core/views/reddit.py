@@ -1,3 +1,4 @@
+from django.http import Http404
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import filters, generics
@@ -59,11 +60,21 @@ class RedditSubmissionView(DetailView):
 
     @property
     def page_title(self):
-        submission = self.get_object()
-        return submission.title
+        return self.object.title
 
     def get_object(self):
-        return get_object_or_404(self.model, id=self.kwargs["submission_id"])
+        submission_id = self.kwargs["submission_id"]
+        submission = self.model.objects.filter(id=submission_id).first()
+
+        # Archived submissions are either gone or kept as stubs without text
+        if submission is None:
+            submission = models.RedditArchive.find_submission(submission_id)
+        else:
+            submission = models.RedditArchive.restore_submission(submission)
+
+        if submission is None:
+            raise Http404("Submission not found")
+        return submission
 
 
 __all__ = (
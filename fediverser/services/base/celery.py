@@ -16,10 +16,50 @@ class FediverserCeleryConfig(object):
             "task": "fediverser.apps.core.tasks.fetch_feeds",
             "schedule": crontab(),
         },
+        "make_subreddit_feeds": {
+            "task": "fediverser.apps.core.tasks.make_subreddit_feeds",
+            "schedule": crontab(minute=15, hour=0),
+        },
         "clear_old_feed_entries": {
             "task": "fediverser.apps.core.tasks.clear_old_feed_entries",
             "schedule": crontab(minute=0, hour=0),
         },
+        "archive_reddit_content": {
+            "task": "fediverser.apps.core.tasks.archive_reddit_content",
+            "schedule": crontab(minute=30, hour=1),
+        },
+        "crawl_fediverse_instances": {
+            "task": "fediverser.apps.core.tasks.crawl_fediverse_instances",
+            "schedule": crontab(minute=0, hour=4),
+        },
+        "flush_domain_health": {
+            "task": "fediverser.apps.core.tasks.flush_domain_health",
+            "schedule": crontab(),
+        },
+        "flag_unreachable_instances": {
+            "task": "fediverser.apps.core.tasks.flag_unreachable_instances",
+            "schedule": crontab(minute=30, hour=4),
+        },
+        "export_snapshot": {
+            "task": "fediverser.apps.core.tasks.export_snapshot",
+            "schedule": crontab(minute=45, hour=2),
+        },
+        "subscribe_to_partners": {
+            "task": "fediverser.apps.core.tasks.subscribe_to_partners",
+            "schedule": crontab(minute=50, hour=2),
+        },
+        "reconcile_change_feeds": {
+            "task": "fediverser.apps.core.tasks.reconcile_change_feeds",
+            "schedule": crontab(minute=15, hour=3),
+        },
+        "update_trust_scores": {
+            "task": "fediverser.apps.core.tasks.update_trust_scores",
+            "schedule": crontab(minute=30, hour=3),
+        },
+        "push_change_feed_entries": {
+            "task": "fediverser.apps.core.tasks.push_change_feed_entries",
+            "schedule": crontab(),
+        },
         "sync_change_feeds": {
             "task": "fediverser.apps.core.tasks.sync_change_feeds",
             "schedule": crontab(),